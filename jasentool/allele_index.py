@@ -0,0 +1,175 @@
+"""Module for indexing downloaded cgMLST scheme alleles by sequence hash"""
+
+import os
+import gzip
+import hashlib
+import sqlite3
+from jasentool.utils import Utils
+from jasentool.log import get_logger
+
+logger = get_logger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS loci (
+    locus TEXT PRIMARY KEY,
+    fname TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    alleles INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS alleles (
+    hash BLOB NOT NULL,
+    locus TEXT NOT NULL,
+    allele TEXT NOT NULL,
+    PRIMARY KEY (hash, locus, allele)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS alleles_locus ON alleles (locus);
+CREATE TABLE IF NOT EXISTS anchors (
+    kmer TEXT NOT NULL,
+    locus TEXT NOT NULL,
+    side INTEGER NOT NULL,
+    PRIMARY KEY (kmer, locus, side)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS anchors_locus ON anchors (locus);
+CREATE TABLE IF NOT EXISTS lengths (
+    locus TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    PRIMARY KEY (locus, length)
+) WITHOUT ROWID;
+"""
+SCHEMA_VERSION = 2
+TABLES = ("loci", "alleles", "anchors", "lengths")
+ANCHOR_SIZE = 20
+START, END = 0, 1
+FASTA_EXTENSIONS = (".fasta", ".fasta.gz", ".fa", ".fa.gz", ".fna", ".fna.gz")
+MMAP_SIZE = 1 << 30
+
+
+def sequence_hash(seq):
+    """Return the SHA-1 digest of the upper-cased sequence"""
+    return hashlib.sha1(seq.upper().encode()).digest()
+
+
+class AlleleIndex:
+    """Class mapping allele sequence hashes to (locus, allele id) in a local SQLite database"""
+    def __init__(self, db_fpath, readonly=False):
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{os.path.abspath(db_fpath)}?mode=ro", uri=True,
+                                        check_same_thread=False)
+        else:
+            self.conn = Utils.connect_db(db_fpath, SCHEMA, TABLES, SCHEMA_VERSION)
+        self.conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def locus_name(fname):
+        """Return the locus name of a scheme FASTA filename, or None for other files"""
+        for ext in FASTA_EXTENSIONS:
+            if fname.endswith(ext):
+                return fname[:-len(ext)]
+        return None
+
+    @staticmethod
+    def allele_id(locus, header):
+        """Return the allele id of a FASTA header such as <locus>_<id>"""
+        name = header.split()[0]
+        return name[len(locus) + 1:] if name.startswith(f"{locus}_") else name
+
+    @staticmethod
+    def iter_fasta(fasta_fpath):
+        """Yield (header, sequence) from a plain or gzip-compressed FASTA file"""
+        opener = gzip.open if fasta_fpath.endswith(".gz") else open
+        with opener(fasta_fpath, "rt", encoding="utf-8") as fin:
+            header = None
+            seq = []
+            for line in fin:
+                if line.startswith(">"):
+                    if header is not None:
+                        yield header, "".join(seq)
+                    header = line[1:].strip()
+                    seq = []
+                elif header is not None:
+                    seq.append(line.strip())
+            if header is not None:
+                yield header, "".join(seq)
+
+    def _allele_rows(self, locus, fasta_fpath, anchors, lengths):
+        """Yield allele rows of a locus FASTA, collecting its anchor k-mers and allele lengths"""
+        for header, seq in self.iter_fasta(fasta_fpath):
+            seq = seq.upper()
+            lengths.add(len(seq))
+            if len(seq) >= ANCHOR_SIZE:
+                anchors.add((seq[:ANCHOR_SIZE], locus, START))
+                anchors.add((seq[-ANCHOR_SIZE:], locus, END))
+            yield sequence_hash(seq), locus, self.allele_id(locus, header)
+
+    def build(self, scheme_dir):
+        """Index every locus FASTA in scheme_dir, re-reading only loci whose file changed"""
+        stored = {locus: (fname, signature) for locus, fname, signature
+                  in self.conn.execute("SELECT locus, fname, signature FROM loci")}
+        seen = set()
+        indexed = 0
+        for entry in sorted(os.scandir(scheme_dir), key=lambda entry: entry.name):
+            locus = self.locus_name(entry.name)
+            if locus is None or not entry.is_file():
+                continue
+            seen.add(locus)
+            stat = entry.stat()
+            signature = f"{stat.st_size}:{stat.st_mtime_ns}"
+            if stored.get(locus) == (entry.name, signature):
+                continue
+            anchors = set()
+            lengths = set()
+            with self.conn:
+                for table in ("alleles", "anchors", "lengths"):
+                    self.conn.execute(f"DELETE FROM {table} WHERE locus = ?", (locus,))
+                self.conn.executemany("INSERT OR IGNORE INTO alleles VALUES (?, ?, ?)",
+                                      self._allele_rows(locus, entry.path, anchors, lengths))
+                self.conn.executemany("INSERT INTO anchors VALUES (?, ?, ?)", anchors)
+                self.conn.executemany("INSERT INTO lengths VALUES (?, ?)", ((locus, length) for length in lengths))
+                n_alleles = self.conn.execute("SELECT COUNT(*) FROM alleles WHERE locus = ?", (locus,)).fetchone()[0]
+                self.conn.execute("INSERT OR REPLACE INTO loci VALUES (?, ?, ?, ?)",
+                                  (locus, entry.name, signature, n_alleles))
+            indexed += 1
+        removed = [(locus,) for locus in stored.keys() - seen]
+        with self.conn:
+            for table in TABLES:
+                self.conn.executemany(f"DELETE FROM {table} WHERE locus = ?", removed)
+        logger.info("Allele index: %d loci indexed, %d unchanged, %d removed",
+                    indexed, len(seen) - indexed, len(removed))
+
+    def loci(self):
+        """Return the indexed locus names"""
+        return [locus for (locus,) in self.conn.execute("SELECT locus FROM loci ORDER BY locus")]
+
+    def anchors(self):
+        """Return {kmer: [(locus, side)]} of the allele start and end k-mers"""
+        anchors = {}
+        for kmer, locus, side in self.conn.execute("SELECT kmer, locus, side FROM anchors"):
+            anchors.setdefault(kmer, []).append((locus, side))
+        return anchors
+
+    def lengths(self):
+        """Return {locus: sorted allele lengths}"""
+        lengths = {}
+        for locus, length in self.conn.execute("SELECT locus, length FROM lengths ORDER BY locus, length"):
+            lengths.setdefault(locus, []).append(length)
+        return lengths
+
+    def lookup(self, seq):
+        """Return [(locus, allele id)] of alleles with the given sequence"""
+        return list(self.conn.execute("SELECT locus, allele FROM alleles WHERE hash = ?", (sequence_hash(seq),)))
+
+    def lookup_locus(self, locus, seq):
+        """Return the allele id of seq at locus, or None when it is not a known allele"""
+        row = self.conn.execute("SELECT allele FROM alleles WHERE hash = ? AND locus = ?",
+                                (sequence_hash(seq), locus)).fetchone()
+        return row[0] if row else None
@@ -15,15 +15,22 @@ Version 20250225 (ported to jasentool class interface)
 """
 
 import configparser
+import gzip
+import hashlib
 import json
 import os
 import re
 import stat
 import sys
+import threading
+import time
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
 from pathlib import Path
 from urllib.parse import parse_qs
 
+from requests.adapters import HTTPAdapter
 from rauth import OAuth1Service, OAuth1Session
 
 from jasentool.log import get_logger
@@ -38,6 +45,13 @@ BASE_API = {
     "PubMLST": "https://rest.pubmlst.org",
     "Pasteur": "https://bigsdb.pasteur.fr/api",
 }
+RATE_LIMIT_RETRIES = 5
+CHUNK_SIZE = 1024 * 1024
+MANIFEST_FNAME = "manifest.jsonl"
+
+
+class BIGSdbError(Exception):
+    """Raised when a BIGSdb request fails."""
 
 
 class BIGSdb:
@@ -56,6 +70,15 @@ class BIGSdb:
         self.force = options.force
         self.cron = options.cron
         self.method = options.method
+        self.sync = getattr(options, "sync", False)
+        self.workers = max(1, getattr(options, "workers", 4))
+        self.gzip = getattr(options, "gzip", False)
+        self._manifest = {}
+        self._client_credentials = None
+        self._session_token = None
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._token_lock = threading.Lock()
 
     def run(self):
         """Entry point: validate args, authenticate, then download or call route."""
@@ -66,12 +89,19 @@ class BIGSdb:
             if not access_token or not access_secret:
                 raise PermissionError("Cannot get new access token.")
         (token, secret) = self._retrieve_token("session")
-        if not token or not secret:
-            (token, secret) = self._get_new_session_token()
-        if self.download_scheme:
-            self._download_scheme_alleles(self.url, token, secret, self.output_dir)
-        elif not self.setup:
-            self._get_route(self.url, token, secret)
+        try:
+            if not token or not secret:
+                (token, secret) = self._get_new_session_token()
+            self._session_token = (token, secret)
+            if self.download_scheme and self.sync:
+                self._sync_scheme_alleles(self.url, token, secret, self.output_dir)
+            elif self.download_scheme:
+                self._download_scheme_alleles(self.url, token, secret, self.output_dir)
+            elif not self.setup:
+                self._get_route(self.url, token, secret)
+        except BIGSdbError as exc:
+            logger.error("%s", exc)
+            sys.exit(1)
 
     def _check_required_args(self):
         if not self.key_name:
@@ -167,7 +197,7 @@ class BIGSdb:
                 config.remove_section(self.key_name)
                 with open(access_path, "w", encoding="utf-8") as configfile:
                     config.write(configfile)
-        sys.exit(1)
+        raise BIGSdbError(f"Failed to get new session token. {msg}")
 
     def _get_service(self):
         (client_key, client_secret) = self._get_client_credentials()
@@ -236,6 +266,12 @@ class BIGSdb:
         sys.exit(1)
 
     def _get_client_credentials(self):
+        with self._lock:
+            if self._client_credentials is None:
+                self._client_credentials = self._read_client_credentials()
+            return self._client_credentials
+
+    def _read_client_credentials(self):
         config = configparser.ConfigParser(interpolation=None)
         file_path = Path(f"{self.token_dir}/client_credentials")
         client_id = None
@@ -293,39 +329,86 @@ class BIGSdb:
                 processed[key] = val[0]
         return trimmed_url, processed
 
-    def _get_route(self, url, token, secret, output_file=None):
+    def _get_session(self, token, secret):
+        """Return the keep-alive session signing requests with a session token, creating it once."""
         (client_key, client_secret) = self._get_client_credentials()
-        session = OAuth1Session(
-            client_key, client_secret, access_token=token, access_token_secret=secret
-        )
+        with self._lock:
+            session = self._sessions.get((token, secret))
+            if session is None:
+                session = OAuth1Session(
+                    client_key, client_secret, access_token=token, access_token_secret=secret
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[(token, secret)] = session
+            return session
+
+    def _refresh_session_token(self, stale_token):
+        """Request a new session token once, however many workers found stale_token rejected."""
+        with self._token_lock:
+            if self._session_token is None or self._session_token[0] == stale_token:
+                sys.stderr.write("Invalid session token, requesting new one...\n")
+                self._session_token = self._get_new_session_token()
+            return self._session_token
+
+    def _request(self, session, url, params, stream=False):
+        """Send a request, waiting and retrying while the server rate limits (429)."""
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            if self.method == "GET":
+                resp = session.get(
+                    url,
+                    params=params,
+                    headers={"User-Agent": "BIGSdb downloader"},
+                    stream=stream,
+                )
+            else:
+                resp = session.post(
+                    url,
+                    params=params,
+                    data="{}",
+                    headers={
+                        "Content-Type": "application/json",
+                        "User-Agent": "BIGSdb downloader",
+                    },
+                    header_auth=True,
+                    stream=stream,
+                )
+            if resp.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+                return resp
+            retry_after = resp.headers.get("Retry-After", "")
+            wait_time = int(retry_after) if retry_after.isdigit() else 2 ** attempt
+            logger.warning("Rate limited (429) on %s. Retrying in %d seconds...", url, wait_time)
+            resp.close()
+            time.sleep(wait_time)
+        return resp
+
+    def _fetch(self, url, token, secret, accept=(200, 201), stream=False):
+        """Return the response to url, refreshing the session token on 401 and raising on errors."""
+        session = self._get_session(token, secret)
         trimmed_url, request_params = self._trim_url_args(url)
-        if self.method == "GET":
-            resp = session.get(
-                trimmed_url,
-                params=request_params,
-                headers={"User-Agent": "BIGSdb downloader"},
-            )
-        else:
-            resp = session.post(
-                trimmed_url,
-                params=request_params,
-                data="{}",
-                headers={
-                    "Content-Type": "application/json",
-                    "User-Agent": "BIGSdb downloader",
-                },
-                header_auth=True,
-            )
+        resp = self._request(session, trimmed_url, request_params, stream=stream)
+        if resp.status_code in accept:
+            return resp
+        if resp.status_code == 400:
+            raise BIGSdbError(f"Bad request - {resp.json().get('message', '')}")
+        if resp.status_code == 401:
+            msg = resp.json().get("message", "")
+            if re.search("unauthorized", msg):
+                raise BIGSdbError("Access denied - client is unauthorized")
+            sys.stderr.write(msg + "\n")
+            (token, secret) = self._refresh_session_token(token)
+            return self._fetch(url, token, secret, accept, stream)
+        raise BIGSdbError(f"Error {resp.status_code} from {trimmed_url}: {resp.text}")
 
+    def _get_route(self, url, token, secret, output_file=None):
         out = output_file or self.output_file
+        resp = self._fetch(url, token, secret, stream=bool(out))
         if resp.status_code in (200, 201):
             if out:
                 try:
-                    with open(out, "w", encoding="utf-8") as file_handle:
-                        if re.search("json", resp.headers.get("content-type", ""), flags=0):
-                            file_handle.write(json.dumps(resp.json()))
-                        else:
-                            file_handle.write(resp.text)
+                    with resp:
+                        self._write_chunks(resp.iter_content(CHUNK_SIZE), out)
                 except IOError as exc:
                     sys.stderr.write(f"Error writing to file: {exc}\n")
             else:
@@ -333,28 +416,228 @@ class BIGSdb:
                     print(json.dumps(resp.json()))
                 else:
                     print(resp.text)
-        elif resp.status_code == 400:
-            sys.stderr.write("Bad request - " + resp.json().get("message", "") + "\n")
-            sys.exit(1)
-        elif resp.status_code == 401:
-            msg = resp.json().get("message", "")
-            if re.search("unauthorized", msg):
-                sys.stderr.write("Access denied - client is unauthorized\n")
-                sys.exit(1)
-            sys.stderr.write(msg + "\n")
-            sys.stderr.write("Invalid session token, requesting new one...\n")
-            (token, secret) = self._get_new_session_token()
-            self._get_route(url, token, secret, output_file=output_file)
-        else:
-            sys.stderr.write(f"Error: {resp.text}\n")
-            sys.exit(1)
+
+    def _locus_file(self, output_dir, locus):
+        return os.path.join(output_dir, f"{locus}.fasta.gz" if self.gzip else f"{locus}.fasta")
+
+    @staticmethod
+    def _write_chunks(chunks, out_file):
+        """Atomically write byte chunks to out_file (gzip for .gz), returning its manifest fields."""
+        tmp_file = f"{out_file}.part"
+        sha256 = hashlib.sha256()
+        alleles = 0
+        last = b"\n"
+        try:
+            with (gzip.open(tmp_file, "wb") if out_file.endswith(".gz") else open(tmp_file, "wb")) as file_handle:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    sha256.update(chunk)
+                    alleles += chunk.count(b"\n>") + (last == b"\n" and chunk.startswith(b">"))
+                    last = chunk[-1:]
+                    file_handle.write(chunk)
+            os.replace(tmp_file, out_file)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+        file_stat = os.stat(out_file)
+        return {
+            "file": os.path.basename(out_file),
+            "size": file_stat.st_size,
+            "mtime_ns": file_stat.st_mtime_ns,
+            "sha256": sha256.hexdigest(),
+            "alleles": alleles,
+        }
+
+    @staticmethod
+    def _load_manifest(output_dir):
+        """Return {locus: entry} from the manifest, the last entry per locus winning."""
+        manifest = {}
+        manifest_file = os.path.join(output_dir, MANIFEST_FNAME)
+        if not os.path.isfile(manifest_file):
+            return manifest
+        with open(manifest_file, "r", encoding="utf-8") as file_handle:
+            for line in file_handle:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a run killed mid-append leaves a truncated last line
+                    continue
+                manifest[entry["locus"]] = entry
+        return manifest
+
+    @staticmethod
+    def _save_manifest(manifest, output_dir):
+        """Rewrite the manifest with one entry per locus."""
+        manifest_file = os.path.join(output_dir, MANIFEST_FNAME)
+        tmp_file = f"{manifest_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as file_handle:
+            for locus in sorted(manifest):
+                file_handle.write(json.dumps(manifest[locus]) + "\n")
+        os.replace(tmp_file, manifest_file)
+
+    def _record_locus(self, output_dir, locus, entry):
+        """Append a completed locus to the manifest so an interrupted run can resume after it."""
+        entry = {"locus": locus, **entry}
+        with self._lock:
+            self._manifest[locus] = entry
+            with open(os.path.join(output_dir, MANIFEST_FNAME), "a", encoding="utf-8") as file_handle:
+                file_handle.write(json.dumps(entry) + "\n")
+        return entry
+
+    @staticmethod
+    def _file_sha256(out_file):
+        """Return the SHA-256 of the (decompressed) FASTA content of a locus file."""
+        sha256 = hashlib.sha256()
+        with gzip.open(out_file, "rb") if out_file.endswith(".gz") else open(out_file, "rb") as file_handle:
+            for chunk in iter(lambda: file_handle.read(CHUNK_SIZE), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _is_complete(self, output_dir, locus):
+        entry = self._manifest.get(locus)
+        out_file = self._locus_file(output_dir, locus)
+        if entry is None or entry["file"] != os.path.basename(out_file) or not os.path.isfile(out_file):
+            return False
+        # Size plus the mtime recorded right after the rename catches a file rewritten in place
+        # (same size, new content) without re-hashing every locus of a large scheme on each run;
+        # entries written before mtime was recorded are checked against their SHA-256 instead.
+        file_stat = os.stat(out_file)
+        if "mtime_ns" in entry:
+            return file_stat.st_size == entry["size"] and file_stat.st_mtime_ns == entry["mtime_ns"]
+        try:
+            return file_stat.st_size == entry["size"] and self._file_sha256(out_file) == entry["sha256"]
+        except (OSError, EOFError):
+            return False
+
+    def _download_locus(self, locus_url, output_dir):
+        """Stream a locus FASTA to disk and record it in the manifest."""
+        locus = os.path.basename(locus_url)
+        (token, secret) = self._session_token
+        resp = self._fetch(f"{locus_url}/alleles_fasta", token, secret, stream=True)
+        with resp:
+            entry = self._write_chunks(resp.iter_content(CHUNK_SIZE), self._locus_file(output_dir, locus))
+        entry = self._record_locus(output_dir, locus, {**entry, "synced": date.today().isoformat()})
+        logger.info("Downloaded locus: %s (%d alleles)", locus, entry["alleles"])
+        return entry
+
+    def _map_loci(self, func, locus_urls, output_dir):
+        """Return func(locus_url, output_dir) for each locus from the worker pool.
+
+        The first failure cancels the loci still queued and is re-raised in the calling thread.
+        """
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            futures = [executor.submit(func, locus_url, output_dir) for locus_url in locus_urls]
+            return [future.result() for future in as_completed(futures)]
+        finally:
+            executor.shutdown(cancel_futures=True)
 
     def _download_scheme_alleles(self, scheme_url, token, secret, output_dir):
         with urllib.request.urlopen(scheme_url) as response:
             data = json.loads(response.read())
-        for locus_url in data.get("loci", []):
-            locus = os.path.basename(locus_url)
-            out_file = os.path.join(output_dir, f"{locus}.fasta")
-            if self.force or not os.path.isfile(out_file):
-                self._get_route(f"{locus_url}/alleles_fasta", token, secret, output_file=out_file)
-                logger.info("Downloaded locus: %s", locus)
+        if self._session_token is None:
+            self._session_token = (token, secret)
+        self._manifest = self._load_manifest(output_dir)
+        pending = [
+            locus_url for locus_url in data.get("loci", [])
+            if self.force or not self._is_complete(output_dir, os.path.basename(locus_url))
+        ]
+        logger.info("Downloading %d of %d loci with %d workers",
+                    len(pending), len(data.get("loci", [])), self.workers)
+        try:
+            self._map_loci(self._download_locus, pending, output_dir)
+        finally:
+            self._save_manifest(self._manifest, output_dir)
+
+    @staticmethod
+    def _parse_fasta(text):
+        """Return {allele header: sequence} in file order."""
+        alleles = {}
+        header = None
+        for line in text.splitlines():
+            if line.startswith(">"):
+                header = line[1:].strip()
+                alleles[header] = ""
+            elif header is not None:
+                alleles[header] += line.strip()
+        return alleles
+
+    @staticmethod
+    def _read_fasta(fasta_file):
+        with (gzip.open(fasta_file, "rt", encoding="utf-8") if fasta_file.endswith(".gz")
+              else open(fasta_file, "r", encoding="utf-8")) as file_handle:
+            return BIGSdb._parse_fasta(file_handle.read())
+
+    def _write_fasta(self, alleles, out_file):
+        return self._write_chunks((f">{header}\n{seq}\n".encode() for header, seq in alleles.items()), out_file)
+
+    def _sync_locus(self, locus_url, output_dir):
+        """Bring a locus FASTA up to date, returning the number of changed alleles."""
+        locus = os.path.basename(locus_url)
+        out_file = self._locus_file(output_dir, locus)
+        entry = self._manifest.get(locus)
+        if self.force or not self._is_complete(output_dir, locus) or "synced" not in entry:
+            return self._download_locus(locus_url, output_dir)["alleles"]
+        (token, secret) = self._session_token
+        resp = self._fetch(f"{locus_url}/alleles_fasta?updated_after={self._since(entry)}",
+                           token, secret, accept=(200, 201, 404))
+        updates = self._parse_fasta(resp.text) if resp.status_code != 404 else {}
+        if not updates:
+            self._record_locus(output_dir, locus, {**entry, "synced": date.today().isoformat()})
+            return 0
+        alleles = self._read_fasta(out_file)
+        changed = sum(alleles.get(header) != seq for header, seq in updates.items())
+        if changed:
+            alleles.update(updates)
+            entry = self._write_fasta(alleles, out_file)
+            logger.info("Synced locus %s: %d alleles added or changed", locus, changed)
+        self._record_locus(output_dir, locus, {**entry, "synced": date.today().isoformat()})
+        return changed
+
+    @staticmethod
+    def _since(entry):
+        """Return the updated_after date covering every change since a locus was last synced."""
+        # updated_after is date-granular, so re-request the day of the last sync and dedupe on merge
+        return (date.fromisoformat(entry["synced"]) - timedelta(days=1)).isoformat()
+
+    def _changed_loci(self, scheme_url, since):
+        """Return the names of the database loci with alleles updated after since.
+
+        One request to the loci route replaces an alleles_fasta request per unchanged locus.
+        """
+        db_url = scheme_url.split("/schemes/", 1)[0]
+        (token, secret) = self._session_token
+        resp = self._fetch(f"{db_url}/loci?alleles_updated_after={since}&return_all=1",
+                           token, secret, accept=(200, 201, 404))
+        if resp.status_code == 404:
+            return set()
+        return {os.path.basename(locus_url) for locus_url in resp.json().get("loci", [])}
+
+    def _sync_scheme_alleles(self, scheme_url, token, secret, output_dir):
+        """Fetch only alleles added or changed since the last sync, tracking per-locus state."""
+        with urllib.request.urlopen(scheme_url) as response:
+            data = json.loads(response.read())
+        if self._session_token is None:
+            self._session_token = (token, secret)
+        self._manifest = self._load_manifest(output_dir)
+        loci = data.get("loci", [])
+        synced = {
+            locus: self._manifest[locus] for locus in map(os.path.basename, loci)
+            if not self.force and self._is_complete(output_dir, locus)
+            and "synced" in self._manifest[locus]
+        }
+        if synced:
+            changed_loci = self._changed_loci(scheme_url, min(map(self._since, synced.values())))
+            today = date.today().isoformat()
+            for locus in synced.keys() - changed_loci:
+                self._manifest[locus] = {**synced[locus], "synced": today}
+            loci = [locus_url for locus_url in loci
+                    if os.path.basename(locus_url) not in synced.keys() - changed_loci]
+        try:
+            changed = sum(self._map_loci(self._sync_locus, loci, output_dir))
+        finally:
+            self._save_manifest(self._manifest, output_dir)
+        logger.info("Synced %d of %d loci, %d alleles added or changed",
+                    len(loci), len(data.get("loci", [])), changed)
@@ -0,0 +1,153 @@
+"""Module for exact-match cgMLST allele calling against the hashed scheme allele index"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from jasentool.allele_index import AlleleIndex, ANCHOR_SIZE, START, END
+from jasentool.log import get_logger
+
+logger = get_logger(__name__)
+
+COMPLEMENT = str.maketrans("ACGTacgt", "TGCAtgca")
+NOVEL_LENGTH_RANGE = (0.8, 1.2)
+CHUNK_SIZE = 100_000
+
+_worker = {}
+
+
+def _init_worker(index_fpath, loci):
+    """Open the allele index read-only and load the anchors of the called loci in a worker"""
+    allele_index = AlleleIndex(index_fpath, readonly=True)
+    loci = set(loci)
+    _worker["index"] = allele_index
+    _worker["anchors"] = {
+        kmer: hits for kmer, hits in (
+            (kmer, [hit for hit in hits if hit[0] in loci]) for kmer, hits in allele_index.anchors().items()
+        ) if hits
+    }
+    _worker["lengths"] = {locus: lengths for locus, lengths in allele_index.lengths().items() if locus in loci}
+
+
+def _scan(seq, scan_len=None):
+    """Return [(locus, allele id or None if novel)] of loci starting in the first scan_len bases"""
+    allele_index = _worker["index"]
+    anchors = _worker["anchors"]
+    lengths = _worker["lengths"]
+    calls = []
+    last_pos = len(seq) - ANCHOR_SIZE + 1
+    for pos in range(last_pos if scan_len is None else min(scan_len, last_pos)):
+        hits = anchors.get(seq[pos:pos + ANCHOR_SIZE])
+        if hits is None:
+            continue
+        for locus, side in hits:
+            if side != START:
+                continue
+            alleles = {
+                allele for allele in (
+                    allele_index.lookup_locus(locus, seq[pos:pos + length])
+                    for length in lengths[locus] if pos + length <= len(seq)
+                ) if allele is not None
+            }
+            if alleles:
+                calls.extend((locus, allele) for allele in alleles)
+            elif _has_end_anchor(seq, pos, locus, anchors, lengths[locus]):
+                calls.append((locus, None))
+    return calls
+
+
+def _scan_chunk(chunk):
+    """Scan a (sequence, scan length) chunk"""
+    return _scan(*chunk)
+
+
+def _has_end_anchor(seq, pos, locus, anchors, lengths):
+    """Return True if an allele end k-mer of locus follows pos within the expected allele length"""
+    first = pos + int(lengths[0] * NOVEL_LENGTH_RANGE[0]) - ANCHOR_SIZE
+    last = min(pos + int(lengths[-1] * NOVEL_LENGTH_RANGE[1]), len(seq)) - ANCHOR_SIZE
+    for end_pos in range(max(first, pos + 1), last + 1):
+        if (locus, END) in anchors.get(seq[end_pos:end_pos + ANCHOR_SIZE], ()):
+            return True
+    return False
+
+
+class AlleleCaller:
+    """Class calling cgMLST alleles by exact sequence match, reporting unmatched loci as INF/LNF"""
+    def __init__(self, index_fpath, workers=4, chunk_size=CHUNK_SIZE):
+        self.index_fpath = index_fpath
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def read_targets(targets_fpath):
+        """Return the locus names of a cgMLST targets TSV in file order"""
+        loci = []
+        with open(targets_fpath, "r", encoding="utf-8") as fin:
+            for line in fin:
+                if line.startswith("Locus") or not line.strip():
+                    continue
+                loci.append(line.split("\t")[0].strip())
+        return loci
+
+    @staticmethod
+    def reverse_complement(seq):
+        """Return the reverse complement of seq"""
+        return seq.translate(COMPLEMENT)[::-1]
+
+    @staticmethod
+    def resolve(locus_calls):
+        """Return the allele of a locus from its (allele id or None) hits"""
+        alleles = {allele for allele in locus_calls if allele is not None}
+        if len(alleles) > 1:
+            return "NIPH"
+        if alleles:
+            allele = alleles.pop()
+            return int(allele) if allele.isdigit() else allele
+        return "INF" if locus_calls else "LNF"
+
+    def chunks(self, seq, overlap):
+        """Yield (chunk, scan length) so each start position of seq is scanned in exactly one chunk.
+
+        Each chunk extends overlap bases past its scanned positions, so alleles (and the end
+        anchors of novel alleles) starting near a chunk boundary are still read in full.
+        """
+        for start in range(0, len(seq), self.chunk_size):
+            yield seq[start:start + self.chunk_size + overlap], self.chunk_size
+
+    def call(self, assembly_fpath, loci=None):
+        """Return {locus: allele} for the assembly, scanning chunks of both strands in a pool"""
+        with AlleleIndex(self.index_fpath, readonly=True) as allele_index:
+            loci = loci or allele_index.loci()
+            lengths = allele_index.lengths()
+        max_length = max((max(lengths[locus]) for locus in loci if locus in lengths), default=0)
+        overlap = int(max_length * NOVEL_LENGTH_RANGE[1])
+        locus_calls = {locus: [] for locus in loci}
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.index_fpath, loci)) as executor:
+            chunks = (
+                chunk for _, contig in AlleleIndex.iter_fasta(assembly_fpath)
+                for strand in (contig.upper(), self.reverse_complement(contig.upper()))
+                for chunk in self.chunks(strand, overlap)
+            )
+            for calls in executor.map(_scan_chunk, chunks):
+                for locus, allele in calls:
+                    locus_calls[locus].append(allele)
+        return {locus: self.resolve(calls) for locus, calls in locus_calls.items()}
+
+    def run(self, assembly_fpath, sample_id=None, targets_fpath=None):
+        """Call alleles and return them in the cgmlst typing result shape of JASEN result files"""
+        loci = self.read_targets(targets_fpath) if targets_fpath else None
+        alleles = self.call(assembly_fpath, loci)
+        n_missing = sum(allele == "LNF" for allele in alleles.values())
+        n_novel = sum(allele == "INF" for allele in alleles.values())
+        n_niph = sum(allele == "NIPH" for allele in alleles.values())
+        sample_id = sample_id or os.path.basename(assembly_fpath).split(".")[0]
+        logger.info("sample_id=%s loci=%d exact=%d novel=%d niph=%d missing=%d", sample_id,
+                    len(alleles), len(alleles) - n_missing - n_novel - n_niph, n_novel, n_niph,
+                    n_missing)
+        return {
+            "sample_id": sample_id,
+            "typing_result": [{
+                "type": "cgmlst",
+                "software": "jasentool",
+                "result": {"n_novel": n_novel, "n_missing": n_missing, "alleles": alleles},
+            }],
+        }
@@ -63,11 +63,26 @@ def find_cmd(query, db_name, db_collection, output_file, output_dir,
               help='Combine all outputs into one output')
 @click.option('--generate-matrix', is_flag=True, default=False,
               help='Generate cgMLST matrix')
+@click.option('--cluster', is_flag=True, default=False,
+              help='Order the matrix heatmap by hierarchical clustering (requires the cluster extra)')
+@click.option('--annot-limit', default=50, show_default=True, type=int,
+              help='Annotate heatmap cells only up to this many samples')
+@click.option('--overview-limit', default=1000, show_default=True, type=int,
+              help='Also write a block-averaged heatmap overview above this many samples')
 @click.option('--address', '--uri', default='mongodb://localhost:27017/',
               help='MongoDB address')
 @click.option('--prefix', default='jasentool_results_', help='Output file prefix')
+@click.option('--plot-dpi', default=600, show_default=True, type=int, help='Plot resolution')
+@click.option('--plot-format', type=click.Choice(['png', 'pdf', 'svg']), default='png',
+              show_default=True, help='Plot output format')
+@click.option('--plot-data-only', is_flag=True, default=False,
+              help='Write plot data files for later rendering instead of plots')
+@click.option('--cpus', default=1, show_default=True, type=int,
+              help='Number of worker processes used to render plots')
 def validate_pipelines_cmd(input_file, input_dir, output_file, output_dir, db_name,
-                           db_collection, combined_output, generate_matrix, address, prefix):
+                           db_collection, combined_output, generate_matrix, cluster, annot_limit,
+                           overview_limit, address, prefix, plot_dpi, plot_format, plot_data_only,
+                           cpus):
     """Compare results from new pipeline to old results."""
     if not input_file and not input_dir:
         raise click.UsageError("One of --input-file or --input-dir is required.")
@@ -83,11 +98,36 @@ def validate_pipelines_cmd(input_file, input_dir, output_file, output_dir, db_na
         output_file=output_file, output_dir=output_dir,
         db_name=db_name, db_collection=db_collection,
         combined_output=combined_output, generate_matrix=generate_matrix,
-        address=address, prefix=prefix,
+        cluster=cluster, annot_limit=annot_limit, overview_limit=overview_limit,
+        address=address, prefix=prefix, plot_dpi=plot_dpi, plot_format=plot_format,
+        plot_data_only=plot_data_only, cpus=cpus,
     )
     _parser().validate_pipelines(options)
 
 
+@cli.command('render-plots')
+@click.option('-i', '--input-file', multiple=True, type=click.Path(exists=True),
+              help='Plot data file(s) written with --plot-data-only')
+@click.option('--input-dir', default=None, type=click.Path(exists=True, file_okay=False),
+              help='Path to directory containing .plot.json files')
+@click.option('--plot-dpi', default=600, show_default=True, type=int, help='Plot resolution')
+@click.option('--plot-format', type=click.Choice(['png', 'pdf', 'svg']), default='png',
+              show_default=True, help='Plot output format')
+@click.option('--cpus', default=1, show_default=True, type=int,
+              help='Number of worker processes used to render plots')
+def render_plots_cmd(input_file, input_dir, plot_dpi, plot_format, cpus):
+    """Render plot data files written by validate-pipelines --plot-data-only."""
+    if not input_file and not input_dir:
+        raise click.UsageError("One of --input-file or --input-dir is required.")
+    if input_file and input_dir:
+        raise click.UsageError("--input-file and --input-dir are mutually exclusive.")
+    options = types.SimpleNamespace(
+        input_file=list(input_file) if input_file else None, input_dir=input_dir,
+        plot_dpi=plot_dpi, plot_format=plot_format, cpus=cpus,
+    )
+    _parser().render_plots(options)
+
+
 @cli.command('identify-missing')
 @click.option('-o', '--output-file', required=True, help='Path to output file')
 @click.option('--db-name', required=True, help='MongoDB database name')
@@ -97,6 +137,15 @@ def validate_pipelines_cmd(input_file, input_dir, output_file, output_dir, db_na
 @click.option('--restore-dir', default='/fs2/seqdata/restored',
               help='Directory to restore spring files to')
 @click.option('--restore-file', default=None, help='Filepath for bash restore script')
+@click.option('--restore-jobs', default=4, type=int, show_default=True,
+              help='Maximum number of concurrent restore jobs in the restore script')
+@click.option('--restore-retries', default=0, type=int, show_default=True,
+              help='Number of times a failed restore command is retried')
+@click.option('--execute', is_flag=True, default=False,
+              help='Restore the missing files directly instead of only writing a restore script')
+@click.option('--restore-state', default=None,
+              help='State file of completed restore jobs used to resume --execute '
+                   '(default: <restore-dir>/restore_state.json)')
 @click.option('--missing-log', default='missing_samples.log',
               help='File containing missing files')
 @click.option('--assay', default='jasen-saureus-dev', help='Assay for JASEN to run')
@@ -105,16 +154,26 @@ def validate_pipelines_cmd(input_file, input_dir, output_file, output_dir, db_na
 @click.option('--alter-sample-id', is_flag=True, default=False,
               help='Alter sample ID to be LIMS ID + sequencing run')
 @click.option('-i', '--input-file', multiple=True, default=None, help='Input filepath(s)')
+@click.option('--cache-dir', default=None,
+              help='Directory for persistent lookup caches reused across runs')
+@click.option('--unresolved-ttl', default=24.0, show_default=True, type=float,
+              help='Hours before an unresolved run location is probed again (--cache-dir)')
+@click.option('--inventory', default=None,
+              help='SQLite sample inventory updated incrementally between runs (--analysis-dir)')
 def identify_missing_cmd(output_file, db_name, db_collection, analysis_dir, restore_dir,
-                         restore_file, missing_log, assay, platform, sample_sheet,
-                         alter_sample_id, input_file):
+                         restore_file, restore_jobs, restore_retries, execute, restore_state,
+                         missing_log, assay,
+                         platform, sample_sheet, alter_sample_id, input_file, cache_dir, unresolved_ttl, inventory):
     """Find missing sample data from old runs."""
     options = types.SimpleNamespace(
         output_file=output_file, db_name=db_name, db_collection=db_collection,
         analysis_dir=analysis_dir, restore_dir=restore_dir, restore_file=restore_file,
+        restore_jobs=restore_jobs, restore_retries=restore_retries,
+        execute=execute, restore_state=restore_state,
         missing_log=missing_log, assay=assay, platform=platform,
         sample_sheet=sample_sheet, alter_sample_id=alter_sample_id,
         input_file=list(input_file) if input_file else None,
+        cache_dir=cache_dir, unresolved_ttl=unresolved_ttl, inventory=inventory,
     )
     _parser().identify_missing(options)
 
@@ -162,9 +221,16 @@ def reformat_csv_cmd(csv_file, output_file, sh_file, remote_dir, remote_hostname
 @click.option('--output-dir', default=None, help='Path to output directory')
 @click.option('--save-dbs', is_flag=True, default=False,
               help='Save all intermediary DBs created for TBProfiler DB convergence')
-def converge_catalogues_cmd(output_dir, save_dbs):
+@click.option('--cache-dir', default=None,
+              help='Download cache revalidated with conditional requests between runs')
+@click.option('--offline', is_flag=True, default=False,
+              help='Serve downloads from --cache-dir without network requests')
+def converge_catalogues_cmd(output_dir, save_dbs, cache_dir, offline):
     """Converge TB mutation catalogues."""
-    options = types.SimpleNamespace(output_dir=output_dir, save_dbs=save_dbs)
+    if offline and not cache_dir:
+        raise click.UsageError('--offline requires --cache-dir')
+    options = types.SimpleNamespace(output_dir=output_dir, save_dbs=save_dbs,
+                                    cache_dir=cache_dir, offline=offline)
     _parser().converge_catalogues(options)
 
 
@@ -183,6 +249,27 @@ def post_align_qc_cmd(sample_id, bam_file, output_file, bed_file, cpus):
     _parser().post_align_qc(options)
 
 
+@cli.command('call-alleles')
+@click.option('-i', '--input-file', required=True, help='Assembly FASTA (plain or gzip)')
+@click.option('-x', '--index', 'index_file', required=True,
+              help='Allele index from index-alleles (updated first when --scheme-dir is given)')
+@click.option('-o', '--output-file', required=True, help='Path to JSON output file')
+@click.option('--scheme-dir', default=None,
+              help='Directory of per-locus scheme FASTA files to index before calling')
+@click.option('--targets', default=None,
+              help='cgMLST targets TSV restricting and ordering the called loci')
+@click.option('--sample-id', default=None, help='Sample ID')
+@click.option('--workers', default=4, show_default=True, type=int,
+              help='Number of worker processes scanning assembly chunks')
+def call_alleles_cmd(input_file, index_file, output_file, scheme_dir, targets, sample_id, workers):
+    """Call cgMLST alleles by exact match against a scheme allele index."""
+    options = types.SimpleNamespace(
+        input_file=input_file, index=index_file, output_file=output_file, scheme_dir=scheme_dir,
+        targets=targets, sample_id=sample_id, workers=workers,
+    )
+    _parser().call_alleles(options)
+
+
 @cli.command('count-reads')
 @click.option('--fastq1', required=True, help='Path to R1 FASTQ file')
 @click.option('--fastq2', default=None, help='Path to R2 FASTQ file (optional, paired-end)')
@@ -205,11 +292,18 @@ def count_reads_cmd(fastq1, fastq2, output_file, sample_id):
 @click.option('--fai-index', is_flag=True, default=False, help='Run samtools faidx')
 @click.option('--clean', is_flag=True, default=False,
               help='Clear output directory before download')
-def download_ncbi_cmd(accession, output_dir, bwa_index, fai_index, clean):
+@click.option('--bgzip', is_flag=True, default=False,
+              help='Write bgzip-compressed FASTA with .fai/.gzi indexes')
+@click.option('--workers', default=3, show_default=True, type=int,
+              help='Number of accessions downloaded concurrently')
+@click.option('--index-workers', default=1, show_default=True, type=int,
+              help='Number of FASTA indexes built concurrently with ongoing downloads')
+def download_ncbi_cmd(accession, output_dir, bwa_index, fai_index, clean, bgzip, workers, index_workers):
     """Download genome FASTA and GFF from NCBI Datasets v2 API."""
     options = types.SimpleNamespace(
         accession=list(accession), output_dir=output_dir,
-        bwa_index=bwa_index, fai_index=fai_index, clean=clean,
+        bwa_index=bwa_index, fai_index=fai_index, clean=clean, bgzip=bgzip,
+        workers=workers, index_workers=index_workers,
     )
     _parser().download_ncbi(options)
 
@@ -366,17 +460,34 @@ def annotate_delly_cmd(vcf, bed, output):
               help='Download all scheme loci')
 @click.option('--force', is_flag=True, default=False,
               help='Re-download existing files (--download-scheme)')
+@click.option('--sync', is_flag=True, default=False,
+              help='Fetch only alleles added or changed since the last sync (--download-scheme)')
+@click.option('--gzip', 'gzip_output', is_flag=True, default=False,
+              help='Write gzip-compressed <locus>.fasta.gz files (--download-scheme)')
 @click.option('--cron', is_flag=True, default=False,
               help='Non-interactive / cron mode')
 @click.option('--method', type=click.Choice(['GET', 'POST']), default='GET',
               show_default=True, help='HTTP method')
 @click.option('--output-file', default=None, help='Save single response to this file')
+@click.option('--workers', default=4, show_default=True, type=int,
+              help='Number of loci downloaded concurrently (--download-scheme)')
 def download_bigsdb_cmd(url, site, key_name, output_dir, token_dir, db, setup,
-                        download_scheme, force, cron, method, output_file):
+                        download_scheme, force, sync, gzip_output, cron, method, output_file, workers):
     """Download cgMLST scheme alleles from PubMLST or BIGSdb Pasteur via OAuth1."""
     options = types.SimpleNamespace(
         url=url, site=site, key_name=key_name, output_dir=output_dir,
         token_dir=token_dir, db=db, setup=setup, download_scheme=download_scheme,
-        force=force, cron=cron, method=method, output_file=output_file,
+        force=force, sync=sync, gzip=gzip_output, cron=cron, method=method, output_file=output_file,
+        workers=workers,
     )
     _parser().download_bigsdb(options)
+
+
+@cli.command('index-alleles')
+@click.option('-i', '--scheme-dir', required=True,
+              help='Directory of per-locus FASTA files from download-bigsdb --download-scheme')
+@click.option('-o', '--output-file', required=True, help='SQLite allele index to create or update')
+def index_alleles_cmd(scheme_dir, output_file):
+    """Index scheme alleles by sequence hash for exact-match lookups."""
+    options = types.SimpleNamespace(scheme_dir=scheme_dir, output_file=output_file)
+    _parser().index_alleles(options)
@@ -3,7 +3,7 @@
 import os
 import shutil
 import pandas as pd
-from jasentool.who import WHO
+from jasentool.who import WHO, WHO_URL
 from jasentool.genome import Genome
 from jasentool.tbprofiler import Tbprofiler
 from jasentool.utils import Utils
@@ -56,15 +56,19 @@ class Converge:
 
     def run(self, save_all_dbs):
         """Run the retrieval and convergance of mutation catalogues"""
-        utils = Utils()
         mycobacterium_genome = Genome("NC_000962.3", "AL123456.3", self.download_dir, "h37rv")
+        who_filepath = os.path.join(self.download_dir, "who.xlsx")
+        Utils.download_files([
+            (mycobacterium_genome.gff_url, mycobacterium_genome.zip_filepath),
+            (self.tbdb_url, self.tbdb_filepath),
+            (WHO_URL, who_filepath),
+        ])
         fasta_filepath = mycobacterium_genome.download_fasta()
-        gff_filepath = mycobacterium_genome.download_gff()
-        utils.download_and_save_file(self.tbdb_url, self.tbdb_filepath)
+        gff_filepath = mycobacterium_genome.extract_gff()
         who = WHO()
         tbprofiler = Tbprofiler(self.tbdb_filepath)
-        who_df = who._parse(fasta_filepath, gff_filepath, self.download_dir)
-        tbdb_df = tbprofiler._parse(self.download_dir)
+        who_df = who._parse(fasta_filepath, gff_filepath, self.download_dir, who_filepath)
+        tbdb_df = tbprofiler._parse(self.download_dir, self.tbdb_filepath)
         fohm_df = pd.read_csv(self.fohm_fpath)
         column_names = ['Drug', 'Gene', 'Mutation']
         intersection_df, unique_tbdb_df, unique_who_df = self.compare_columns(tbdb_df, who_df, column_names)
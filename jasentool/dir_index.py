@@ -0,0 +1,50 @@
+"""Module for indexing directory listings"""
+
+import os
+from bisect import bisect_left
+from jasentool.json_cache import JsonCache
+
+class DirIndex(JsonCache):
+    """Class holding sorted directory listings, optionally persisted and keyed by directory mtime"""
+    description = "directory index"
+
+    def __init__(self, cache_fpath=None):
+        super().__init__(cache_fpath)
+        self.listings = {}
+        self.persisted = self.load()
+
+    def contents(self):
+        """Return the persisted directory listings"""
+        return self.persisted
+
+    def listdir(self, parent_dir):
+        """Return the sorted entries of parent_dir (None if missing), listing it at most once"""
+        key = os.path.normpath(parent_dir)
+        if key in self.listings:
+            return self.listings[key]
+        try:
+            mtime = os.stat(key).st_mtime_ns
+        except FileNotFoundError:
+            self.listings[key] = None
+            return None
+        cached = self.persisted.get(key)
+        if cached and cached["mtime"] == mtime:
+            entries = cached["entries"]
+        else:
+            entries = sorted(os.listdir(key))
+            self.persisted[key] = {"mtime": mtime, "entries": entries}
+            self.modified = True
+        self.listings[key] = entries
+        return entries
+
+    def prefix(self, parent_dir, prefix):
+        """Return the sorted entries of parent_dir starting with prefix (None if missing)"""
+        entries = self.listdir(parent_dir)
+        if entries is None:
+            return None
+        matches = []
+        for idx in range(bisect_left(entries, prefix), len(entries)):
+            if not entries[idx].startswith(prefix):
+                break
+            matches.append(entries[idx])
+        return matches
@@ -0,0 +1,294 @@
+"""Module for downloading files over a shared, pooled HTTP session"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from jasentool.log import get_logger
+
+logger = get_logger(__name__)
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+class DownloadCache:
+    """Class storing downloaded files by content hash, indexed by URL with their validators"""
+    def __init__(self, cache_dir, offline=False):
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.index_fpath = os.path.join(cache_dir, "index.json")
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.entries = self._load()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Load the URL index"""
+        if not os.path.exists(self.index_fpath):
+            return {}
+        try:
+            with open(self.index_fpath, 'r', encoding="utf-8") as fin:
+                return json.load(fin)
+        except (OSError, json.JSONDecodeError) as error_code:
+            logger.warning("Ignoring unreadable download cache index %s: %s",
+                           self.index_fpath, error_code)
+            return {}
+
+    def save(self):
+        """Persist the URL index"""
+        tmp_fpath = f"{self.index_fpath}.tmp"
+        with open(tmp_fpath, 'w', encoding="utf-8") as fout:
+            json.dump(self.entries, fout, indent=1)
+        os.replace(tmp_fpath, self.index_fpath)
+
+    def object_fpath(self, sha256):
+        """Return the path of a cached object"""
+        return os.path.join(self.objects_dir, sha256)
+
+    def entry(self, url):
+        """Return the index entry of url if its object is cached, otherwise None"""
+        entry = self.entries.get(url)
+        if entry and os.path.exists(self.object_fpath(entry["sha256"])):
+            return entry
+        return None
+
+    def partial_fpath(self, url):
+        """Return the path a download of url is written to before it is hashed"""
+        url_hash = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.objects_dir, f"{url_hash}.download")
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Return the If-None-Match/If-Modified-Since headers revalidating an entry"""
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url, fpath, response_headers):
+        """Move a downloaded file into the cache under its content hash and index it by url"""
+        sha256 = hashlib.sha256()
+        with open(fpath, 'rb') as fin:
+            for chunk in iter(lambda: fin.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        size = os.path.getsize(fpath)
+        os.replace(fpath, self.object_fpath(digest))
+        with self._lock:
+            previous = self.entries.get(url)
+            self.entries[url] = {"sha256": digest, "size": size,
+                                 "etag": response_headers.get("ETag"),
+                                 "last_modified": response_headers.get("Last-Modified"),
+                                 "fetched": time.time()}
+            self.save()
+            if previous and previous["sha256"] != digest:
+                self.remove_unreferenced(previous["sha256"])
+        return self.entries[url]
+
+    def remove_unreferenced(self, sha256):
+        """Delete a cached object that no index entry refers to anymore"""
+        if any(entry["sha256"] == sha256 for entry in self.entries.values()):
+            return
+        try:
+            os.remove(self.object_fpath(sha256))
+        except FileNotFoundError:
+            pass
+
+    def copy_to(self, entry, output_filepath):
+        """Copy a cached object to output_filepath"""
+        tmp_fpath = f"{output_filepath}.part"
+        shutil.copyfile(self.object_fpath(entry["sha256"]), tmp_fpath)
+        os.replace(tmp_fpath, output_filepath)
+
+
+class Downloader:
+    """Class downloading files with a pooled session, resuming partial files with Range requests"""
+    def __init__(self, workers=4, chunk_size=1024 * 1024, cache=None, rate=None):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.min_interval = 1.0 / rate if rate else 0.0
+        self._next_request = 0.0
+        self._session = None
+        self._lock = threading.Lock()
+        self._rate_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Return the shared session, creating it on first use"""
+        with self._lock:
+            if self._session is None:
+                adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+                self._session = requests.Session()
+                self._session.mount("https://", adapter)
+                self._session.mount("http://", adapter)
+            return self._session
+
+    def throttle(self):
+        """Wait until the next request is allowed under the configured rate limit"""
+        if not self.min_interval:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            start = max(now, self._next_request)
+            self._next_request = start + self.min_interval
+        if start > now:
+            sleep(start - now)
+
+    @staticmethod
+    def wait_time(response, attempt):
+        """Return seconds to wait before the next attempt, honouring Retry-After"""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+        return (2 ** attempt) + 1
+
+    @staticmethod
+    def validator(response_headers):
+        """Return the strong ETag or Last-Modified of a response, usable as an If-Range validator"""
+        etag = response_headers.get("ETag")
+        if etag and not etag.startswith("W/"):
+            return etag
+        return response_headers.get("Last-Modified")
+
+    @staticmethod
+    def read_validator(validator_filepath):
+        """Return the validator stored next to a partial file, or None"""
+        if not os.path.exists(validator_filepath):
+            return None
+        with open(validator_filepath, 'r', encoding="utf-8") as fin:
+            return fin.read().strip() or None
+
+    @staticmethod
+    def discard(*fpaths):
+        """Remove partial download files that exist"""
+        for fpath in fpaths:
+            if os.path.exists(fpath):
+                os.remove(fpath)
+
+    def _write_part(self, response, part_filepath, validator_filepath, resumed):
+        """Append a 206 response to the partial file, or restart it and store the new validator"""
+        if resumed:
+            logger.info("Resuming download of %s at byte %d",
+                        response.url, os.path.getsize(part_filepath))
+        else:
+            if os.path.exists(validator_filepath):
+                logger.info("Remote file changed, restarting download of %s", response.url)
+                os.remove(validator_filepath)
+            if self.validator(response.headers):
+                with open(validator_filepath, 'w', encoding="utf-8") as fout:
+                    fout.write(self.validator(response.headers))
+        with open(part_filepath, "ab" if resumed else "wb") as output_file:
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                output_file.write(chunk)
+
+    def fetch(self, url, output_filepath, timeout=600, part_filepath=None, headers=None):
+        """Fetch url into a partial file, resuming from its size, and move it to output_filepath.
+
+        A partial file is resumed with If-Range against the validator stored when it was
+        started and only appended to if the 206 Content-Range starts at its size; a 200
+        or a mismatched range restarts it.
+        Returns the response headers, or None if the server answered 304 Not Modified to the
+        conditional headers (which are only sent when no partial file exists).
+        """
+        part_filepath = part_filepath or f"{output_filepath}.part"
+        validator_filepath = f"{part_filepath}.validator"
+        offset = os.path.getsize(part_filepath) if os.path.exists(part_filepath) else 0
+        validator = self.read_validator(validator_filepath) if offset else None
+        if offset and validator is None:
+            logger.info("No validator stored for partial download of %s, restarting", url)
+            offset = 0
+        if offset:
+            request_headers = {"Range": f"bytes={offset}-", "If-Range": validator}
+        else:
+            request_headers = dict(headers or {})
+        self.throttle()
+        with self.session.get(url, stream=True, timeout=timeout,
+                              headers=request_headers) as response:
+            if response.status_code == 304:
+                return None
+            content_range = response.headers.get("Content-Range", "")
+            if offset and response.status_code == 416:
+                restart = content_range != f"bytes */{offset}"
+                if not restart:
+                    logger.info("Partial download of %s is already complete", output_filepath)
+            else:
+                response.raise_for_status()
+                resumed = offset and response.status_code == 206
+                restart = resumed and not content_range.startswith(f"bytes {offset}-")
+                if not restart:
+                    self._write_part(response, part_filepath, validator_filepath, resumed)
+        if restart:
+            logger.warning("Unexpected Content-Range '%s' for %s, restarting download",
+                           content_range, url)
+            self.discard(part_filepath, validator_filepath)
+            return self.fetch(url, output_filepath, timeout, part_filepath, headers)
+        os.replace(part_filepath, output_filepath)
+        self.discard(validator_filepath)
+        return response.headers
+
+    def fetch_cached(self, url, output_filepath, timeout=600):
+        """Fetch url through the cache, revalidating a cached copy with a conditional request"""
+        entry = self.cache.entry(url)
+        if self.cache.offline:
+            if entry is None:
+                raise FileNotFoundError(f"{url} is not in the download cache (offline mode)")
+            logger.info("Serving %s from the download cache (offline mode)", url)
+        else:
+            download_fpath = self.cache.partial_fpath(url)
+            response_headers = self.fetch(url, download_fpath, timeout, f"{download_fpath}.part",
+                                          self.cache.conditional_headers(entry))
+            if response_headers is None:
+                logger.info("Cached copy of %s is up to date", url)
+            else:
+                entry = self.cache.store(url, download_fpath, response_headers)
+        self.cache.copy_to(entry, output_filepath)
+
+    def download(self, url, output_filepath, timeout=600, max_retries=3):
+        """Download url to output_filepath, retrying rate limits, server errors and dropped links"""
+        for attempt in range(max_retries):
+            response = None
+            try:
+                if self.cache is None:
+                    self.fetch(url, output_filepath, timeout)
+                else:
+                    self.fetch_cached(url, output_filepath, timeout)
+                logger.info("File downloaded and saved to: %s", output_filepath)
+                return True
+            except requests.exceptions.HTTPError as error_code:
+                response = error_code.response
+                if response is None or response.status_code not in RETRY_STATUS_CODES:
+                    logger.error("Download of %s failed: %s", url, error_code)
+                    return False
+                logger.warning("Attempt %d failed: %s", attempt + 1, error_code)
+            except FileNotFoundError as error_code:
+                logger.error("Download of %s failed: %s", url, error_code)
+                return False
+            except (requests.exceptions.RequestException, OSError) as error_code:
+                logger.warning("Attempt %d failed: %s", attempt + 1, error_code)
+            if attempt < max_retries - 1:
+                wait_time = self.wait_time(response, attempt)
+                logger.info("Retrying in %d seconds...", wait_time)
+                sleep(wait_time)
+        logger.error("Max retries reached. Giving up.")
+        return False
+
+    def download_many(self, downloads, timeout=600, max_retries=3):
+        """Download (url, output_filepath) pairs concurrently, returning {output_filepath: ok}"""
+        downloads = list(downloads)
+        if not downloads:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(downloads))) as executor:
+            results = executor.map(
+                lambda download: self.download(download[0], download[1], timeout, max_retries),
+                downloads
+            )
+            return {output_filepath: success
+                    for (_, output_filepath), success in zip(downloads, results)}
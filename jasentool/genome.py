@@ -18,9 +18,17 @@ class Genome:
         self.fasta_filepath = os.path.join(download_dir, f"{prefix}.fasta")
         self.genbank_filepath = os.path.join(download_dir, f"{prefix}.gb")
         self.gff_filepath = os.path.join(download_dir, f"{prefix}.gff")
+        self.gff_url = (
+            "https://api.ncbi.nlm.nih.gov/datasets/v2alpha/genome/accession/GCF_000195955.2/download"
+            "?include_annotation_type=GENOME_GFF&filename=GCF_000195955.2.zip"
+        )
 
     def download_fasta(self):
         """Download genome in fasta format"""
+        cache = Utils.downloader.cache
+        if cache is not None and cache.offline and os.path.exists(self.fasta_filepath):
+            logger.info("Reusing %s (offline mode)", self.fasta_filepath)
+            return self.fasta_filepath
         try:
             fasta_handle = Entrez.efetch(db="nucleotide", id=self.refseq_accn,
                                          rettype="fasta", retmode="text")
@@ -51,14 +59,14 @@ class Genome:
 
     def download_gff(self):
         """Download gff of genome genes"""
-        utils = Utils()
-        h37rv_url = "https://api.ncbi.nlm.nih.gov/datasets/v2alpha/genome/accession/GCF_000195955.2/download?include_annotation_type=GENOME_GFF&filename=GCF_000195955.2.zip"
+        Utils.download_and_save_file(self.gff_url, self.zip_filepath)
+        return self.extract_gff()
+
+    def extract_gff(self):
+        """Extract the gff of genome genes from the downloaded zip file"""
         try:
-            utils.download_and_save_file(h37rv_url, self.zip_filepath)
-            utils.unzip(self.zip_filepath, self.download_dir)
-            source = os.path.join(self.download_dir, "ncbi_dataset/data/GCF_000195955.2/genomic.gff")
-            destination = os.path.join(self.download_dir, "h37rv.gff")
-            utils.copy_file(source, destination)
+            gff_member = "ncbi_dataset/data/GCF_000195955.2/genomic.gff"
+            Utils.extract_members(self.zip_filepath, {gff_member: self.gff_filepath})
         except Exception as error_code:
             logger.error("Error downloading the gff file: %s", error_code)
         return self.gff_filepath
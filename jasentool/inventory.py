@@ -0,0 +1,139 @@
+"""Module for the local sample inventory backing identify-missing"""
+
+import os
+import time
+from jasentool.stat_cache import StatCache
+from jasentool.utils import Utils
+from jasentool.log import get_logger
+
+logger = get_logger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    id TEXT PRIMARY KEY,
+    run TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_run ON samples (run);
+CREATE TABLE IF NOT EXISTS runs (
+    run TEXT PRIMARY KEY,
+    run_dir TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reads (
+    sample TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    fpath TEXT NOT NULL,
+    PRIMARY KEY (sample, kind, fpath)
+);
+CREATE TABLE IF NOT EXISTS results (
+    dir TEXT NOT NULL,
+    fname TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    sample_name TEXT,
+    PRIMARY KEY (dir, fname)
+);
+CREATE INDEX IF NOT EXISTS results_prefix ON results (dir, prefix);
+CREATE INDEX IF NOT EXISTS results_sample_name ON results (dir, sample_name);
+"""
+SCHEMA_VERSION = 3
+# every table any schema version created, so a version change also drops tables it no longer uses
+TABLES = ("samples", "runs", "reads", "results")
+
+class Inventory:
+    """Class keeping samples, runs, read files and analysis results in a local SQLite database"""
+    def __init__(self, db_fpath, stat_cache=None):
+        self.stat_cache = stat_cache if stat_cache is not None else StatCache()
+        # every table is rebuilt from mongodb and the filesystem, so older layouts are dropped
+        self.conn = Utils.connect_db(db_fpath, SCHEMA, TABLES, SCHEMA_VERSION)
+
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update_samples(self, meta_dict):
+        """Synchronise the samples table with the samples found in mongodb"""
+        now = time.time()
+        samples = {sample["id"]: sample["run"] for sample in meta_dict}
+        stored = dict(self.conn.execute("SELECT id, run FROM samples"))
+        changed = [(sample_id, run, now) for sample_id, run in samples.items()
+                   if stored.get(sample_id) != run]
+        removed = [(sample_id,) for sample_id in stored.keys() - samples.keys()]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?, ?)", changed)
+            self.conn.executemany("DELETE FROM samples WHERE id = ?", removed)
+            self.conn.executemany("DELETE FROM reads WHERE sample = ?", removed)
+        logger.info("Inventory samples: %d updated, %d removed", len(changed), len(removed))
+
+    def update_results(self, dir_fpath, sample_names=None):
+        """Synchronise the results table with the json files in the analysis directory.
+
+        Each file is stored with its filename prefix and, when sample_names ({fname: sample_name}
+        read from the json files) is given, its sample name, so either naming can be queried later.
+        """
+        dir_key = os.path.normpath(os.path.abspath(dir_fpath))
+        stored = {fname: sample_name for fname, sample_name in self.conn.execute(
+            "SELECT fname, sample_name FROM results WHERE dir = ?", (dir_key,))}
+        fnames = [entry.name for entry in os.scandir(dir_key) if entry.name.endswith(".json")]
+        changed = []
+        for fname in fnames:
+            sample_name = sample_names.get(fname) if sample_names is not None else stored.get(fname)
+            if fname not in stored or stored[fname] != sample_name:
+                changed.append((dir_key, fname, fname.split("_")[0], sample_name))
+        removed = [(dir_key, fname) for fname in stored.keys() - set(fnames)]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", changed)
+            self.conn.executemany("DELETE FROM results WHERE dir = ? AND fname = ?", removed)
+        logger.info("Inventory results: %d updated, %d removed", len(changed), len(removed))
+
+    def update_runs(self, run_dirs):
+        """Record the resolved directories of sequencing runs"""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO runs VALUES (?, ?, ?)",
+                                  [(run, run_dir, now) for run, run_dir in run_dirs.items()])
+
+    def update_reads(self, csv_dict):
+        """Record the read files of samples and the backed up files they are restored from"""
+        rows = []
+        for sample_id, record in csv_dict.items():
+            backup = record.spring if record.spring else record.restored
+            rows.extend((sample_id, "reads", fpath) for fpath in record.reads)
+            rows.extend((sample_id, "backup", fpath) for fpath in backup)
+        with self.conn:
+            self.conn.executemany("DELETE FROM reads WHERE sample = ?",
+                                  [(sample_id,) for sample_id in csv_dict])
+            self.conn.executemany("INSERT OR IGNORE INTO reads VALUES (?, ?, ?)", rows)
+        logger.info("Inventory reads: %d files of %d samples recorded", len(rows), len(csv_dict))
+
+    def read_files(self, sample_id, kind="reads"):
+        """Return the recorded read (or, with kind="backup", backed up) files of a sample"""
+        return [fpath for (fpath,) in self.conn.execute(
+            "SELECT fpath FROM reads WHERE sample = ? AND kind = ? ORDER BY fpath", (sample_id, kind)
+        )]
+
+    def run_dirs(self):
+        """Return {run: run_dir} of recorded runs whose directory still exists"""
+        recorded = dict(self.conn.execute("SELECT run, run_dir FROM runs"))
+        self.stat_cache.prefetch(recorded.values())
+        return {run: run_dir for run, run_dir in recorded.items() if self.stat_cache.isdir(run_dir)}
+
+    def missing_samples(self, dir_fpath, alter_sample_id=False):
+        """Return the ids of samples without analysis results in dir_fpath.
+
+        Results are matched on the sample name read from the json files with alter_sample_id,
+        otherwise on the filename prefix.
+        """
+        column = "sample_name" if alter_sample_id else "prefix"
+        return [sample_id for (sample_id,) in self.conn.execute(
+            "SELECT id FROM samples WHERE NOT EXISTS "
+            f"(SELECT 1 FROM results WHERE results.dir = ? AND results.{column} = samples.id) "
+            "ORDER BY run, id",
+            (os.path.normpath(os.path.abspath(dir_fpath)),)
+        )]
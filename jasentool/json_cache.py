@@ -0,0 +1,44 @@
+"""Module for small on-disk JSON caches"""
+
+import os
+import json
+from abc import ABC, abstractmethod
+from jasentool.log import get_logger
+
+logger = get_logger(__name__)
+
+class JsonCache(ABC):
+    """Base class for caches persisted as a single JSON file, replaced atomically on save"""
+    description = "cache"
+    indent = None
+
+    def __init__(self, cache_fpath=None):
+        self.cache_fpath = cache_fpath
+        self.modified = False
+
+    def load(self):
+        """Return the persisted cache contents, or {} if there are none or they are unreadable"""
+        if not self.cache_fpath or not os.path.exists(self.cache_fpath):
+            return {}
+        try:
+            with open(self.cache_fpath, 'r', encoding="utf-8") as fin:
+                return json.load(fin)
+        except (OSError, json.JSONDecodeError) as error_code:
+            logger.warning("Ignoring unreadable %s %s: %s",
+                           self.description, self.cache_fpath, error_code)
+            return {}
+
+    @abstractmethod
+    def contents(self):
+        """Return the cache contents to persist"""
+
+    def save(self):
+        """Persist the cache contents if they changed since they were loaded or last saved"""
+        if not self.cache_fpath or not self.modified:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_fpath)), exist_ok=True)
+        tmp_fpath = f"{self.cache_fpath}.tmp"
+        with open(tmp_fpath, 'w', encoding="utf-8") as fout:
+            json.dump(self.contents(), fout, indent=self.indent)
+        os.replace(tmp_fpath, self.cache_fpath)
+        self.modified = False
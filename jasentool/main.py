@@ -9,7 +9,12 @@ from bson import ObjectId
 from jasentool.database import Database
 from jasentool.validate import Validate
 from jasentool.utils import Utils
+from jasentool.download import DownloadCache
 from jasentool.missing import Missing
+from jasentool.inventory import Inventory
+from jasentool.restore import Restore
+from jasentool.remote import RemoteSession
+from jasentool.plot import Plot
 from jasentool.convert import Convert
 from jasentool.fix import Fix
 from jasentool.converge import Converge
@@ -17,6 +22,8 @@ from jasentool.qc import QC
 from jasentool.count_reads import CountReads
 from jasentool.ncbi import NCBI
 from jasentool.bigsdb import BIGSdb
+from jasentool.allele_index import AlleleIndex
+from jasentool.call_alleles import AlleleCaller
 from jasentool.concatenate import Concatenate
 from jasentool.create_yaml import CreateYaml
 from jasentool.annotate_delly import AnnotateDelly
@@ -89,13 +96,28 @@ class OptionsParser:
         output_fpaths = self._get_output_fpaths(input_files, options.output_dir,
                                                 options.output_file, options.prefix,
                                                 options.combined_output)
-        validate = Validate(options.input_dir, options.db_collection)
-        validate.run(input_files, output_fpaths, options.combined_output, options.generate_matrix)
+        plot = Plot(options.plot_dpi, options.plot_format, options.plot_data_only, options.cpus)
+        validate = Validate(options.input_dir, options.db_collection, plot)
+        validate.run(input_files, output_fpaths, options.combined_output, options.generate_matrix,
+                     options.cluster, options.annot_limit, options.overview_limit)
+
+    def render_plots(self, options):
+        """Render plot data files written by validate-pipelines --plot-data-only"""
+        data_fpaths = list(options.input_file or [])
+        if options.input_dir:
+            data_fpaths.extend(sorted(
+                os.path.join(options.input_dir, fname) for fname in os.listdir(options.input_dir)
+                if fname.endswith(".plot.json")
+            ))
+        plot = Plot(options.plot_dpi, options.plot_format, workers=options.cpus)
+        for output_plot_fpath in plot.render_data_files(data_fpaths):
+            logger.info("Plot rendered to: %s", output_plot_fpath)
 
     def identify_missing(self, options):
         """Execute search for missing samples from new pipeline results"""
         utils = Utils()
         handler = Missing()
+        handler.initialize(options.cache_dir, unresolved_ttl=options.unresolved_ttl)
         db = Database()
         db.initialize(options.db_name)
         if options.sample_sheet:
@@ -108,16 +130,44 @@ class OptionsParser:
             log_fpath = os.path.splitext(options.missing_log)[0] + ".log"
             empty_fpath = os.path.splitext(options.output_file)[0] + "_empty.csv"
             meta_dict = db.find(options.db_collection, {"metadata.QC": "OK"}, db.get_meta_fields())
-            analysis_dir_fnames = handler.parse_dir(options.analysis_dir, options.alter_sample_id)
-            csv_dict, missing_samples_txt = handler.find_missing(meta_dict, analysis_dir_fnames, options.restore_dir)
+            if options.inventory:
+                with Inventory(options.inventory, handler.stat_cache) as inventory:
+                    inventory.update_samples(meta_dict)
+                    sample_names = None
+                    if options.alter_sample_id:
+                        sample_names = handler.result_index.index(options.analysis_dir,
+                                                                  handler.get_sample_name)
+                    inventory.update_results(options.analysis_dir, sample_names)
+                    csv_dict, missing_samples_txt, run_dirs = handler.find_missing(
+                        meta_dict, None, options.restore_dir,
+                        inventory.missing_samples(options.analysis_dir, options.alter_sample_id),
+                        inventory.run_dirs()
+                    )
+                    inventory.update_runs(run_dirs)
+                    inventory.update_reads(csv_dict)
+            else:
+                analysis_dir_fnames = handler.parse_dir(options.analysis_dir, options.alter_sample_id)
+                csv_dict, missing_samples_txt, _ = handler.find_missing(
+                    meta_dict, analysis_dir_fnames, options.restore_dir
+                )
             empty_files_dict, csv_dict = handler.remove_empty_files(csv_dict)
             utils.write_out_csv(csv_dict, options.assay, options.platform, options.output_file, options.alter_sample_id)
             utils.write_out_csv(empty_files_dict, options.assay, options.platform, empty_fpath, options.alter_sample_id)
             utils.write_out_txt(missing_samples_txt, log_fpath)
         if options.restore_file:
             bash_fpath = os.path.splitext(options.restore_file)[0] + ".sh"
-            bash_script = handler.create_bash_script(csv_dict, options.restore_dir)
+            bash_script = handler.create_bash_script(csv_dict, options.restore_dir,
+                                                     options.restore_jobs, options.restore_retries)
             utils.write_out_txt(bash_script, bash_fpath)
+        if options.execute:
+            state_fpath = options.restore_state or os.path.join(options.restore_dir, "restore_state.json")
+            restore = Restore(options.restore_jobs, options.restore_retries, state_fpath)
+            failed = restore.run(handler.restore_jobs(csv_dict, options.restore_dir))
+            if failed:
+                handler.save_cache()
+                logger.error('Failed to restore %d jobs from backup.', failed)
+                sys.exit(2)
+        handler.save_cache()
 
     def transform_file_format(self, options):
         """Execute conversion of file formats"""
@@ -137,12 +187,16 @@ class OptionsParser:
         csv_files, assays = handler.fix_csv(options.csv_file, options.output_file, options.alter_sample_id)
         batch_files = handler.fix_sh(options.sh_file, options.output_file, assays) if options.sh_file else options.sh_file
         if (options.remote or options.auto_start) and batch_files:
-            utils.copy_batch_and_csv_files(batch_files, csv_files, options.remote_dir, options.remote_hostname, options.auto_start or options.remote)
-            if options.auto_start:
-                utils.start_remote_pipelines(batch_files, options.remote_hostname, options.remote_dir)
+            with RemoteSession(options.remote_hostname) as session:
+                utils.copy_batch_and_csv_files(batch_files, csv_files, options.remote_dir, options.remote_hostname,
+                                               options.auto_start or options.remote, session)
+                if options.auto_start:
+                    utils.start_remote_pipelines(batch_files, options.remote_hostname, options.remote_dir, session)
 
     def converge_catalogues(self, options):
         """Execute convergence of mutation catalogues"""
+        if options.cache_dir:
+            Utils.downloader.cache = DownloadCache(options.cache_dir, options.offline)
         handler = Converge(options.output_dir)
         handler.run(options.save_dbs)
 
@@ -152,6 +206,17 @@ class OptionsParser:
         json_result = qc.run()
         qc.write_json_result(json_result, options.output_file)
 
+    def call_alleles(self, options):
+        """Call cgMLST alleles by exact match and write JSON result."""
+        if options.scheme_dir:
+            with AlleleIndex(options.index) as allele_index:
+                allele_index.build(options.scheme_dir)
+        result = AlleleCaller(options.index, options.workers).run(
+            options.input_file, options.sample_id, options.targets
+        )
+        with open(options.output_file, 'w', encoding="utf-8") as fout:
+            json.dump(result, fout, indent=2)
+
     def count_reads(self, options):
         """Count reads in FASTQ file(s) and write JSON result."""
         handler = CountReads()
@@ -167,6 +232,11 @@ class OptionsParser:
         """Download cgMLST scheme alleles from PubMLST or BIGSdb Pasteur via OAuth1."""
         BIGSdb(options).run()
 
+    def index_alleles(self, options):
+        """Index downloaded scheme alleles by sequence hash."""
+        with AlleleIndex(options.output_file) as allele_index:
+            allele_index.build(options.scheme_dir)
+
     def concatenate_files(self, options):
         """Concatenate multiple YAML files into one"""
         Concatenate.run(options.input_files, options.output_file)
@@ -3,17 +3,31 @@
 import os
 import sys
 import json
+import warnings
 import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 from jasentool.database import Database
+from jasentool.plot import Plot
+from jasentool.log import get_logger
+
+logger = get_logger(__name__)
 
 class Matrix:
     """Class to validate old pipeline (cgviz) with new pipeline (jasen)"""
-    def __init__(self, input_dir, db_collection):
+    def __init__(self, input_dir, db_collection, plot=None, cluster=False, annot_limit=50,
+                 overview_limit=1000):
         self.input_dir = input_dir
         self.db_collection = db_collection
+        self.render_on_run = plot is None
+        self.plot = plot if plot is not None else Plot()
+        self.cluster = cluster
+        if cluster:
+            try:
+                import scipy.cluster # pylint: disable=import-outside-toplevel,unused-import
+            except ImportError:
+                sys.exit('--cluster requires scipy: pip install "jasentool[cluster]"')
+        self.annot_limit = annot_limit
+        self.overview_limit = overview_limit
 
     def search(self, search_query, search_kw, search_list):
         """Search for query in list of arrays"""
@@ -66,45 +80,59 @@ class Matrix:
                     matrix_df.loc[row_sample, col_sample] = self.compare_cgmlst_alleles(row_sample_cgmlst, col_sample_cgmlst)
         return matrix_df
 
-    def plot_heatmap(self, distance_df, output_plot_fpath):
-        """Plot heatmap"""
-        plt.figure(figsize=(10, 8))
-        sns.heatmap(distance_df, annot=True, cmap="coolwarm", center=0)
-        plt.title("Differential Matrix Heatmap of cgmlst")
-        plt.xlabel("Jasen")
-        plt.ylabel("Cgviz")
-        plt.savefig(output_plot_fpath, dpi=600)
-
-    def plot_matrix_boxplot(self, df, output_plot_fpath):
-        """Plot boxplot of matrix"""
-        plt.figure(figsize=(10, 8))
-        counts = list(df["sum"])
-        sample_ids = list(df["SampleID"])
-        plt.boxplot(counts)
-
-        jitter = 0.04
-        x_jitter = np.random.normal(1, jitter, size=len(counts))
-        plt.scatter(x_jitter, counts, alpha=0.5, color="blue")
+    def cluster_order(self, distance_df):
+        """Reorder matrix rows and columns by hierarchical clustering"""
+        from scipy.cluster import hierarchy # pylint: disable=import-outside-toplevel
+        if len(distance_df.index) < 3:
+            return distance_df
+        values = np.nan_to_num(distance_df.to_numpy(dtype=float))
+        order = hierarchy.leaves_list(hierarchy.linkage(values, method="average"))
+        return distance_df.iloc[order, order]
 
-        plt.xlabel("Samples")
-        plt.ylabel("Sum of sample allele differences")
-        plt.title("Summed differential matrix of distances between pipelines' cgMLST results")
+    def downsample_matrix(self, values, max_bins):
+        """Block-average a square matrix down to at most max_bins x max_bins cells"""
+        n_samples = values.shape[0]
+        bin_size = -(-n_samples // max_bins)
+        n_bins = -(-n_samples // bin_size)
+        padded = np.full((n_bins * bin_size, n_bins * bin_size), np.nan)
+        padded[:n_samples, :n_samples] = values
+        blocks = padded.reshape(n_bins, bin_size, n_bins, bin_size)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            return np.nanmean(blocks, axis=(1, 3))
 
-        for i, count in enumerate(counts):
-            if count > 250000 or count < -750000:
-                if float(x_jitter[i]) < 1:
-                    plt.annotate(f"{sample_ids[i]}", xy=(x_jitter[i] - 0.01, count), xytext=(x_jitter[i] - 0.01, count),
-                                horizontalalignment="right", fontsize=8)
-                else:
-                    plt.annotate(f"{sample_ids[i]}", xy=(x_jitter[i] - 0.01, count), xytext=(x_jitter[i] + 0.01, count),
-                                horizontalalignment="left", fontsize=8)
+    def plot_heatmap(self, distance_df, output_plot_fpath, annot_limit=50, cluster=False,
+                     overview_limit=1000, label_limit=100):
+        """Plot heatmap, dropping annotations and downsampling as the matrix grows"""
+        if cluster:
+            distance_df = self.cluster_order(distance_df)
+        n_samples = len(distance_df.index)
+        title = "Differential Matrix Heatmap of cgmlst"
+        values = distance_df.to_numpy(dtype=float)
+        self.plot.plot_heatmap(values, list(distance_df.index), output_plot_fpath, title,
+                               "Jasen", "Cgviz", annot=n_samples <= annot_limit,
+                               label_limit=label_limit)
+        if n_samples > overview_limit:
+            stem, ext = os.path.splitext(output_plot_fpath)
+            overview = self.downsample_matrix(values, overview_limit)
+            logger.info("Rendering %dx%d overview of %d samples", overview.shape[0],
+                        overview.shape[1], n_samples)
+            self.plot.plot_heatmap(overview, None, f"{stem}_overview{ext}",
+                                   f"{title} (overview, block mean)", "Jasen", "Cgviz",
+                                   label_limit=label_limit)
 
-        plt.tight_layout()
-        plt.savefig(output_plot_fpath, dpi=600)
+    def plot_matrix_boxplot(self, df, output_plot_fpath):
+        """Plot boxplot of matrix"""
+        self.plot.plot_matrix_boxplot(
+            df["SampleID"], df["sum"], output_plot_fpath, "Samples",
+            "Sum of sample allele differences",
+            "Summed differential matrix of distances between pipelines' cgMLST results"
+        )
 
     def run(self, input_files, output_fpaths):
         """Run the matrix analyses"""
         output_csv_fpath = os.path.join(os.path.dirname(output_fpaths[0]), "cgviz_vs_jasen.csv")
+        heatmap_fpath = os.path.join(os.path.dirname(output_fpaths[0]), "cgviz_vs_jasen_heatmap.png")
         boxplot_matrix_fpath = os.path.join(os.path.dirname(output_fpaths[0]), "summed_differential_matrix_boxplot.png")
         sample_ids = [os.path.basename(input_file).replace("_result.json", "") for input_file in input_files]
         cgviz_matrix_df = self.generate_matrix(sample_ids, self.get_cgviz_cgmlst_data)
@@ -112,6 +140,8 @@ class Matrix:
         distance_df = jasen_matrix_df - cgviz_matrix_df
         distance_df = distance_df.astype(float)
         distance_df.to_csv(output_csv_fpath, index=True, header=True)
+        self.plot_heatmap(distance_df, heatmap_fpath, self.annot_limit, self.cluster,
+                          self.overview_limit)
         if os.path.exists(output_csv_fpath):
             distance_df = pd.read_csv(output_csv_fpath, index_col=0)
             distance_df["sum"] = distance_df.sum(axis=1)
@@ -119,3 +149,5 @@ class Matrix:
             distance_df.rename(columns={'index': 'SampleID'}, inplace=True)
             filtered_df = distance_df[["SampleID", "sum"]]
             self.plot_matrix_boxplot(filtered_df, boxplot_matrix_fpath)
+        if self.render_on_run:
+            self.plot.render()
@@ -3,12 +3,61 @@
 import os
 import re
 import json
+import shlex
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from jasentool.dir_index import DirIndex
+from jasentool.result_index import ResultIndex
+from jasentool.run_resolver import RunResolver
+from jasentool.sample_sheet import SampleSheet, SampleRecord
+from jasentool.stat_cache import StatCache
 from jasentool.log import get_logger
 
 logger = get_logger(__name__)
 
+JCP = "/fs2/sw/bnf-scripts/jcp"
+UNSPRING = "/fs2/sw/bnf-scripts/unspring_file.pl"
+JSON_TOKEN_RE = re.compile(rb'[^"{}\[\]]*(?:("(?:[^"\\]|\\.)*")|([{\[])|[}\]])')
+JSON_VALUE_RE = re.compile(rb'\s*:\s*("(?:[^"\\]|\\.)*")?')
+
+class RestoreJob(NamedTuple):
+    """Commands restoring the files of a sample from a single backup source file"""
+    sample_id: str
+    source: str
+    commands: list
+
+
 class Missing:
     """Class for locating expected samples that are missing from a given directory"""
+    dir_index = DirIndex()
+    stat_cache = StatCache()
+    run_resolver = RunResolver(stat_cache=stat_cache)
+    sample_sheets = SampleSheet()
+    result_index = ResultIndex()
+
+    @staticmethod
+    def initialize(cache_dir=None, workers=16, unresolved_ttl=24):
+        """Initialize the filesystem caches shared by Missing lookups"""
+        def cache_fpath(fname):
+            return os.path.join(cache_dir, fname) if cache_dir else None
+
+        Missing.dir_index = DirIndex(cache_fpath("dir_index.json"))
+        Missing.stat_cache.close()
+        Missing.stat_cache = StatCache(workers)
+        Missing.run_resolver = RunResolver(
+            cache_fpath("run_locations.json"), unresolved_ttl * 3600, Missing.stat_cache
+        )
+        Missing.sample_sheets = SampleSheet(cache_fpath("sample_sheets.json"))
+        Missing.result_index = ResultIndex(cache_fpath("sample_names.json"), workers)
+
+    @staticmethod
+    def save_cache():
+        """Persist the filesystem caches"""
+        Missing.dir_index.save()
+        Missing.run_resolver.save()
+        Missing.sample_sheets.save()
+        Missing.result_index.save()
+
     @staticmethod
     def rm_double_dmltplx(read_files):
         """Exclude files that have been demultiplexed twice"""
@@ -25,20 +74,35 @@ class Missing:
     @staticmethod
     def find_files(search_term, parent_dir):
         """Find files in a given directory using a regex search term."""
-        if not os.path.exists(parent_dir):
+        try:
+            search_files = Missing.dir_index.listdir(parent_dir)
+        except Exception as e:
+            logger.error("Could not list files in %s: %s", parent_dir, e)
+            return []
+        if search_files is None:
             logger.warning("%s does not exist! Skipping search.", parent_dir)
             return []
+        search_re = re.compile(search_term)
+        return [
+            os.path.join(parent_dir, search_file) for search_file in search_files
+            if search_re.search(search_file) and not search_file.endswith("~")
+        ]
 
+    @staticmethod
+    def find_prefixed_files(prefix, parent_dir):
+        """Find files in a given directory whose names start with prefix."""
         try:
-            search_files = os.listdir(parent_dir)
-            found_files = sorted(
-                os.path.join(parent_dir, search_file) for search_file in search_files
-                if re.search(search_term, search_file) and not search_file.endswith("~")
-            )
-            return found_files
+            search_files = Missing.dir_index.prefix(parent_dir, prefix)
         except Exception as e:
             logger.error("Could not list files in %s: %s", parent_dir, e)
             return []
+        if search_files is None:
+            logger.warning("%s does not exist! Skipping search.", parent_dir)
+            return []
+        return [
+            os.path.join(parent_dir, search_file) for search_file in search_files
+            if not search_file.endswith("~")
+        ]
 
     @staticmethod
     def edit_read_paths(reads, restore_dir):
@@ -63,16 +127,22 @@ class Missing:
         """Check that file not already coppied to restore directory"""
         checked_reads = []
         restore_dirs = set([restore_dir.rstrip("/"), "/fs2/seqdata/restored"])
+        stat_cache = Missing.stat_cache
+        stat_cache.prefetch(
+            [filepath for filepath in reads if filepath.startswith("/fs")] +
+            [os.path.join(directory, os.path.basename(filepath))
+             for filepath in reads for directory in restore_dirs]
+        )
         for filepath in reads:
             filename = os.path.basename(filepath)
-            if filepath.startswith("/fs") and os.path.exists(filepath):
+            if filepath.startswith("/fs") and stat_cache.exists(filepath):
                 checked_reads.append(filepath)
             else:
                 for directory in restore_dirs:
                     read_fpath = os.path.join(directory, filename)
                     if (
-                        os.path.exists(read_fpath) and
-                        not os.path.isdir(read_fpath) and
+                        stat_cache.exists(read_fpath) and
+                        not stat_cache.isdir(read_fpath) and
                         len(checked_reads) != 2
                     ):
                         checked_reads.append(read_fpath)
@@ -88,128 +158,107 @@ class Missing:
         """Parse sample sheets for sample meta data"""
         csv_dict = {}
         seqrun = Missing.get_seqrun_from_filepath(sample_sheet)
-        with open(sample_sheet, "r", encoding="utf-8") as fin:
-            for line in fin:
-                if line.endswith("saureus\n"):
-                    line = line.rstrip()
-                    sample_id = line.split(",")[-1].split("_")[1]
-                    try:
-                        if seqrun != id_seqrun_dict[sample_id]:
-                            continue
-                    except KeyError:
-                        continue
-                    species = line.split(",")[-1].split("_")[2]
-                    try:
-                        clarity_sample_meta = line.split(",")[0].split(":")[1]
-                    except IndexError:
-                        clarity_sample_meta = line.split(",")[0]
-                    try:
-                        clarity_group_id = clarity_sample_meta.split("_")[1]
-                    except IndexError:
-                        clarity_group_id = clarity_sample_meta
-                    clarity_sample_id = clarity_sample_meta.split("_")[0]
-                    if len(clarity_sample_id) < 4:
-                        clarity_sample_id = sample_id
-                        clarity_group_id = sample_id
-                    if ":" in line:
-                        parent_dir = os.path.join(
-                            line.split(":")[0].rstrip("SampleSheet.csv"),
-                            "Data/Intensities/BaseCalls/"
-                        )
-                    else:
-                        parent_dir = os.path.join(
-                            os.path.dirname(sample_sheet),
-                            "Data/Intensities/BaseCalls/"
+        for record in Missing.sample_sheets.parse(sample_sheet):
+            sample_id = record.sample_id
+            if sample_id not in id_seqrun_dict or seqrun != id_seqrun_dict[sample_id]:
+                continue
+            sample_meta = (record.clarity_sample_id, record.clarity_group_id,
+                           record.species, seqrun)
+            parent_dir = record.basecalls_dir
+            try:
+                paired_reads = Missing.find_prefixed_files(record.clarity_sample_id, parent_dir)
+                if len(paired_reads) == 2 and paired_reads[0].endswith(".gz"):
+                    restored_reads_fpaths = Missing.check_file_cp(paired_reads, restore_dir)
+                    csv_dict[sample_id] = SampleRecord(*sample_meta, restored_reads_fpaths,
+                                                       None, paired_reads)
+                elif len(paired_reads) == 1 and paired_reads[0].endswith(".spring"):
+                    spring_fpaths = paired_reads
+                    (restored_spring_fpaths, paired_reads) = list(map(
+                        Missing.edit_read_paths,
+                        spring_fpaths,
+                        [restore_dir]*len(spring_fpaths)
+                    ))[0]
+                    csv_dict[sample_id] = SampleRecord(*sample_meta, paired_reads,
+                                                       spring_fpaths, restored_spring_fpaths)
+                elif len(paired_reads) == 4 and paired_reads[0].endswith(".gz"):
+                    paired_reads = Missing.rm_double_dmltplx(paired_reads)
+                    if len(paired_reads) == 2:
+                        restored_reads_fpaths = Missing.check_file_cp(paired_reads, restore_dir)
+                        csv_dict[sample_id] = SampleRecord(*sample_meta, restored_reads_fpaths,
+                                                           None, paired_reads)
+                    elif len(paired_reads) == 4:
+                        paired_reads_string = '\n-'.join(paired_reads)
+                        logger.warning(
+                            "There are 4 sets of reads related to sample %s from the %s:\n-%s",
+                            sample_id, parent_dir, paired_reads_string
                         )
-                    try:
-                        paired_reads = Missing.find_files(r'^' + clarity_sample_id, parent_dir)
-                        if len(paired_reads) == 2 and paired_reads[0].endswith(".gz"):
-                            restored_reads_fpaths = Missing.check_file_cp(paired_reads, restore_dir)
-                            csv_dict[sample_id] = [
-                                clarity_sample_id,
-                                clarity_group_id,
-                                species,
-                                seqrun,
-                                restored_reads_fpaths,
-                                None,
-                                paired_reads
-                            ]
-                        elif len(paired_reads) == 1 and paired_reads[0].endswith(".spring"):
-                            spring_fpaths = paired_reads
-                            (restored_spring_fpaths, paired_reads) = list(map(
-                                Missing.edit_read_paths,
-                                spring_fpaths,
-                                [restore_dir]*len(spring_fpaths)
-                            ))[0]
-                            csv_dict[sample_id] = [
-                                clarity_sample_id,
-                                clarity_group_id,
-                                species,
-                                seqrun,
-                                paired_reads,
-                                spring_fpaths,
-                                restored_spring_fpaths
-                            ]
-                        elif len(paired_reads) == 4 and paired_reads[0].endswith(".gz"):
-                            paired_reads = Missing.rm_double_dmltplx(paired_reads)
-                            if len(paired_reads) == 2:
-                                restored_reads_fpaths = Missing.check_file_cp(paired_reads, restore_dir)
-                                csv_dict[sample_id] = [
-                                    clarity_sample_id,
-                                    clarity_group_id,
-                                    species,
-                                    seqrun,
-                                    restored_reads_fpaths,
-                                    None,
-                                    paired_reads
-                                ]
-                            elif len(paired_reads) == 4:
-                                paired_reads_string = '\n-'.join(paired_reads)
-                                logger.warning("There are 4 sets of reads related to sample %s from the %s:\n-%s", sample_id, parent_dir, paired_reads_string)
-
-                        elif len(paired_reads) == 3:
-                            paired_reads = [paired_read for paired_read in paired_reads
-                                            if paired_read.endswith(".fastq.gz")]
-                            restored_reads_fpaths = Missing.check_file_cp(paired_reads, restore_dir)
-                            csv_dict[sample_id] = [
-                                clarity_sample_id,
-                                clarity_group_id,
-                                species,
-                                seqrun,
-                                restored_reads_fpaths,
-                                None,
-                                paired_reads
-                            ]
-                        elif len(paired_reads) == 6:
-                            paired_reads = [paired_read for paired_read in paired_reads
-                                            if paired_read.endswith(".fastq.gz")]
-                            restored_reads_fpaths = Missing.check_file_cp(paired_reads, restore_dir)
-                            csv_dict[sample_id] = [
-                                clarity_sample_id,
-                                clarity_group_id,
-                                species,
-                                seqrun,
-                                restored_reads_fpaths,
-                                None,
-                                paired_reads
-                            ]
-                    except FileNotFoundError:
-                        logger.warning("%s does not exist regarding %s. (sample sheet: %s)", parent_dir, sample_id, sample_sheet)
+
+                elif len(paired_reads) in (3, 6):
+                    paired_reads = [paired_read for paired_read in paired_reads
+                                    if paired_read.endswith(".fastq.gz")]
+                    restored_reads_fpaths = Missing.check_file_cp(paired_reads, restore_dir)
+                    csv_dict[sample_id] = SampleRecord(*sample_meta, restored_reads_fpaths,
+                                                       None, paired_reads)
+            except FileNotFoundError:
+                logger.warning("%s does not exist regarding %s. (sample sheet: %s)",
+                               parent_dir, sample_id, sample_sheet)
 
         return csv_dict
 
+    @staticmethod
+    def parse_sample_sheets(sample_sheets, restore_dir, id_seqrun_dict):
+        """Parse several sample sheets concurrently, returning their csv dicts in input order"""
+        if len(sample_sheets) < 2:
+            return [Missing.parse_sample_sheet(sample_sheet, restore_dir, id_seqrun_dict)
+                    for sample_sheet in sample_sheets]
+        workers = min(Missing.stat_cache.workers, len(sample_sheets))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(
+                lambda sample_sheet: Missing.parse_sample_sheet(
+                    sample_sheet, restore_dir, id_seqrun_dict
+                ),
+                sample_sheets
+            ))
+
     @staticmethod
     def check_format(fpath):
         """Check that filepath has the correct prefix and that it exists"""
+        run_dir = Missing.run_resolver.lookup(fpath)
+        if run_dir is not None:
+            return run_dir
+        run_dir, check_fpath = Missing.probe_run_dir(fpath)
+        Missing.run_resolver.record(fpath, run_dir, check_fpath)
+        return run_dir
+
+    @staticmethod
+    def probe_paths(fpath):
+        """Return every path probe_run_dir may stat for a run"""
+        paths = []
+        for prefix in ("/fs1", "/fs2"):
+            if fpath.startswith(prefix):
+                paths.append(os.path.join(fpath, "Data/Intensities/BaseCalls"))
+                fpath = fpath.replace(prefix, "")
+        if fpath.startswith("NovaSeq"):
+            fpath = "/seqdata/" + fpath
+        if not fpath.startswith("/data"):
+            paths.extend(os.path.join(root + fpath, "Data/Intensities/BaseCalls")
+                         for root in ("/fs2", "/media/isilon/backup_hopper", "/data"))
+            paths.append(fpath)
+        return paths
+
+    @staticmethod
+    def probe_run_dir(fpath):
+        """Probe the known mounts for a run, returning its directory and the path proving it"""
+        stat_cache = Missing.stat_cache
         if (
             fpath.startswith("/fs1") and
-            not os.path.exists(os.path.join(fpath, "Data/Intensities/BaseCalls"))
+            not stat_cache.exists(os.path.join(fpath, "Data/Intensities/BaseCalls"))
         ):
             logger.warning("%s does not exist! Fixing by removing '/fs1' prefix.", fpath)
             fpath = fpath.replace("/fs1", "")
         if (
             fpath.startswith("/fs2") and
-            not os.path.exists(os.path.join(fpath, "Data/Intensities/BaseCalls"))
+            not stat_cache.exists(os.path.join(fpath, "Data/Intensities/BaseCalls"))
         ):
             logger.warning("%s does not exist! Fixing by removing '/fs2' prefix.", fpath)
             fpath = fpath.replace("/fs2", "")
@@ -220,20 +269,65 @@ class Missing:
             fs2_fpath = "/fs2" + fpath
             isilon_fpath = "/media/isilon/backup_hopper" + fpath
             data_fpath = "/data" + fpath
-            if os.path.exists(os.path.join(fs2_fpath, "Data/Intensities/BaseCalls")):
-                return fs2_fpath
-            if os.path.exists(os.path.join(isilon_fpath, "Data/Intensities/BaseCalls")):
-                return isilon_fpath
-            if os.path.exists(os.path.join(data_fpath, "Data/Intensities/BaseCalls")):
-                return data_fpath
-            if os.path.exists(fpath):
-                return fpath.rstrip("Data/Intensities/BaseCalls/")
+            stat_cache.prefetch([
+                os.path.join(fs2_fpath, "Data/Intensities/BaseCalls"),
+                os.path.join(isilon_fpath, "Data/Intensities/BaseCalls"),
+                os.path.join(data_fpath, "Data/Intensities/BaseCalls"),
+                fpath
+            ])
+            for run_fpath in [fs2_fpath, isilon_fpath, data_fpath]:
+                basecalls_fpath = os.path.join(run_fpath, "Data/Intensities/BaseCalls")
+                if stat_cache.exists(basecalls_fpath):
+                    return run_fpath, basecalls_fpath
+            if stat_cache.exists(fpath):
+                return fpath.rstrip("Data/Intensities/BaseCalls/"), fpath
             logger.warning("Base calls for %s cannot be found.", fpath)
-        return fpath
+            return fpath, None
+        return fpath, fpath
+
+    @staticmethod
+    def resolve_run_dirs(runs):
+        """Resolve the run directories of several runs, statting all candidate paths in one batch"""
+        runs = list(dict.fromkeys(runs))
+        paths = []
+        for run in runs:
+            check_paths = Missing.run_resolver.check_paths(run)
+            paths.extend(Missing.probe_paths(run) if check_paths is None else check_paths)
+        Missing.stat_cache.prefetch(paths)
+        return {run: Missing.check_format(run) for run in runs}
 
     @staticmethod
-    def get_sample_name(json_fpath):
-        """Reads a JSON file and retrieves the 'sample_name' from the JSON structure."""
+    def scan_sample_name(fin, chunk_size=65536):
+        """Return the raw string value of the top-level 'sample_name' key, or None if unscannable"""
+        buffer = b""
+        depth = 0
+        while chunk := fin.read(chunk_size):
+            buffer += chunk
+            pos = 0
+            while token := JSON_TOKEN_RE.match(buffer, pos):
+                if token.group(1) is None:
+                    depth += 1 if token.group(2) else -1
+                elif depth == 1 and token.group(1) == b'"sample_name"':
+                    value = JSON_VALUE_RE.match(buffer, token.end())
+                    if value is None and not buffer[token.end():].strip():
+                        break
+                    if value is not None and value.group(1):
+                        return value.group(1)
+                    if value is not None:
+                        if value.end() == len(buffer) or buffer[value.end()] == ord('"'):
+                            break
+                        return None
+                pos = token.end()
+            buffer = buffer[pos:]
+        return None
+
+    @staticmethod
+    def get_sample_name(json_fpath, chunk_size=65536):
+        """Retrieves the 'sample_name' from a JSON file, reading only up to the key if possible."""
+        with open(json_fpath, 'rb') as fin:
+            sample_name = Missing.scan_sample_name(fin, chunk_size)
+        if sample_name is not None:
+            return json.loads(sample_name)
         try:
             with open(json_fpath, 'r') as file:
                 result_json = json.load(file)
@@ -250,15 +344,13 @@ class Missing:
     @staticmethod
     def parse_dir(dir_fpath, alter_sample_id):
         """Return filenames in directory"""
+        if alter_sample_id:
+            sample_names = Missing.result_index.sample_names(dir_fpath, Missing.get_sample_name)
+            return [sample_name for sample_name in sample_names if sample_name]
         dir_fpaths = []
         for filename in os.listdir(dir_fpath):
             if filename.endswith(".json"):
-                if alter_sample_id:
-                    sample_name = Missing.get_sample_name(os.path.join(dir_fpath, filename))
-                    if sample_name:
-                        dir_fpaths.append(sample_name)
-                else:
-                    dir_fpaths.append(filename.split("_")[0])
+                dir_fpaths.append(filename.split("_")[0])
         return dir_fpaths
 
     @staticmethod
@@ -276,72 +368,132 @@ class Missing:
         return filtered_csv_dict, not_found
 
     @staticmethod
-    def find_missing(meta_dict, analysis_dir_fnames, restore_dir):
-        """Find missing samples from jasen results directory"""
-        sample_runs = []
+    def find_missing(meta_dict, analysis_dir_fnames, restore_dir, missing_ids=None,
+                     known_run_dirs=None):
+        """Find missing samples from jasen results directory (or from precomputed missing ids).
+
+        Returns the csv dict, the ids not found in any sample sheet and the run directories
+        used, resolving only runs absent from known_run_dirs.
+        """
+        sample_runs = set()
         missing_samples = []
         csv_dict = {}
         sorted_meta_dict = sorted(meta_dict, key=lambda x: x["run"], reverse=False)
         id_seqrun_dict = {sample["id"]: sample["run"].split("/")[-1] for sample in sorted_meta_dict}
+        if missing_ids is None:
+            analysis_dir_fnames = set(analysis_dir_fnames)
+            missing_ids = {sample["id"] for sample in sorted_meta_dict
+                           if sample["id"] not in analysis_dir_fnames}
+        else:
+            missing_ids = set(missing_ids)
+        known_run_dirs = known_run_dirs or {}
+        missing_runs = {sample["run"] for sample in sorted_meta_dict if sample["id"] in missing_ids}
+        run_dirs = {run: known_run_dirs[run] for run in missing_runs if run in known_run_dirs}
+        run_dirs |= Missing.resolve_run_dirs(run for run in missing_runs if run not in run_dirs)
+        sample_sheets = []
         for sample in sorted_meta_dict:
-            if sample["id"] not in analysis_dir_fnames:
+            if sample["id"] in missing_ids:
                 missing_samples.append(sample["id"])
                 if sample["run"] not in sample_runs:
-                    ss_dict = {}
-                    sample_run_dir = Missing.check_format(sample["run"])
-                    sample_sheets = Missing.find_files(r'.csv$', sample_run_dir)
-                    if sample_sheets:
-                        for sample_sheet in sample_sheets:
-                            ss_dict |= Missing.parse_sample_sheet(sample_sheet, restore_dir, id_seqrun_dict)
-                        csv_dict |= ss_dict
+                    sample_run_dir = run_dirs[sample["run"]]
+                    run_sample_sheets = Missing.find_files(r'.csv$', sample_run_dir)
+                    if run_sample_sheets:
+                        sample_sheets.extend(run_sample_sheets)
                     else:
-                        logger.warning("No sample sheets exist in the following path: %s!", sample['run'])
-                    sample_runs.append(sample["run"])
+                        logger.warning("No sample sheets exist in the following path: %s!",
+                                       sample['run'])
+                    sample_runs.add(sample["run"])
+        for ss_dict in Missing.parse_sample_sheets(sample_sheets, restore_dir, id_seqrun_dict):
+            csv_dict |= ss_dict
 
         logger.info("%d samples found", len(csv_dict.keys()))
         logger.info("%d samples missing", len(missing_samples))
         logger.info("%d duplicate sample ids", len(missing_samples) - len(set(missing_samples)))
         filtered_csv_dict, not_found = Missing.filter_csv_dict(csv_dict, missing_samples)
-        return filtered_csv_dict, "\n".join(not_found)
+        return filtered_csv_dict, "\n".join(not_found), run_dirs
+
+    @staticmethod
+    def restore_jobs(csv_dict, restore_dir):
+        """List the restore jobs of samples, ordered by source volume and descending file size"""
+        jobs = []
+        stat_cache = Missing.stat_cache
+        stat_cache.prefetch(
+            path for record in csv_dict.values()
+            for path in (
+                (record.restored, record.reads[0], record.spring[0]) if record.spring
+                else record.restored
+            )
+        )
+        for sample, record in csv_dict.items():
+            if record.spring:
+                spring_fpath = record.spring[0]
+                if not (stat_cache.exists(record.restored) or stat_cache.exists(record.reads[0])):
+                    jobs.append(RestoreJob(sample, spring_fpath, [
+                        [JCP, spring_fpath, f"{restore_dir}/"],
+                        [UNSPRING, record.restored, f"{restore_dir}/", "WAIT"],
+                    ]))
+            else:
+                for read_fpath in record.restored:
+                    jobs.append(RestoreJob(sample, read_fpath,
+                                           [[JCP, read_fpath, f"{restore_dir}/", "WAIT"]]))
+        return sorted(jobs, key=lambda job: (Missing.source_volume(job.source),
+                                             -Missing.source_size(job.source)))
 
     @staticmethod
-    def create_bash_script(csv_dict, restore_dir):
-        """Create shell script that executes copying of files and starts nextflow analysis"""
-        spring_command = ""
+    def source_volume(fpath):
+        """Return the device of a source file, falling back to its top level directories"""
+        result = Missing.stat_cache.stat(fpath)
+        if result is not None:
+            return str(result.st_dev)
+        return "/".join(os.path.abspath(fpath).split("/")[:3])
+
+    @staticmethod
+    def source_size(fpath):
+        """Return the size of a source file, 0 if it cannot be found"""
+        result = Missing.stat_cache.stat(fpath)
+        return result.st_size if result is not None else 0
+
+    @staticmethod
+    def create_bash_script(csv_dict, restore_dir, max_jobs=4, retries=0):
+        """Create shell script that restores files from backup, running at most max_jobs at once"""
         shell_script_path = 'SCRIPTPATH="$( cd -- "$(dirname "$0")" >/dev/null 2>&1 ; pwd -P )"\n'
-        shell_fail_count = "FAIL=0\n"
-        shell_for_loop = 'for job in $PIDS; do wait $job || let "FAIL+=1"; done \nif [ "$FAIL" != "0" ]; \nthen \n\techo Failed to restore from backup \n\texit 2 \nfi \n'
-        for sample in csv_dict:
-            jcp_command = ""
-            unspring_command = ""
-            try:
-                spring_fpaths, restored_fpaths = csv_dict[sample][5][0], csv_dict[sample][6]
-                read1, _ = csv_dict[sample][4]
-                if not os.path.exists(restored_fpaths) and not os.path.exists(read1):
-                    jcp_command = f'/fs2/sw/bnf-scripts/jcp {spring_fpaths} {restore_dir}/ && '
-                    unspring_command = f'/fs2/sw/bnf-scripts/unspring_file.pl {restored_fpaths} {restore_dir}/ WAIT &\nPIDS="$PIDS $!"\n'
-                spring_command = spring_command + jcp_command + unspring_command
-            except TypeError:
-                for read_fpath in csv_dict[sample][6]:
-                    jcp_command = f'/fs2/sw/bnf-scripts/jcp {read_fpath} {restore_dir}/ WAIT &\nPIDS="$PIDS $!"\n'
-                    spring_command = spring_command + jcp_command
-        bash_script = shell_script_path + shell_fail_count + spring_command + shell_for_loop
+        shell_settings = f"MAX_JOBS={max_jobs}\nRETRIES={retries}\nFAIL=0\nPIDS=\"\"\n"
+        shell_functions = (
+            'throttle() { while [ "$(jobs -rp | wc -l)" -ge "$MAX_JOBS" ]; do sleep 1; done; }\n'
+            'retry() {\n\tlocal n=0\n\tuntil "$@"; do\n\t\tn=$((n+1))\n'
+            '\t\tif [ "$n" -gt "$RETRIES" ]; then return 1; fi\n'
+            '\t\techo "Retrying ($n/$RETRIES): $*" >&2\n\t\tsleep $((n*10))\n\tdone\n}\n'
+        )
+        shell_for_loop = (
+            'for job in $PIDS; do wait $job || let "FAIL+=1"; done \nif [ "$FAIL" != "0" ]; \n'
+            'then \n\techo Failed to restore from backup \n\texit 2 \nfi \n'
+        )
+        restore_command = ""
+        for job in Missing.restore_jobs(csv_dict, restore_dir):
+            job_command = " && ".join(f"retry {shlex.join(command)}" for command in job.commands)
+            restore_command += f'throttle\n( {job_command} ) &\nPIDS="$PIDS $!"\n'
+        bash_script = (shell_script_path + shell_settings + shell_functions + restore_command
+                       + shell_for_loop)
         return bash_script
 
     @staticmethod
     def remove_empty_files(csv_dict):
         """Remove fastq filepaths if the file size is < 10 mb"""
         empty_files_dict = {}
-        for sample in csv_dict:
+        stat_cache = Missing.stat_cache
+        stat_cache.prefetch(read_fpath for record in csv_dict.values()
+                            for read_fpath in record.reads[:2])
+        for sample, record in csv_dict.items():
             try:
-                file_size_r1 = os.path.getsize(csv_dict[sample][4][0]) / (1024 * 1024)
-                file_size_r2 = os.path.getsize(csv_dict[sample][4][1]) / (1024 * 1024)
+                file_size_r1 = stat_cache.getsize(record.reads[0]) / (1024 * 1024)
+                file_size_r2 = stat_cache.getsize(record.reads[1]) / (1024 * 1024)
                 if file_size_r1 < 10 or file_size_r2 < 10:
-                    empty_files_dict[sample] = csv_dict[sample]
+                    empty_files_dict[sample] = record
             except FileNotFoundError:
-                logger.warning("%s read files (%s and/or %s) could not be found!", sample, csv_dict[sample][4][0], csv_dict[sample][4][1])
+                logger.warning("%s read files (%s and/or %s) could not be found!",
+                               sample, record.reads[0], record.reads[1])
             except IndexError:
-                logger.error("Unexpected csv_dict entry for %s: %s", sample, csv_dict[sample])
+                logger.error("Unexpected csv_dict entry for %s: %s", sample, record)
         for empty_file in list(empty_files_dict.keys()):
             csv_dict.pop(empty_file, None)
         return empty_files_dict, csv_dict
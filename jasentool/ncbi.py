@@ -4,13 +4,21 @@
 import os
 import re
 import shutil
+import hashlib
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import pysam
+
+from jasentool.download import Downloader
 from jasentool.log import get_logger
 from jasentool.utils import Utils
 
 logger = get_logger(__name__)
 
+NCBI_REQUESTS_PER_SECOND = 3
+INDEX_EXTENSIONS = (".fai", ".gzi", ".amb", ".ann", ".bwt", ".pac", ".sa")
+
 
 def _mkdir(dirpath):
     os.makedirs(dirpath, exist_ok=True)
@@ -33,32 +41,31 @@ def _remove_dir_content(dirpath):
     _mkdir(dirpath)
 
 
-def _find_files(search_term, parent_dir):
-    try:
-        return sorted([
-            os.path.join(parent_dir, f)
-            for f in os.listdir(parent_dir)
-            if re.search(search_term, f) and not f.endswith("~")
-        ])
-    except FileNotFoundError:
-        logger.warning("Directory does not exist: %s", parent_dir)
-        return []
-
-
 def _index_fasta(command_str, accn, download_dir):
     try:
-        proc = subprocess.Popen(
+        proc = subprocess.run(
             command_str.split(),
             cwd=download_dir,
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
+            check=False,
         )
-        proc.communicate()
+        if proc.returncode:
+            logger.error("Indexing failed for %s (exit code %d): %s", accn, proc.returncode, command_str)
+            return
         logger.info("Indexing complete for %s: %s", accn, command_str)
     except FileNotFoundError:
         logger.error("Indexing tool not found for command: %s", command_str)
 
 
+def _sha256(filepath):
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as fin:
+        for chunk in iter(lambda: fin.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
 class NCBI:
     """Download genome FASTA and GFF from NCBI Datasets v2 API."""
 
@@ -68,17 +75,70 @@ class NCBI:
         self.bwa_index = options.bwa_index
         self.fai_index = options.fai_index
         self.clean = options.clean
+        self.bgzip = getattr(options, "bgzip", False)
+        self.workers = max(1, getattr(options, "workers", 3))
+        self.index_workers = max(1, getattr(options, "index_workers", 1))
+        self.downloader = Downloader(workers=self.workers, rate=NCBI_REQUESTS_PER_SECOND)
 
     def run(self):
-        """Entry point: optionally clean output dir, then download each accession."""
+        """Entry point: optionally clean output dir, then download accessions concurrently,
+        indexing each FASTA as soon as it has been extracted."""
         if self.clean:
             logger.info("Cleaning output directory: %s", self.output_dir)
             _remove_dir_content(self.output_dir)
         _mkdir(self.output_dir)
-        for accn in self.accessions:
-            self._process_accession(accn)
-
-    def _process_accession(self, accn):
+        accessions = list(dict.fromkeys(self.accessions))
+        with ThreadPoolExecutor(max_workers=self.workers) as fetcher, \
+                ThreadPoolExecutor(max_workers=self.index_workers) as indexer:
+            fetches = {fetcher.submit(self._fetch_accession, accn): accn for accn in accessions}
+            indexes = []
+            for future in as_completed(fetches):
+                fasta_dest = future.result()
+                if fasta_dest:
+                    indexes.append(indexer.submit(self._index_accession, fetches[future], fasta_dest))
+            for future in indexes:
+                future.result()
+
+    def _fasta_dest(self, accn):
+        return os.path.join(self.output_dir, f"{accn}.fasta.gz" if self.bgzip else f"{accn}.fasta")
+
+    def _checksum_path(self, accn):
+        return os.path.join(self.output_dir, f"{accn}.sha256")
+
+    def _write_checksums(self, accn, filepaths):
+        with open(self._checksum_path(accn), "w", encoding="utf-8") as fout:
+            for filepath in filepaths:
+                fout.write(f"{_sha256(filepath)}  {os.path.basename(filepath)}\n")
+
+    def _verified(self, accn):
+        """Return True if the outputs of accn exist and match their recorded checksums."""
+        checksum_path = self._checksum_path(accn)
+        if not os.path.exists(checksum_path):
+            return False
+        checksums = {}
+        try:
+            with open(checksum_path, "r", encoding="utf-8") as fin:
+                for line in fin:
+                    if line.strip():
+                        checksum, fname = line.rstrip("\n").split("  ", 1)
+                        checksums[fname] = checksum
+            if os.path.basename(self._fasta_dest(accn)) not in checksums:
+                return False
+            for fname, checksum in checksums.items():
+                filepath = os.path.join(self.output_dir, fname)
+                if not os.path.exists(filepath) or _sha256(filepath) != checksum:
+                    logger.info("Checksum mismatch for %s, downloading %s again.", filepath, accn)
+                    return False
+        except (OSError, ValueError) as exc:
+            logger.info("Unreadable checksums for %s (%s), downloading it again.", accn, exc)
+            return False
+        return True
+
+    def _fetch_accession(self, accn):
+        """Download and extract an accession, returning the FASTA path (None on failure)."""
+        if self._verified(accn):
+            logger.info("Skipping %s: already downloaded and checksum-verified.", accn)
+            return self._fasta_dest(accn)
         logger.info("Processing accession: %s", accn)
         zip_path = os.path.join(self.output_dir, f"{accn}.zip")
         url = (
@@ -86,35 +146,58 @@ class NCBI:
             f"?include_annotation_type=GENOME_FASTA&include_annotation_type=GENOME_GFF"
             f"&include_annotation_type=SEQUENCE_REPORT&hydrated=FULLY_HYDRATED&filename={accn}.zip"
         )
-        if not Utils.download_and_save_file(url, zip_path, max_retries=5):
+        if not self.downloader.download(url, zip_path, max_retries=5):
             logger.error("Skipping %s due to download failure.", accn)
-            return
-        if not Utils.unzip(zip_path, self.output_dir):
+            return None
+        members = Utils.zip_members(zip_path)
+        if members is None:
             logger.error("Skipping %s due to unzip failure.", accn)
             _remove_file(zip_path)
-            return
+            return None
         try:
-            data_dir = os.path.join(self.output_dir, f"ncbi_dataset/data/{accn}")
-            fasta_files = _find_files(rf'^{accn}.*\.(fna|fasta)$', data_dir)
-            if not fasta_files:
+            data_dir = f"ncbi_dataset/data/{accn}/"
+            fasta_regex = re.compile(rf'^{accn}.*\.(fna|fasta)$')
+            fasta_members = sorted(
+                member for member in members
+                if member.startswith(data_dir) and "/" not in member[len(data_dir):]
+                and fasta_regex.search(member[len(data_dir):])
+            )
+            if not fasta_members:
                 logger.warning("No FASTA file found for %s. Skipping.", accn)
-                return
-            fasta_source = fasta_files[0]
-            gff_source = os.path.join(data_dir, "genomic.gff")
-            fasta_dest = os.path.join(self.output_dir, f"{accn}.fasta")
+                return None
+            gff_member = f"{data_dir}genomic.gff"
+            fasta_dest = self._fasta_dest(accn)
             gff_dest = os.path.join(self.output_dir, f"{accn}.gff")
-            if os.path.exists(fasta_source):
-                shutil.copy(fasta_source, fasta_dest)
-                logger.info("Copied FASTA: %s", fasta_dest)
-            if os.path.exists(gff_source):
-                shutil.copy(gff_source, gff_dest)
-                logger.info("Copied GFF: %s", gff_dest)
-            if self.bwa_index:
-                _index_fasta(f"bwa index {fasta_dest}", accn, self.output_dir)
-            if self.fai_index:
-                _index_fasta(f"samtools faidx {fasta_dest}", accn, self.output_dir)
+            for index_ext in INDEX_EXTENSIONS:
+                _remove_file(f"{fasta_dest}{index_ext}")
+            extract = {fasta_members[0]: fasta_dest}
+            if gff_member in members:
+                extract[gff_member] = gff_dest
+            _remove_file(self._checksum_path(accn))
+            bgzip_members = {fasta_members[0]} if self.bgzip else ()
+            if not Utils.extract_members(zip_path, extract, bgzip_members=bgzip_members):
+                logger.error("Skipping %s due to extraction failure.", accn)
+                return None
+            logger.info("Extracted FASTA: %s", fasta_dest)
+            if gff_member in members:
+                logger.info("Extracted GFF: %s", gff_dest)
+            self._write_checksums(accn, extract.values())
+            return fasta_dest
         except Exception as exc:  # pylint: disable=broad-except
             logger.error("Error while processing %s: %s", accn, exc)
+            return None
         finally:
-            _remove_directory(os.path.join(self.output_dir, "ncbi_dataset"))
             _remove_file(zip_path)
+
+    def _index_accession(self, accn, fasta_dest):
+        """Build the requested indexes of a FASTA that are not already present."""
+        try:
+            if self.bwa_index and not os.path.exists(f"{fasta_dest}.bwt"):
+                _index_fasta(f"bwa index {fasta_dest}", accn, self.output_dir)
+            if self.bgzip and not (os.path.exists(f"{fasta_dest}.fai") and os.path.exists(f"{fasta_dest}.gzi")):
+                pysam.faidx(fasta_dest)
+                logger.info("Indexing complete for %s: %s.fai, %s.gzi", accn, fasta_dest, fasta_dest)
+            elif not self.bgzip and self.fai_index and not os.path.exists(f"{fasta_dest}.fai"):
+                _index_fasta(f"samtools faidx {fasta_dest}", accn, self.output_dir)
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.error("Error while indexing %s: %s", accn, exc)
@@ -1,53 +1,224 @@
 """Module for plotting graphs"""
 
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt # pylint: disable=wrong-import-position
+import seaborn as sns # pylint: disable=wrong-import-position
+
+from jasentool.log import get_logger # pylint: disable=wrong-import-position
+
+logger = get_logger(__name__)
+
+
+def _render_barplot(fig, data, xlabel, ylabel, title):
+    """Draw a barplot of category counts"""
+    ax = fig.add_subplot()
+    bars = ax.bar(data["categories"], data["counts"], color="skyblue")
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    ax.tick_params(axis="x", labelrotation=90)
+    for plot_bar in bars:
+        yval = plot_bar.get_height()
+        ax.text(plot_bar.get_x() + plot_bar.get_width()/2, yval + 1, yval, ha="center", va="bottom")
+    fig.tight_layout()
+
+
+def _render_boxplot(fig, data, xlabel, title, threshold=None):
+    """Draw a boxplot of counts, annotating the minimum and values above threshold"""
+    ax = fig.add_subplot()
+    counts = data["counts"]
+    ax.boxplot(counts, vert=True, patch_artist=True)
+    ax.set_xlabel(xlabel)
+    ax.set_title(title)
+    min_value = np.min(counts)
+    ax.annotate(f"Min: {min_value}", xy=(1, min_value), xytext=(1.05, min_value),
+        arrowprops={"facecolor": 'red', "shrink": 0.05},
+        horizontalalignment="left")
+    if threshold:
+        for key, value in zip(data["labels"], counts):
+            if value > threshold:
+                ax.annotate(f"{key} ({value})", xy=(1, value), xytext=(1.1, value),
+                    arrowprops={"facecolor": 'red', "shrink": 0.05},
+                    horizontalalignment="left", color="red")
+
+
+def _render_matrix_boxplot(fig, data, xlabel, ylabel, title):
+    """Draw a jittered boxplot of summed matrix differences, labelling outliers"""
+    ax = fig.add_subplot()
+    counts = data["counts"]
+    sample_ids = data["labels"]
+    ax.boxplot(counts)
+
+    jitter = 0.04
+    x_jitter = np.random.normal(1, jitter, size=len(counts))
+    ax.scatter(x_jitter, counts, alpha=0.5, color="blue")
+
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+
+    for i, count in enumerate(counts):
+        if count > 250000 or count < -750000:
+            if float(x_jitter[i]) < 1:
+                ax.annotate(f"{sample_ids[i]}", xy=(x_jitter[i] - 0.01, count), xytext=(x_jitter[i] - 0.01, count),
+                            horizontalalignment="right", fontsize=8)
+            else:
+                ax.annotate(f"{sample_ids[i]}", xy=(x_jitter[i] - 0.01, count), xytext=(x_jitter[i] + 0.01, count),
+                            horizontalalignment="left", fontsize=8)
+    fig.tight_layout()
+
+
+def _render_heatmap(fig, data, title, xlabel, ylabel, annot=False, label_limit=100):
+    """Draw a matrix heatmap, annotated per cell or as a single image"""
+    ax = fig.add_subplot()
+    values = np.array(data["values"], dtype=float)
+    labels = data.get("labels")
+    if annot:
+        sns.heatmap(values, xticklabels=labels, yticklabels=labels,
+                    annot=True, cmap="coolwarm", center=0, ax=ax)
+    else:
+        vmax = np.nanmax(np.abs(values)) if np.isfinite(values).any() else 1.0
+        vmax = vmax or 1.0
+        image = ax.imshow(np.ma.masked_invalid(values), cmap="coolwarm", vmin=-vmax, vmax=vmax,
+                          interpolation="nearest", aspect="auto")
+        fig.colorbar(image, ax=ax)
+        if labels is not None and len(labels) <= label_limit:
+            ax.set_xticks(range(len(labels)), labels, rotation=90, fontsize=6)
+            ax.set_yticks(range(len(labels)), labels, fontsize=6)
+        else:
+            ax.set_xticks([])
+            ax.set_yticks([])
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    fig.tight_layout()
+
+
+def _to_json(obj):
+    """Serialise numpy values in plot data"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+RENDERERS = {
+    "barplot": _render_barplot,
+    "boxplot": _render_boxplot,
+    "matrix_boxplot": _render_matrix_boxplot,
+    "heatmap": _render_heatmap,
+}
+
+
+def render_job(job, dpi=600):
+    """Render a single queued plot job to file, always closing its figure"""
+    fig = plt.figure(figsize=(10, 8))
+    try:
+        RENDERERS[job["kind"]](fig, job["data"], **job["kwargs"])
+        fig.savefig(job["output_plot_fpath"], dpi=dpi)
+    finally:
+        plt.close(fig)
+    return job["output_plot_fpath"]
+
 
 class Plot:
-    """Class for plotting graphs"""
+    """Class for queueing and rendering graphs headlessly"""
+    def __init__(self, dpi=600, fmt="png", data_only=False, workers=1):
+        self.dpi = dpi
+        self.fmt = fmt
+        self.data_only = data_only
+        self.workers = workers
+        self.queue = []
+
+    def _output_fpath(self, output_plot_fpath):
+        """Swap the plot filepath extension for the configured output format"""
+        return f"{os.path.splitext(output_plot_fpath)[0]}.{self.fmt}"
+
+    def submit(self, kind, data, output_plot_fpath, **kwargs):
+        """Queue a plot job for rendering"""
+        output_plot_fpath = self._output_fpath(output_plot_fpath)
+        self.queue.append({"kind": kind, "data": data,
+                           "output_plot_fpath": output_plot_fpath, "kwargs": kwargs})
+        return output_plot_fpath
+
     def plot_barplot(self, count_dict, output_plot_fpath, xlabel, ylabel, title, filter_thresh=1000):
         """Plot general barplot"""
         filtered_dict = {k: v for k, v in count_dict.items() if v >= filter_thresh}
         sorted_filtered_dict = dict(sorted(filtered_dict.items(), key=lambda item: item[1]))
-        categories = list(sorted_filtered_dict.keys())
-        counts = list(sorted_filtered_dict.values())
+        data = {"categories": list(sorted_filtered_dict.keys()),
+                "counts": list(sorted_filtered_dict.values())}
+        return self.submit("barplot", data, output_plot_fpath,
+                           xlabel=xlabel, ylabel=ylabel, title=title)
 
-        plt.figure(figsize=(10, 8))
-        bars = plt.bar(categories, counts, color="skyblue")
+    def plot_boxplot(self, count_dict, output_plot_fpath, xlabel, title, threshold=None):
+        """Plot general boxplot, returning the csv of values above threshold"""
+        data = {"labels": list(count_dict.keys()), "counts": list(count_dict.values())}
+        self.submit("boxplot", data, output_plot_fpath, xlabel=xlabel, title=title, threshold=threshold)
+        threshold_csv_output = "sample_name,count\n"
+        if threshold:
+            for key, value in count_dict.items():
+                if value > threshold:
+                    threshold_csv_output += f"{key},{value}\n"
+        return threshold_csv_output
 
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        plt.title(title)
-        plt.xticks(rotation=90)
-        for bar in bars:
-            yval = bar.get_height()
-            plt.text(bar.get_x() + bar.get_width()/2, yval + 1, yval, ha="center", va="bottom")
+    def plot_matrix_boxplot(self, sample_ids, counts, output_plot_fpath, xlabel, ylabel, title):
+        """Plot jittered boxplot of summed matrix differences"""
+        data = {"labels": list(sample_ids), "counts": list(counts)}
+        return self.submit("matrix_boxplot", data, output_plot_fpath,
+                           xlabel=xlabel, ylabel=ylabel, title=title)
 
-        plt.tight_layout()
-        plt.savefig(output_plot_fpath, dpi=600)
+    def plot_heatmap(self, values, labels, output_plot_fpath, title, xlabel, ylabel,
+                     annot=False, label_limit=100):
+        """Plot matrix heatmap"""
+        data = {"values": np.asarray(values, dtype=float),
+                "labels": list(labels) if labels is not None else None}
+        return self.submit("heatmap", data, output_plot_fpath, title=title, xlabel=xlabel,
+                           ylabel=ylabel, annot=annot, label_limit=label_limit)
 
-    def plot_boxplot(self, count_dict, output_plot_fpath, xlabel, title, threshold=None):
-        """Plot general boxplot"""
-        counts = list(count_dict.values())
-        plt.figure(figsize=(10, 8))
-        plt.boxplot(counts, vert=True, patch_artist=True)
-        plt.xlabel(xlabel)
-        plt.title(title)
+    def write_data_files(self, jobs):
+        """Write plot jobs out as json data files for later rendering"""
+        data_fpaths = []
+        for job in jobs:
+            data_fpath = os.path.splitext(job["output_plot_fpath"])[0] + ".plot.json"
+            with open(data_fpath, 'w', encoding="utf-8") as fout:
+                json.dump(job, fout, default=_to_json)
+            data_fpaths.append(data_fpath)
+        return data_fpaths
 
-        min_value = np.min(counts)
+    def render(self):
+        """Render all queued plots (or write their data files) and empty the queue"""
+        jobs, self.queue = self.queue, []
+        if not jobs:
+            return []
+        if self.data_only:
+            logger.info("Writing %d plot data files", len(jobs))
+            return self.write_data_files(jobs)
+        logger.info("Rendering %d plots with %d worker(s)", len(jobs), self.workers)
+        if self.workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(jobs))) as executor:
+                return list(executor.map(render_job, jobs, [self.dpi] * len(jobs)))
+        return [render_job(job, self.dpi) for job in jobs]
 
-        plt.annotate(f"Min: {min_value}", xy=(1, min_value), xytext=(1.05, min_value),
-            arrowprops={"facecolor": 'red', "shrink": 0.05},
-            horizontalalignment="left")
+    def load_data_file(self, data_fpath):
+        """Return the plot job of a json data file, writing its plot next to the data file"""
+        with open(data_fpath, 'r', encoding="utf-8") as fin:
+            job = json.load(fin)
+        output_fname = os.path.basename(self._output_fpath(job["output_plot_fpath"]))
+        job["output_plot_fpath"] = os.path.join(os.path.dirname(data_fpath), output_fname)
+        return job
 
-        if threshold:
-            threshold_csv_output = "sample_name,count\n"
-            for key, value in count_dict.items():
-                if value > threshold:
-                    threshold_csv_output += f"{key},{value}\n"
-                    plt.annotate(f"{key} ({value})", xy=(1, value), xytext=(1.1, value),
-                        arrowprops={"facecolor": 'red', "shrink": 0.05},
-                        horizontalalignment="left", color="red")
-            return threshold_csv_output
-        plt.savefig(output_plot_fpath, dpi=600)
-        return "sample_name,count\n"
+    def render_data_file(self, data_fpath):
+        """Render a plot from a json data file written with data_only"""
+        return render_job(self.load_data_file(data_fpath), self.dpi)
+
+    def render_data_files(self, data_fpaths):
+        """Queue the plots of json data files written with data_only and render them"""
+        self.queue.extend(self.load_data_file(data_fpath) for data_fpath in data_fpaths)
+        return self.render()
@@ -2,6 +2,8 @@
 
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 import pysam
 import numpy as np
@@ -10,6 +12,132 @@ from jasentool.log import get_logger
 
 logger = get_logger(__name__)
 
+MAX_INSERT_SIZES = 1_000_000
+COVERAGE_BATCH = 1 << 20
+MIN_REGION_SIZE = 100_000
+MAX_REGION_SIZE = 5_000_000
+REGIONS_PER_CPU = 4
+UNPLACED = "*"
+# SAM flag bits
+FPAIRED = 0x1
+FPROPER_PAIR = 0x2
+FUNMAP = 0x4
+FREAD1 = 0x40
+FSECONDARY = 0x100
+FQCFAIL = 0x200
+FDUP = 0x400
+FSUPPLEMENTARY = 0x800
+
+STAT_KEYS = ('n_reads', 'n_dup_reads', 'n_mapped_reads', 'n_read_pairs')
+
+
+def add_spans(diff, starts, ends):
+    """Add buffered read spans to a coverage difference array and clear the buffers"""
+    np.add.at(diff, np.array(starts, dtype=np.int64), 1)
+    np.add.at(diff, np.array(ends, dtype=np.int64), -1)
+    starts.clear()
+    ends.clear()
+
+
+def depth_histogram(depth, windows, targets=None):
+    """Return counts of positions per depth over the windows, or over the targets within them.
+
+    targets maps contig to (start, end) intervals in window coordinates; overlapping
+    intervals are counted once each.
+    """
+    hist = np.zeros(1, dtype=np.int64)
+    for contig, offset, length in windows:
+        window = depth[offset:offset + length]
+        if targets is None:
+            slices = [window]
+        else:
+            slices = [window[max(start, 0):min(end, length)] for start, end in targets.get(contig, ())]
+        for values in slices:
+            hist = merge_histograms(hist, np.bincount(values, minlength=1))
+    return hist
+
+
+def merge_histograms(hist, other):
+    """Return the element-wise sum of two depth histograms of any length"""
+    if len(other) > len(hist):
+        hist, other = other, hist
+    hist = hist.astype(np.int64, copy=True)
+    hist[:len(other)] += other
+    return hist
+
+
+def scan_alignments(bam_fpath, region=None, threads=1, targets=None):
+    """Scan the reads starting in region (the whole file when None) in one pass.
+
+    Returns flagstat counts, proper-pair insert sizes in file order, the depth histogram
+    of the region (restricted to targets, a {contig: [(start, end)]} dict, when given)
+    and whether the first read is paired. Coverage of reads overlapping a region is
+    clipped to it, so adjacent regions add up.
+    """
+    stats = dict.fromkeys(STAT_KEYS, 0)
+    insert_sizes = []
+    first_read = None
+    with pysam.AlignmentFile(bam_fpath, "rb", threads=threads) as bam:
+        if region is None:
+            reads = bam.fetch(until_eof=True)
+            contigs = list(zip(bam.references, bam.lengths))
+            (clip_start, clip_end, count_from) = (0, None, -1)
+        elif region == UNPLACED:
+            reads = bam.fetch(UNPLACED)
+            contigs = []
+            (clip_start, clip_end, count_from) = (0, None, -1)
+        else:
+            (contig, clip_start, clip_end) = region
+            reads = bam.fetch(contig, clip_start, clip_end)
+            contigs = [(contig, clip_end - clip_start)]
+            count_from = clip_start
+        # one coverage difference array for all windows, each padded by a base for read ends
+        windows = []
+        offsets = {}
+        size = 0
+        for contig, length in contigs:
+            windows.append((contig, size, length))
+            offsets[bam.get_tid(contig)] = size - clip_start
+            size += length + 1
+        diff = np.zeros(size, dtype=np.int32)
+        starts = []
+        ends = []
+        for read in reads:
+            if first_read is None:
+                first_read = read
+            flag = read.flag
+            if read.reference_start >= count_from:
+                if not flag & FQCFAIL:
+                    # flagstat QC-passed counts: total, then primary duplicates/mapped/read1
+                    stats['n_reads'] += 1
+                    if not flag & (FSECONDARY | FSUPPLEMENTARY):
+                        stats['n_dup_reads'] += bool(flag & FDUP)
+                        stats['n_mapped_reads'] += not flag & FUNMAP
+                        stats['n_read_pairs'] += flag & (FPAIRED | FREAD1) == FPAIRED | FREAD1
+                if (flag & (FREAD1 | FPROPER_PAIR) == FREAD1 | FPROPER_PAIR
+                        and len(insert_sizes) < MAX_INSERT_SIZES and read.template_length > 0):
+                    insert_sizes.append(read.template_length)
+            if not flag & FUNMAP:
+                offset = offsets[read.reference_id]
+                read_start = read.reference_start
+                read_end = read.reference_end
+                if clip_end is not None:
+                    read_start = max(read_start, clip_start)
+                    read_end = min(read_end, clip_end)
+                starts.append(offset + read_start)
+                ends.append(offset + read_end)
+                if len(starts) >= COVERAGE_BATCH:
+                    add_spans(diff, starts, ends)
+        add_spans(diff, starts, ends)
+    # spans never cross a window's padding base, so one cumulative sum serves every window
+    depth = np.cumsum(diff, dtype=np.int32)
+    if targets is not None:
+        targets = {contig: [(start - clip_start, end - clip_start) for start, end in intervals]
+                   for contig, intervals in targets.items()}
+    hist = depth_histogram(depth, windows, targets)
+    return stats, insert_sizes, hist, bool(first_read and first_read.is_paired)
+
+
 class QC:
     """Class for retrieving qc results"""
     def __init__(self, args):
@@ -18,7 +146,7 @@ class QC:
         self.bed = args.bed
         self.sample_id = args.sample_id
         self.cpus = args.cpus
-        self.paired = self.is_paired()
+        self.paired = False
 
     def write_json_result(self, json_result, output_filepath):
         """Write out json file"""
@@ -36,62 +164,119 @@ class QC:
             first_read = next(iter(bam), None)
             return bool(first_read and first_read.is_paired)
 
-    def get_base_coverage(self):
-        """Compute per-base coverage; BED-region or genome-wide depending on self.bed"""
-        if self.bed is not None:
+    def _can_split(self):
+        """Return True if the BAM is coordinate-sorted and indexed for region fetches"""
+        with pysam.AlignmentFile(self.bam, "rb") as bam:
+            if bam.header.to_dict().get("HD", {}).get("SO") != "coordinate":
+                logger.warning("%s is not coordinate-sorted, scanning it in one process with whole-genome coverage", self.bam)
+                return False
+        try:
             self._ensure_index()
+        except (pysam.utils.SamtoolsError, OSError) as exc:
+            logger.warning("Cannot index %s (%s), scanning it in one process with whole-genome coverage", self.bam, exc)
+            return False
+        return True
+
+    def regions(self):
+        """Split the contigs into about REGIONS_PER_CPU regions per cpu, followed by the unplaced reads"""
         with pysam.AlignmentFile(self.bam, "rb") as bam:
-            if self.bed is not None:
-                depths = []
-                with open(self.bed, "r", encoding="utf-8") as bed_fh:
-                    for line in bed_fh:
-                        parts = line.strip().split("\t")
-                        chrom, start, end = parts[0], int(parts[1]), int(parts[2])
-                        region_cov = np.zeros(end - start, dtype=np.int32)
-                        for col in bam.pileup(chrom, start, end, truncate=True,
-                                              min_base_quality=0, stepper="nofilter"):
-                            region_cov[col.reference_pos - start] = col.nsegments
-                        depths.extend(region_cov.tolist())
-                return np.array(depths, dtype=np.int32)
-            else:
-                refs = list(bam.header.references)
-                ref_lengths = [bam.header.get_reference_length(r) for r in refs]
-                total_bases = sum(ref_lengths)
-                coverage = np.zeros(total_bases, dtype=np.int32)
-                offsets, offset = {}, 0
-                for ref, length in zip(refs, ref_lengths):
-                    offsets[ref] = offset
-                    offset += length
-                for col in bam.pileup(min_base_quality=0, stepper="nofilter"):
-                    coverage[offsets[col.reference_name] + col.reference_pos] = col.nsegments
-                return coverage
-
-    def _parse_flagstat(self):
-        """Parse pysam.flagstat() output to extract read counts"""
-        stats = {'n_reads': 0, 'n_dup_reads': 0, 'n_mapped_reads': 0, 'n_read_pairs': 0}
-        for line in pysam.flagstat(self.bam).splitlines():
-            count = int(line.split(' + ')[0])
-            if 'in total' in line:
-                stats['n_reads'] = count
-            elif 'primary duplicates' in line:
-                stats['n_dup_reads'] = count
-            elif 'primary mapped' in line:
-                stats['n_mapped_reads'] = count
-            elif 'read1' in line:
-                stats['n_read_pairs'] = count
-        return stats
-
-    def _collect_insert_sizes(self):
-        """Compute median insert size and std dev via pysam"""
+            contigs = list(zip(bam.references, bam.lengths))
+        total = sum(length for _, length in contigs)
+        region_size = min(MAX_REGION_SIZE, max(MIN_REGION_SIZE, -(-total // (self.cpus * REGIONS_PER_CPU))))
+        regions = [(contig, start, min(start + region_size, length))
+                   for contig, length in contigs for start in range(0, length, region_size)]
+        regions.append(UNPLACED)
+        return regions
+
+    def read_targets(self):
+        """Return the BED intervals as {contig: [(start, end)]}, or None without a BED file"""
+        if self.bed is None:
+            return None
+        targets = {}
+        with open(self.bed, "r", encoding="utf-8") as bed_fh:
+            for line in bed_fh:
+                parts = line.strip().split("\t")
+                targets.setdefault(parts[0], []).append((int(parts[1]), int(parts[2])))
+        return targets
+
+    @staticmethod
+    def region_targets(targets, region):
+        """Return the targets overlapping a region, or None to count every position"""
+        if targets is None:
+            return None
+        if region == UNPLACED:
+            return {}
+        (contig, start, end) = region
+        return {contig: [(max(bed_start, start), min(bed_end, end)) for bed_start, bed_end in targets.get(contig, ())
+                         if bed_start < end and bed_end > start]}
+
+    def scan(self):
+        """Collect flagstat counts, insert sizes and the depth histogram in one pass over the BAM.
+
+        With more than one cpu a coordinate-sorted BAM is indexed if needed and its regions are
+        scanned in a process pool; otherwise the whole genome is held in memory for a single pass.
+        """
+        targets = self.read_targets()
+        if self.cpus <= 1 or not self._can_split():
+            stats, insert_sizes, hist, self.paired = scan_alignments(self.bam, threads=max(1, self.cpus),
+                                                                     targets=targets)
+            return stats, insert_sizes, hist
+        self.paired = self.is_paired()
+        regions = self.regions()
+        logger.info("Scanning %d regions with %d processes", len(regions), self.cpus)
+        stats = dict.fromkeys(STAT_KEYS, 0)
         insert_sizes = []
-        with pysam.AlignmentFile(self.bam, "rb") as bam:
-            count = 0
-            for read in bam:
-                if read.is_read1 and read.is_proper_pair and read.template_length > 0:
-                    insert_sizes.append(read.template_length)
-                    count += 1
-                    if count >= 1_000_000:
-                        break
+        hist = np.zeros(1, dtype=np.int64)
+        region_targets = [self.region_targets(targets, region) for region in regions]
+        with ProcessPoolExecutor(max_workers=self.cpus) as executor:
+            results = executor.map(scan_alignments, repeat(self.bam), regions, repeat(1),
+                                   region_targets)
+            for region_stats, region_inserts, region_hist, _ in results:
+                for key, count in region_stats.items():
+                    stats[key] += count
+                # regions are in file order, so this keeps the first insert sizes of a serial scan
+                insert_sizes.extend(region_inserts[:MAX_INSERT_SIZES - len(insert_sizes)])
+                hist = merge_histograms(hist, region_hist)
+        return stats, insert_sizes, hist
+
+    @staticmethod
+    def coverage_stats(hist, thresholds):
+        """Return mean, quartiles, median and pct_above_x from a depth histogram.
+
+        Quartiles use the linear interpolation of np.percentile and the median the mean
+        of the middle values, as for the per-base depth array.
+        """
+        tot_bases = int(hist.sum())
+        if not tot_bases:
+            return 0.0, 0.0, 0.0, 0.0, {t: 0.0 for t in thresholds}
+        cum_bases = np.cumsum(hist)
+
+        def depth_at(idx):
+            return int(np.searchsorted(cum_bases, idx, side="right"))
+
+        def percentile(pct):
+            virtual_idx = (tot_bases - 1) * (pct / 100)
+            lower = int(np.floor(virtual_idx))
+            gamma = virtual_idx - lower
+            low = depth_at(lower)
+            high = depth_at(min(lower + 1, tot_bases - 1))
+            if gamma >= 0.5:
+                return float(high - (high - low) * (1 - gamma))
+            return float(low + (high - low) * gamma)
+
+        mean_cov = float(int(np.dot(np.arange(len(hist), dtype=np.int64), hist)) / tot_bases)
+        middle = tot_bases // 2
+        if tot_bases % 2:
+            median_cov = float(depth_at(middle))
+        else:
+            median_cov = float((depth_at(middle - 1) + depth_at(middle)) / 2)
+        above = tot_bases - np.concatenate(([0], cum_bases))
+        above_pct = {t: round(100 * float(above[t] if t < len(above) else 0) / tot_bases, 6)
+                     for t in thresholds}
+        return mean_cov, percentile(25), median_cov, percentile(75), above_pct
+
+    def _set_insert_sizes(self, insert_sizes):
+        """Set median insert size and std dev"""
         if insert_sizes:
             arr = np.array(insert_sizes)
             self.results['ins_size'] = round(float(np.median(arr)), 6)
@@ -99,34 +284,17 @@ class QC:
 
     def run(self):
         """Run QC info extraction"""
-        logger.info("Collecting basic stats...")
-        fs = self._parse_flagstat()
+        logger.info("Collecting basic stats, insert sizes and coverage...")
+        fs, insert_sizes, hist = self.scan()
 
         if self.paired:
-            logger.info("Collect insert sizes...")
-            self._collect_insert_sizes()
+            self._set_insert_sizes(insert_sizes)
 
         thresholds = [1, 10, 30, 100, 250, 500, 1000]
 
         logger.info("Collecting depth stats...")
-        depths = self.get_base_coverage()
-        tot_bases = len(depths)
-
-        if tot_bases:
-            mean_cov = float(np.mean(depths))
-            q1 = float(np.percentile(depths, 25))
-            median_cov = float(np.median(depths))
-            q3 = float(np.percentile(depths, 75))
-            coverage_uniformity = (q3 - q1) / median_cov if median_cov else 0.0
-            above_pct = {t: round(100 * float(np.sum(depths >= t)) / tot_bases, 6)
-                         for t in thresholds}
-        else:
-            mean_cov = 0.0
-            q1 = 0.0
-            median_cov = 0.0
-            q3 = 0.0
-            coverage_uniformity = 0.0
-            above_pct = {t: 0.0 for t in thresholds}
+        mean_cov, q1, median_cov, q3, above_pct = self.coverage_stats(hist, thresholds)
+        coverage_uniformity = (q3 - q1) / median_cov if median_cov else 0.0
 
         self.results['pct_above_x'] = above_pct
         self.results['mean_cov'] = mean_cov
@@ -0,0 +1,83 @@
+"""Module for running commands and copies on a remote host over one multiplexed SSH connection"""
+
+import os
+import shlex
+import shutil
+import tempfile
+import subprocess
+from jasentool.log import get_logger
+
+logger = get_logger(__name__)
+
+class RemoteSession:
+    """Class authenticating once to a remote host and multiplexing ssh/scp over an OpenSSH ControlMaster"""
+    def __init__(self, hostname, ssh="ssh", scp="scp", control_persist=60):
+        self.hostname = hostname
+        self.ssh = ssh
+        self.scp = scp
+        self.control_persist = control_persist
+        self.control_dir = None
+
+    @property
+    def control_path(self):
+        """Return the path of the control socket, or None without a master connection"""
+        return os.path.join(self.control_dir, "master.sock") if self.control_dir else None
+
+    def options(self):
+        """Return the ssh/scp options reusing the control socket, if any"""
+        if self.control_dir is None:
+            return []
+        return ["-o", f"ControlPath={self.control_path}", "-o", "ControlMaster=no"]
+
+    def open(self):
+        """Authenticate and start the master connection in the background, falling back to plain ssh"""
+        self.control_dir = tempfile.mkdtemp(prefix="jasentool-ssh-")
+        try:
+            subprocess.run(
+                [self.ssh, "-M", "-N", "-f", "-o", f"ControlPath={self.control_path}",
+                 "-o", f"ControlPersist={self.control_persist}", self.hostname],
+                check=True
+            )
+        except (subprocess.CalledProcessError, OSError) as error_code:
+            logger.warning("Could not open multiplexed SSH connection to %s, using plain ssh: %s",
+                           self.hostname, error_code)
+            shutil.rmtree(self.control_dir, ignore_errors=True)
+            self.control_dir = None
+            return self
+        logger.info("Opened multiplexed SSH connection to %s", self.hostname)
+        return self
+
+    def close(self):
+        """Stop the master connection and remove its control directory"""
+        if self.control_dir is None:
+            return
+        subprocess.run([self.ssh, *self.options(), "-O", "exit", self.hostname],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+        self.control_dir = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run(self, args, check=True):
+        """Run a command on the remote host and wait for it"""
+        return subprocess.run([self.ssh, *self.options(), self.hostname, shlex.join(args)], check=check)
+
+    def launch(self, args, log_fpath="/dev/null"):
+        """Start a command detached on the remote host with nohup, writing its output to log_fpath.
+
+        The ssh session ends as soon as the command is started, so launched commands neither hold
+        a session slot of the master connection (sshd MaxSessions) nor keep it open.
+        """
+        command = f"nohup {shlex.join(args)} > {shlex.quote(log_fpath)} 2>&1 < /dev/null &"
+        return subprocess.run([self.ssh, *self.options(), self.hostname, command], check=False)
+
+    def copy(self, fpaths, remote_dir, check=True):
+        """Copy local files into a remote directory"""
+        return subprocess.run(
+            [self.scp, *self.options(), *fpaths, f"{self.hostname}:{remote_dir}"],
+            stdout=subprocess.PIPE, universal_newlines=True, check=check
+        )
@@ -0,0 +1,107 @@
+"""Module for executing restores of sequencing data from backup"""
+
+import os
+import json
+import time
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from jasentool.missing import JCP
+from jasentool.log import get_logger
+
+logger = get_logger(__name__)
+
+class Restore:
+    """Class running a restore plan with a bounded worker pool and a resumable state file"""
+    def __init__(self, workers=4, retries=0, state_fpath=None, retry_delay=10):
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.state_fpath = state_fpath
+        self.done = self._load()
+
+    def _load(self):
+        """Load the keys of jobs completed by previous runs"""
+        if not self.state_fpath or not os.path.exists(self.state_fpath):
+            return set()
+        try:
+            with open(self.state_fpath, 'r', encoding="utf-8") as fin:
+                return set(json.load(fin)["done"])
+        except (OSError, KeyError, json.JSONDecodeError) as error_code:
+            logger.warning("Ignoring unreadable restore state %s: %s", self.state_fpath, error_code)
+            return set()
+
+    def save(self):
+        """Persist the keys of completed jobs"""
+        if not self.state_fpath:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_fpath)), exist_ok=True)
+        tmp_fpath = f"{self.state_fpath}.tmp"
+        with open(tmp_fpath, 'w', encoding="utf-8") as fout:
+            json.dump({"done": sorted(self.done)}, fout, indent=1)
+        os.replace(tmp_fpath, self.state_fpath)
+
+    @staticmethod
+    def job_key(job):
+        """Return the key identifying a job in the state file"""
+        return f"{job.sample_id}:{job.source}"
+
+    @staticmethod
+    def copy_file(source_fpath, target_dir):
+        """Copy a file into a directory via a temporary file, returning the number of bytes copied"""
+        os.makedirs(target_dir, exist_ok=True)
+        target_fpath = os.path.join(target_dir, os.path.basename(source_fpath))
+        tmp_fpath = f"{target_fpath}.part"
+        shutil.copyfile(source_fpath, tmp_fpath)
+        os.replace(tmp_fpath, target_fpath)
+        return os.path.getsize(target_fpath)
+
+    @staticmethod
+    def run_command(command):
+        """Run a restore command, copying natively in place of jcp"""
+        if command[0] == JCP:
+            return Restore.copy_file(command[1], command[2])
+        subprocess.run(command, check=True)
+        return 0
+
+    def run_job(self, job):
+        """Run the commands of a job in order, retrying failed commands"""
+        n_bytes = 0
+        for command in job.commands:
+            attempt = 0
+            while True:
+                try:
+                    n_bytes += self.run_command(command)
+                    break
+                except (OSError, subprocess.CalledProcessError) as error_code:
+                    attempt += 1
+                    if attempt > self.retries:
+                        raise
+                    logger.warning("Retrying (%d/%d) %s: %s", attempt, self.retries, job.source, error_code)
+                    time.sleep(self.retry_delay * attempt)
+        return n_bytes
+
+    def run(self, jobs):
+        """Run all jobs not completed before, returning the number of failed jobs"""
+        pending = [job for job in jobs if self.job_key(job) not in self.done]
+        if len(pending) < len(jobs):
+            logger.info("Skipping %d restore jobs completed by a previous run.", len(jobs) - len(pending))
+        failed = 0
+        total_bytes = 0
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.run_job, job): job for job in pending}
+            for idx, future in enumerate(as_completed(futures), 1):
+                job = futures[future]
+                try:
+                    total_bytes += future.result()
+                except (OSError, subprocess.CalledProcessError) as error_code:
+                    failed += 1
+                    logger.error("Failed to restore %s (%s): %s", job.sample_id, job.source, error_code)
+                else:
+                    self.done.add(self.job_key(job))
+                    self.save()
+                elapsed = max(time.monotonic() - start, 1e-6)
+                logger.info("Restored %d/%d jobs, %.1f MB copied (%.1f MB/s)", idx, len(pending),
+                            total_bytes / (1024 * 1024), total_bytes / (1024 * 1024) / elapsed)
+        return failed
@@ -0,0 +1,53 @@
+"""Module for indexing the sample names of analysis result files"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from jasentool.json_cache import JsonCache
+from jasentool.log import get_logger
+
+logger = get_logger(__name__)
+
+class ResultIndex(JsonCache):
+    """Class caching the sample name of each result file, keyed by filename and mtime"""
+    description = "result index"
+
+    def __init__(self, cache_fpath=None, workers=16):
+        super().__init__(cache_fpath)
+        self.workers = workers
+        self.indexed = self.load()
+
+    def contents(self):
+        """Return the indexed sample names"""
+        return self.indexed
+
+    def sample_names(self, dir_fpath, get_sample_name):
+        """Return the sample names of the json files in dir_fpath, reading only changed files"""
+        return list(self.index(dir_fpath, get_sample_name).values())
+
+    def index(self, dir_fpath, get_sample_name):
+        """Return {fname: sample_name} of the json files in dir_fpath, reading only changed files"""
+        key = os.path.normpath(dir_fpath)
+        cached = self.indexed.get(key, {})
+        index = {}
+        pending = []
+        with os.scandir(key) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json"):
+                    continue
+                mtime = entry.stat().st_mtime_ns
+                if entry.name in cached and cached[entry.name][0] == mtime:
+                    index[entry.name] = cached[entry.name]
+                else:
+                    pending.append((entry.name, entry.path, mtime))
+        if pending:
+            logger.info("Reading sample names from %d of %d result files",
+                        len(pending), len(index) + len(pending))
+            workers = max(1, min(self.workers, len(pending)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                names = executor.map(get_sample_name, [fpath for _, fpath, _ in pending])
+                for (fname, _, mtime), sample_name in zip(pending, names):
+                    index[fname] = [mtime, sample_name]
+        if pending or len(index) != len(cached):
+            self.indexed[key] = index
+            self.modified = True
+        return {fname: sample_name for fname, (_, sample_name) in index.items()}
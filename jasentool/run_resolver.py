@@ -0,0 +1,56 @@
+"""Module for caching the resolved locations of sequencing runs"""
+
+import time
+from jasentool.stat_cache import StatCache
+from jasentool.json_cache import JsonCache
+from jasentool.log import get_logger
+
+logger = get_logger(__name__)
+
+class RunResolver(JsonCache):
+    """Class recording the canonical location of sequencing runs in a small on-disk store"""
+    description = "run location store"
+    indent = 1
+
+    def __init__(self, store_fpath=None, negative_ttl=24 * 3600, stat_cache=None):
+        super().__init__(store_fpath)
+        self.negative_ttl = negative_ttl
+        self.stat_cache = stat_cache if stat_cache is not None else StatCache()
+        self.locations = self.load()
+
+    def contents(self):
+        """Return the recorded run locations"""
+        return self.locations
+
+    def check_paths(self, run):
+        """Return the paths lookup will stat to revalidate run, or None if run has to be probed"""
+        entry = self.locations.get(run)
+        if entry is None:
+            return None
+        if entry["found"]:
+            return [entry["check"]]
+        if time.time() - entry["checked"] < self.negative_ttl:
+            return []
+        return None
+
+    def lookup(self, run):
+        """Return the recorded directory of a run if it is still valid, otherwise None"""
+        entry = self.locations.get(run)
+        if entry is None:
+            return None
+        if entry["found"]:
+            if self.stat_cache.exists(entry["check"]):
+                return entry["path"]
+            logger.info("Recorded location of %s (%s) is gone, resolving again.",
+                        run, entry["path"])
+        elif time.time() - entry["checked"] < self.negative_ttl:
+            return entry["path"]
+        del self.locations[run]
+        self.modified = True
+        return None
+
+    def record(self, run, path, check_fpath=None):
+        """Record the resolved directory of a run, or an unresolved run when check_fpath is None"""
+        self.locations[run] = {"path": path, "found": check_fpath is not None,
+                               "check": check_fpath, "checked": time.time()}
+        self.modified = True
@@ -0,0 +1,85 @@
+"""Module for parsing sample sheets into structured records"""
+
+import os
+from typing import NamedTuple
+from jasentool.json_cache import JsonCache
+
+class SampleSheetRecord(NamedTuple):
+    """Sample meta data from a single sample sheet line"""
+    sample_id: str
+    species: str
+    clarity_sample_id: str
+    clarity_group_id: str
+    basecalls_dir: str
+
+
+class SampleRecord(NamedTuple):
+    """Read files of a sample and where to restore them from.
+
+    For springs, spring lists the backed up spring file and restored is its path in the restore
+    directory; for fastqs, spring is None and restored lists the backed up read files.
+    """
+    lims_id: str
+    group: str
+    species: str
+    seqrun: str
+    reads: list
+    spring: list | None
+    restored: str | list
+
+
+class SampleSheet(JsonCache):
+    """Class parsing sample sheets once, with parsed records cached by sheet mtime"""
+    description = "sample sheet cache"
+
+    def __init__(self, cache_fpath=None):
+        super().__init__(cache_fpath)
+        self.parsed = self.load()
+
+    def contents(self):
+        """Return the parsed sample sheets"""
+        return self.parsed
+
+    @staticmethod
+    def parse_line(line, sample_sheet):
+        """Tokenize a saureus sample sheet line once into a record"""
+        fields = line.split(",")
+        sample_fields = fields[-1].split("_")
+        sample_id, species = sample_fields[1], sample_fields[2]
+        meta_fields = fields[0].split(":")
+        clarity_sample_meta = meta_fields[1] if len(meta_fields) > 1 else fields[0]
+        clarity_fields = clarity_sample_meta.split("_")
+        clarity_sample_id = clarity_fields[0]
+        clarity_group_id = clarity_fields[1] if len(clarity_fields) > 1 else clarity_sample_meta
+        if len(clarity_sample_id) < 4:
+            clarity_sample_id = sample_id
+            clarity_group_id = sample_id
+        if ":" in line:
+            run_dir = line.split(":", 1)[0].rstrip("SampleSheet.csv")
+        else:
+            run_dir = os.path.dirname(sample_sheet)
+        basecalls_dir = os.path.join(run_dir, "Data/Intensities/BaseCalls/")
+        return SampleSheetRecord(sample_id, species, clarity_sample_id, clarity_group_id,
+                                 basecalls_dir)
+
+    def read(self, sample_sheet):
+        """Read all saureus records of a sample sheet"""
+        records = []
+        with open(sample_sheet, "r", encoding="utf-8") as fin:
+            for line in fin:
+                if line.endswith("saureus\n"):
+                    records.append(self.parse_line(line.rstrip(), sample_sheet))
+        return records
+
+    def parse(self, sample_sheet):
+        """Return the records of a sample sheet, re-reading it only if its mtime changed"""
+        mtime = os.stat(sample_sheet).st_mtime_ns
+        cached = self.parsed.get(sample_sheet)
+        if cached and cached["mtime"] == mtime:
+            return [SampleSheetRecord(*record) for record in cached["records"]]
+        records = self.read(sample_sheet)
+        self.parsed[sample_sheet] = {
+            "mtime": mtime, "records": [list(record) for record in records]
+        }
+        self.modified = True
+        return records
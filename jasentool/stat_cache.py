@@ -0,0 +1,83 @@
+"""Module for memoized, concurrent filesystem stat lookups"""
+
+import os
+import stat
+import errno
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class StatCache:
+    """Class memoizing stat results per invocation and resolving batches of paths concurrently.
+
+    All prefetches share one pool of at most workers threads, so prefetching from inside another
+    thread pool adds threads instead of multiplying them.
+    """
+    def __init__(self, workers=16):
+        self.workers = workers
+        self.results = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """Return the shared stat thread pool, creating it on first use"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="stat")
+            return self._executor
+
+    def close(self):
+        """Shut down the shared stat thread pool"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    @staticmethod
+    def _stat(path):
+        """Stat a path, returning None where os.path.exists would be False"""
+        try:
+            return os.stat(path)
+        except (OSError, ValueError):
+            return None
+
+    def stat(self, path):
+        """Return the memoized stat result of path (None if it does not exist)"""
+        path = os.fspath(path)
+        try:
+            return self.results[path]
+        except KeyError:
+            result = self._stat(path)
+            self.results[path] = result
+            return result
+
+    def exists(self, path):
+        """Memoized os.path.exists"""
+        return self.stat(path) is not None
+
+    def isdir(self, path):
+        """Memoized os.path.isdir"""
+        result = self.stat(path)
+        return result is not None and stat.S_ISDIR(result.st_mode)
+
+    def getsize(self, path):
+        """Memoized os.path.getsize"""
+        result = self.stat(path)
+        if result is None:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), os.fspath(path))
+        return result.st_size
+
+    def prefetch(self, paths):
+        """Stat all paths not yet seen concurrently in the shared thread pool"""
+        pending = list(dict.fromkeys(
+            os.fspath(path) for path in paths if path and os.fspath(path) not in self.results
+        ))
+        if not pending:
+            return
+        if len(pending) == 1 or self.workers < 2:
+            for path in pending:
+                self.results[path] = self._stat(path)
+            return
+        for path, result in zip(pending, self.executor.map(self._stat, pending)):
+            self.results[path] = result
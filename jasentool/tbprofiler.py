@@ -164,10 +164,11 @@ class Tbprofiler:
             return ["large_deletion"]
         sys.exit(f"{mut} is not a valid formatted mutation... Exiting!")
 
-    def _parse(self, download_dir):
-        utils = Utils()
-        tbdb_url = "https://raw.githubusercontent.com/jodyphelan/tbdb/master/tbdb.csv"
-        tbdb_filepath = os.path.join(download_dir, "tbdb.csv")
-        utils.download_and_save_file(tbdb_url, tbdb_filepath)
+    def _parse(self, download_dir, tbdb_filepath=None):
+        if tbdb_filepath is None:
+            utils = Utils()
+            tbdb_url = "https://raw.githubusercontent.com/jodyphelan/tbdb/master/tbdb.csv"
+            tbdb_filepath = os.path.join(download_dir, "tbdb.csv")
+            utils.download_and_save_file(tbdb_url, tbdb_filepath)
         tbdb_df = pd.read_csv(tbdb_filepath, header=0)
         return tbdb_df
@@ -3,38 +3,34 @@
 import os
 import csv
 import shutil
+import sqlite3
 import pathlib
-import subprocess
-from time import sleep
+from contextlib import nullcontext
 from zipfile import ZipFile, BadZipFile
-import requests
+import pysam
+from jasentool.download import Downloader
+from jasentool.remote import RemoteSession
 from jasentool.log import get_logger
 
 logger = get_logger(__name__)
 
 class Utils:
     """Class containing utilities used throughout jasentool"""
+    downloader = Downloader()
+
     @staticmethod
     def write_out_csv(csv_dict, assay, platform, out_fpath, alter_sample_id=False):
-        """Write out file as csv"""
+        """Stream sample records out as csv"""
         with open(out_fpath, 'w+', encoding="utf-8") as csvfile:
-            fieldnames = ["id", "clarity_sample_id", "sample_name", "group", "species", "assay",
-                          "platform", "sequencing_run", "read1", "read2"]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            for sample in csv_dict:
-                lims_id = csv_dict[sample][0]
-                sequencing_run = csv_dict[sample][3]
-                sample_id = str(lims_id.lower() + "_" + sequencing_run.lower()) if alter_sample_id else sample
-                row_dict = {"id": sample_id,
-                            "clarity_sample_id": lims_id,
-                            "sample_name": sample,
-                            "group": csv_dict[sample][1], "species": csv_dict[sample][2],
-                            "assay": assay, "platform": platform,
-                            "sequencing_run": sequencing_run,
-                            "read1": csv_dict[sample][4][0],
-                            "read2": csv_dict[sample][4][1]}
-                writer.writerow(row_dict)
+            writer = csv.writer(csvfile)
+            writer.writerow(["id", "clarity_sample_id", "sample_name", "group", "species", "assay",
+                             "platform", "sequencing_run", "read1", "read2"])
+            writer.writerows(
+                (f"{record.lims_id.lower()}_{record.seqrun.lower()}" if alter_sample_id else sample,
+                 record.lims_id, sample, record.group, record.species, assay, platform,
+                 record.seqrun, record.reads[0], record.reads[1])
+                for sample, record in csv_dict.items()
+            )
 
     @staticmethod
     def write_out_txt(output_txt, out_fpath):
@@ -52,62 +48,41 @@ class Utils:
         return False
 
     @staticmethod
-    def copy_batch_and_csv_files(batch_files, csv_files, remote_dir, remote_hostname, remote=False):
-        """Copy shell and csv files to desired (remote) location"""
+    def copy_batch_and_csv_files(batch_files, csv_files, remote_dir, remote_hostname,
+                                 remote=False, session=None):
+        """Copy shell and csv files to desired (remote) location, over session when given"""
         if remote:
-            _ = subprocess.run(
-                f'ssh {remote_hostname} mkdir -p {remote_dir}',
-                shell=True
-            )
-            _ = subprocess.run(
-                f'scp {" ".join(batch_files)} {" ".join(csv_files)} {remote_hostname}:{remote_dir}',
-                shell=True,
-                stdout=subprocess.PIPE,
-                universal_newlines=True
-            )
+            with nullcontext(session) if session else RemoteSession(remote_hostname) as ssh_session:
+                if ssh_session.run(["mkdir", "-p", remote_dir], check=False).returncode:
+                    logger.error("Could not create %s on %s", remote_dir, remote_hostname)
+                if ssh_session.copy(batch_files + csv_files, remote_dir, check=False).returncode:
+                    logger.error("Could not copy batch and csv files to %s:%s",
+                                 remote_hostname, remote_dir)
         else:
             pathlib.Path(remote_dir).mkdir(parents=True, exist_ok=True)
             for fin in batch_files + csv_files:
                 shutil.copy(fin, remote_dir)
 
     @staticmethod
-    def start_remote_pipelines(batch_files, remote_hostname, remote_dir):
-        """Start nextflow pipelines on a remote server"""
-        for batch_file in batch_files:
-            if Utils.pipeline_ready(batch_file):
-                sleep(10.0) # Avoid maxing SSH auth connections
-                _ = subprocess.Popen(
-                    ["ssh", remote_hostname,
-                     "bash", f"{remote_dir}/{os.path.basename(batch_file)}"],
-                    close_fds=True
-                )
+    def start_remote_pipelines(batch_files, remote_hostname, remote_dir, session=None):
+        """Start nextflow pipelines on a remote server, over session when given"""
+        with nullcontext(session) if session else RemoteSession(remote_hostname) as ssh_session:
+            for batch_file in batch_files:
+                if Utils.pipeline_ready(batch_file):
+                    remote_batch_file = f"{remote_dir}/{os.path.basename(batch_file)}"
+                    log_fpath = f"{remote_batch_file}.log"
+                    if ssh_session.launch(["bash", remote_batch_file], log_fpath).returncode:
+                        logger.error("Could not start %s on %s", remote_batch_file, remote_hostname)
 
     @staticmethod
-    def download_and_save_file(url, output_filepath, timeout=600, max_retries=1):
+    def download_and_save_file(url, output_filepath, timeout=600, max_retries=3):
         """Download the file and save it to the user-specified path with a timeout."""
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(url, stream=True, timeout=timeout)
-                if response.status_code == 429:
-                    wait_time = (2 ** attempt) + 1
-                    logger.warning("Rate limited (429). Retrying in %d seconds...", wait_time)
-                    sleep(wait_time)
-                    continue
-                response.raise_for_status()
-                with open(output_filepath, 'wb') as output_file:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        output_file.write(chunk)
-                logger.info("File downloaded and saved to: %s", output_filepath)
-                return True
-            except requests.exceptions.RequestException as error_code:
-                wait_time = (2 ** attempt) + 1
-                logger.warning("Attempt %d failed: %s", attempt + 1, error_code)
-                if attempt < max_retries - 1:
-                    logger.info("Retrying in %d seconds...", wait_time)
-                    sleep(wait_time)
-                else:
-                    logger.error("Max retries reached. Giving up.")
-        return False
+        return Utils.downloader.download(url, output_filepath, timeout, max_retries)
+
+    @staticmethod
+    def download_files(downloads, timeout=600, max_retries=3):
+        """Download several (url, output_filepath) pairs concurrently over the shared session."""
+        return Utils.downloader.download_many(downloads, timeout, max_retries)
 
     @staticmethod
     def unzip(zip_file, outdir):
@@ -120,6 +95,38 @@ class Utils:
             return False
         return True
 
+    @staticmethod
+    def zip_members(zip_file):
+        """List the members of a zip file. Returns None if the archive is invalid."""
+        try:
+            with ZipFile(zip_file, 'r') as zip_object:
+                return zip_object.namelist()
+        except BadZipFile:
+            logger.error("Invalid or corrupt zip file: %s", zip_file)
+            return None
+
+    @staticmethod
+    def extract_members(zip_file, members, bgzip_members=()):
+        """Stream selected zip members ({member: destination}) straight to their destinations,
+        bgzip-compressing those in bgzip_members. Returns False if the archive is invalid or
+        lacks a member."""
+        try:
+            with ZipFile(zip_file, 'r') as zip_object:
+                for member, destination in members.items():
+                    tmp_fpath = f"{destination}.part"
+                    with zip_object.open(member) as fin:
+                        with (pysam.BGZFile(tmp_fpath, "wb") if member in bgzip_members
+                              else open(tmp_fpath, "wb")) as fout:
+                            shutil.copyfileobj(fin, fout, 1024 * 1024)
+                    os.replace(tmp_fpath, destination)
+        except BadZipFile:
+            logger.error("Invalid or corrupt zip file: %s", zip_file)
+            return False
+        except KeyError as error_code:
+            logger.error("Missing member in zip file %s: %s", zip_file, error_code)
+            return False
+        return True
+
     @staticmethod
     def copy_file(source, destination):
         """Copy file from source to destination"""
@@ -129,6 +136,19 @@ class Utils:
         except Exception as error_code:
             logger.error("Error copying file: %s", error_code)
 
+    @staticmethod
+    def connect_db(db_fpath, schema, tables, schema_version):
+        """Open a SQLite database, dropping its tables first if they have another schema version"""
+        os.makedirs(os.path.dirname(os.path.abspath(db_fpath)), exist_ok=True)
+        conn = sqlite3.connect(db_fpath)
+        if conn.execute("PRAGMA user_version").fetchone()[0] != schema_version:
+            with conn:
+                for table in tables:
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+                conn.execute(f"PRAGMA user_version = {schema_version}")
+        conn.executescript(schema)
+        return conn
+
     @staticmethod
     def get_aa_dict():
         """Amino acid one letter translations"""
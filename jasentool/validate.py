@@ -12,9 +12,10 @@ logger = get_logger(__name__)
 
 class Validate:
     """Class to validate old pipeline (cgviz) with new pipeline (jasen)"""
-    def __init__(self, input_dir, db_collection):
+    def __init__(self, input_dir, db_collection, plot=None):
         self.input_dir = input_dir
         self.db_collection = db_collection
+        self.plot = plot if plot is not None else Plot()
 
     def get_sample_name(self, results):
         """Get sample ID from input json"""
@@ -130,11 +131,12 @@ class Validate:
         cgmlst_alleles = self.compare_cgmlst_alleles(old_data["cgmlst_alleles"], new_data["cgmlst_alleles"])
         return True, f"{sample_name},{pvl_comp},{mlst_seqtype_comp},{mlst_alleles},{cgmlst_alleles}"
 
-    def run(self, input_files, output_fpaths, combined_output, generate_matrix):
+    def run(self, input_files, output_fpaths, combined_output, generate_matrix, cluster=False,
+            annot_limit=50, overview_limit=1000):
         """Execute validation of new pipeline (jasen)"""
         utils = Utils()
         # Plots
-        plot = Plot()
+        plot = self.plot
         barplot_fpath = os.path.join(os.path.dirname(output_fpaths[0]), "null_alleles_barplot.png")
         sample_null_boxplot_fpath = os.path.join(os.path.dirname(output_fpaths[0]), "sample_null_boxplot.png")
         n_missing_boxplot_fpath = os.path.join(os.path.dirname(output_fpaths[0]), "n_missing_loci_boxplot.png")
@@ -145,8 +147,10 @@ class Validate:
         plot.plot_barplot(null_alleles_count, barplot_fpath, "Alleles", "Count", "Null Allele Count Bar Plot")
         utils.write_out_txt(threshold_csv_output, n_missing_csv_fpath)
         if generate_matrix:
-            matrix = Matrix(self.input_dir, self.db_collection)
+            matrix = Matrix(self.input_dir, self.db_collection, plot, cluster, annot_limit,
+                            overview_limit)
             matrix.run(input_files, output_fpaths)
+        plot.render()
         # csv file headers
         csv_output = "sample_name,pvl,mlst_seqtype,mlst_allele_matches(%),cgmlst_allele_matches(%)"
         mlst_at_header = "old_arcC,new_arcC,old_aroE,new_aroE,old_glpF,new_glpF,old_gmk,new_gmk,old_pta,new_pta,old_tpi,new_tpi,old_yqiL,new_yqiL"
@@ -9,6 +9,11 @@ from jasentool.log import get_logger
 
 logger = get_logger(__name__)
 
+WHO_URL = (
+    "https://raw.githubusercontent.com/GTB-tbsequencing/mutation-catalogue-2023/main/"
+    "Final%20Result%20Files/WHO-UCN-TB-2023.6-eng.xlsx"
+)
+
 class WHO:
     """Class for handling WHO tb mutation catalogue"""
     def __init__(self):
@@ -280,12 +285,11 @@ class WHO:
         """Write results to csv file"""
         classified.to_csv(csv_outpath, index=False)
 
-    def _parse(self, fasta_filepath, gff_filepath, download_dir):
-        """Parse WHO excel file"""
-        utils = Utils()
-        who_url = "https://raw.githubusercontent.com/GTB-tbsequencing/mutation-catalogue-2023/main/Final%20Result%20Files/WHO-UCN-TB-2023.6-eng.xlsx"
-        who_filepath = os.path.join(download_dir, "who.xlsx")
-        utils.download_and_save_file(who_url, who_filepath)
+    def _parse(self, fasta_filepath, gff_filepath, download_dir, who_filepath=None):
+        """Parse WHO excel file, downloading it unless who_filepath is given"""
+        if who_filepath is None:
+            who_filepath = os.path.join(download_dir, "who.xlsx")
+            Utils.download_and_save_file(WHO_URL, who_filepath)
         _, catalogue, _ = self.read_files(gff_filepath, who_filepath, fasta_filepath)
         catalogue.columns = catalogue.columns.str.title()
         catalogue.rename(columns={'Final Confidence Grading': 'WHO Confidence'}, inplace=True)
@@ -0,0 +1,34 @@
+"""Tests for the hashed scheme allele index."""
+import gzip
+import os
+
+from jasentool.allele_index import AlleleIndex
+
+
+def test_allele_index_build_and_update(tmp_path):
+    scheme_dir = tmp_path / "scheme"
+    scheme_dir.mkdir()
+    (scheme_dir / "abcZ.fasta").write_text(">abcZ_1\nACGT\nACGT\n>abcZ_2\nTTTT\n")
+    with gzip.open(scheme_dir / "adk.fasta.gz", "wt") as fout:
+        fout.write(">adk_1\nacgtacgt\n>adk_7\nGGGG\n")
+    (scheme_dir / "manifest.jsonl").write_text("{}\n")
+    db_fpath = str(tmp_path / "alleles.sqlite")
+
+    with AlleleIndex(db_fpath) as allele_index:
+        allele_index.build(str(scheme_dir))
+        assert allele_index.loci() == ["abcZ", "adk"]
+        assert sorted(allele_index.lookup("ACGTACGT")) == [("abcZ", "1"), ("adk", "1")]
+        assert allele_index.lookup_locus("adk", "GGGG") == "7"
+        assert allele_index.lookup_locus("adk", "TTTT") is None
+
+    (scheme_dir / "abcZ.fasta").write_text(">abcZ_1\nACGTACGT\n>abcZ_3\nCCCC\n")
+    os.utime(scheme_dir / "abcZ.fasta", ns=(1, 1))
+    os.remove(scheme_dir / "adk.fasta.gz")
+    with AlleleIndex(db_fpath) as allele_index:
+        allele_index.build(str(scheme_dir))
+        assert allele_index.loci() == ["abcZ"]
+        assert allele_index.lookup("CCCC") == [("abcZ", "3")]
+        assert allele_index.lookup("TTTT") == []
+
+    with AlleleIndex(db_fpath, readonly=True) as allele_index:
+        assert allele_index.lookup_locus("abcZ", "acgtacgt") == "1"
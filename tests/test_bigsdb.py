@@ -0,0 +1,240 @@
+"""Tests for concurrent BIGSdb scheme downloads against a local stand-in server."""
+import gzip
+import json
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from jasentool.bigsdb import BIGSdb
+
+LOCI = [f"LOCUS{idx}" for idx in range(8)]
+
+
+class SchemeHandler(BaseHTTPRequestHandler):
+    """Serve a scheme and per-locus allele FASTA, rejecting the stale session token.
+
+    Loci in failing answer 500 and the others wait delay seconds.
+    """
+    failing = set()
+    delay = 0
+    requests_seen = []
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        if parsed.path == "/db/test_seqdef/schemes/1":
+            body = json.dumps({"loci": [f"{base}/db/test_seqdef/loci/{locus}" for locus in LOCI]})
+            content_type = "application/json"
+        elif parsed.path.endswith("/alleles_fasta"):
+            if parse_qs(parsed.query).get("oauth_token") != ["fresh"]:
+                body = json.dumps({"message": "Invalid session token"})
+                self.send_response(401)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(body.encode())
+                return
+            locus = parsed.path.split("/")[-2]
+            SchemeHandler.requests_seen.append(locus)
+            if locus in SchemeHandler.failing:
+                self.send_error(500)
+                return
+            time.sleep(SchemeHandler.delay)
+            body = f">{locus}_1\nACGT\n"
+            content_type = "text/plain"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def scheme_server():
+    SchemeHandler.failing = set()
+    SchemeHandler.delay = 0
+    SchemeHandler.requests_seen = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SchemeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_scheme_refreshes_session_once(scheme_server, tmp_path):
+    token_dir = tmp_path / "tokens"
+    token_dir.mkdir()
+    (token_dir / "client_credentials").write_text("[test]\nclient_id = id\nclient_secret = secret\n")
+    (token_dir / "session_tokens").write_text("[test]\ntoken = stale\nsecret = stale\n")
+    options = types.SimpleNamespace(
+        key_name="test", token_dir=str(token_dir), site="PubMLST", db=None,
+        url=f"{scheme_server}/db/test_seqdef/schemes/1", setup=False, download_scheme=True,
+        output_dir=str(tmp_path), output_file=None, force=False, cron=True, method="GET", workers=4,
+    )
+    bigsdb = BIGSdb(options)
+    refreshes = []
+
+    def get_new_session_token():
+        refreshes.append(threading.get_ident())
+        return ("fresh", "fresh")
+
+    bigsdb._get_new_session_token = get_new_session_token
+    bigsdb.run()
+    assert len(refreshes) == 1
+    for locus in LOCI:
+        assert (tmp_path / f"{locus}.fasta").read_text() == f">{locus}_1\nACGT\n"
+
+
+class SyncHandler(BaseHTTPRequestHandler):
+    """Serve alleles with datestamps, honouring updated_after on alleles_fasta and the loci list."""
+    alleles = {}
+    requests_seen = []
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        if parsed.path == "/db/test_seqdef/schemes/1":
+            body = json.dumps({"loci": [f"{base}/db/test_seqdef/loci/{locus}" for locus in SyncHandler.alleles]})
+        elif parsed.path == "/db/test_seqdef/loci":
+            updated_after = parse_qs(parsed.query)["alleles_updated_after"][0]
+            SyncHandler.requests_seen.append(("loci", updated_after))
+            body = json.dumps({"loci": [
+                f"{base}/db/test_seqdef/loci/{locus}" for locus, alleles in SyncHandler.alleles.items()
+                if any(datestamp > updated_after for _, _, datestamp in alleles)
+            ]})
+        else:
+            locus = parsed.path.split("/")[-2]
+            updated_after = parse_qs(parsed.query).get("updated_after", [""])[0]
+            SyncHandler.requests_seen.append((locus, updated_after))
+            alleles = [(allele_id, seq) for allele_id, seq, datestamp in SyncHandler.alleles[locus]
+                       if datestamp > updated_after]
+            if not alleles:
+                self.send_error(404)
+                return
+            body = "".join(f">{locus}_{allele_id}\n{seq}\n" for allele_id, seq in alleles)
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+def test_sync_scheme_fetches_only_changed_alleles(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SyncHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/db/test_seqdef/schemes/1"
+    SyncHandler.alleles = {"abcZ": [(1, "ACGT", "2026-01-01"), (2, "ACGG", "2026-01-01")],
+                           "adk": [(1, "TTTT", "2026-01-01")]}
+    SyncHandler.requests_seen = []
+    token_dir = tmp_path / "tokens"
+    token_dir.mkdir()
+    (token_dir / "client_credentials").write_text("[test]\nclient_id = id\nclient_secret = secret\n")
+    (token_dir / "session_tokens").write_text("[test]\ntoken = token\nsecret = secret\n")
+    options = types.SimpleNamespace(
+        key_name="test", token_dir=str(token_dir), site="PubMLST", db=None, url=url, setup=False,
+        download_scheme=True, sync=True, output_dir=str(tmp_path), output_file=None, force=False,
+        cron=True, method="GET", workers=2,
+    )
+    try:
+        BIGSdb(options).run()
+        manifest = BIGSdb._load_manifest(str(tmp_path))
+        assert manifest["abcZ"]["alleles"] == 2
+        assert manifest["adk"]["alleles"] == 1
+        synced = manifest["abcZ"]["synced"]
+
+        SyncHandler.alleles["abcZ"] += [(3, "CCCC", "2099-01-01")]
+        SyncHandler.alleles["abcZ"][1] = (2, "ACGA", "2099-01-01")
+        SyncHandler.requests_seen = []
+        BIGSdb(options).run()
+        assert sorted(locus for locus, updated_after in SyncHandler.requests_seen if updated_after) == ["abcZ", "loci"]
+        assert (tmp_path / "abcZ.fasta").read_text() == ">abcZ_1\nACGT\n>abcZ_2\nACGA\n>abcZ_3\nCCCC\n"
+        assert (tmp_path / "adk.fasta").read_text() == ">adk_1\nTTTT\n"
+        assert all(updated_after < synced for _, updated_after in SyncHandler.requests_seen)
+        manifest = BIGSdb._load_manifest(str(tmp_path))
+        assert manifest["abcZ"]["alleles"] == 3
+        assert manifest["adk"]["synced"] >= synced
+
+        SyncHandler.alleles["abcZ"] = [(allele_id, seq, "2026-01-01")
+                                       for allele_id, seq, _ in SyncHandler.alleles["abcZ"]]
+        SyncHandler.requests_seen = []
+        BIGSdb(options).run()
+        assert [locus for locus, _ in SyncHandler.requests_seen] == ["loci"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_download_scheme_resumes_from_manifest(scheme_server, tmp_path):
+    token_dir = tmp_path / "tokens"
+    token_dir.mkdir()
+    (token_dir / "client_credentials").write_text("[test]\nclient_id = id\nclient_secret = secret\n")
+    (token_dir / "session_tokens").write_text("[test]\ntoken = fresh\nsecret = fresh\n")
+    options = types.SimpleNamespace(
+        key_name="test", token_dir=str(token_dir), site="PubMLST", db=None,
+        url=f"{scheme_server}/db/test_seqdef/schemes/1", setup=False, download_scheme=True,
+        output_dir=str(tmp_path), output_file=None, force=False, cron=True, method="GET", workers=4, gzip=True,
+    )
+    (tmp_path / "LOCUS0.fasta.gz").write_bytes(b"partial")
+    BIGSdb(options).run()
+    manifest = BIGSdb._load_manifest(str(tmp_path))
+    assert sorted(manifest) == LOCI
+    for locus in LOCI:
+        with gzip.open(tmp_path / f"{locus}.fasta.gz", "rt") as file_handle:
+            assert file_handle.read() == f">{locus}_1\nACGT\n"
+        assert manifest[locus]["alleles"] == 1
+    assert not list(tmp_path.glob("*.part"))
+
+    (tmp_path / "LOCUS3.fasta.gz").write_bytes(b"truncated")
+    rewritten = tmp_path / "LOCUS5.fasta.gz"
+    rewritten.write_bytes(bytes(len(rewritten.read_bytes())))
+    with open(tmp_path / "manifest.jsonl", "a", encoding="utf-8") as file_handle:
+        for locus in ("LOCUS6", "LOCUS7"):
+            legacy = {key: value for key, value in manifest[locus].items() if key != "mtime_ns"}
+            file_handle.write(json.dumps(legacy) + "\n")
+        file_handle.write('{"locus": "LOC')
+    corrupted = tmp_path / "LOCUS7.fasta.gz"
+    corrupted.write_bytes(corrupted.read_bytes()[:-8] + bytes(8))
+    bigsdb = BIGSdb(options)
+    downloaded = []
+    download_locus = bigsdb._download_locus
+
+    def record_download(locus_url, output_dir):
+        downloaded.append(locus_url)
+        return download_locus(locus_url, output_dir)
+
+    bigsdb._download_locus = record_download
+    bigsdb.run()
+    assert sorted(url.rsplit("/", 1)[1] for url in downloaded) == ["LOCUS3", "LOCUS5", "LOCUS7"]
+    assert len((tmp_path / "manifest.jsonl").read_text().splitlines()) == len(LOCI)
+    assert "mtime_ns" not in BIGSdb._load_manifest(str(tmp_path))["LOCUS6"]
+
+
+def test_download_scheme_cancels_pending_loci_on_error(scheme_server, tmp_path):
+    token_dir = tmp_path / "tokens"
+    token_dir.mkdir()
+    (token_dir / "client_credentials").write_text("[test]\nclient_id = id\nclient_secret = secret\n")
+    (token_dir / "session_tokens").write_text("[test]\ntoken = fresh\nsecret = fresh\n")
+    options = types.SimpleNamespace(
+        key_name="test", token_dir=str(token_dir), site="PubMLST", db=None,
+        url=f"{scheme_server}/db/test_seqdef/schemes/1", setup=False, download_scheme=True,
+        output_dir=str(tmp_path), output_file=None, force=False, cron=True, method="GET", workers=2,
+    )
+    SchemeHandler.failing = {"LOCUS0"}
+    SchemeHandler.delay = 0.2
+    with pytest.raises(SystemExit) as exit_info:
+        BIGSdb(options).run()
+    assert exit_info.value.code == 1
+    assert len(SchemeHandler.requests_seen) < len(LOCI)
+    manifest = BIGSdb._load_manifest(str(tmp_path))
+    assert "LOCUS0" not in manifest
+    assert all((tmp_path / f"{locus}.fasta").exists() for locus in manifest)
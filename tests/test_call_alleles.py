@@ -0,0 +1,76 @@
+"""Tests for exact-match cgMLST allele calling."""
+import json
+import random
+
+from click.testing import CliRunner
+
+from jasentool.allele_index import AlleleIndex
+from jasentool.call_alleles import AlleleCaller
+from jasentool.cli import cli
+
+
+def _random_seq(rng, length):
+    return "".join(rng.choice("ACGT") for _ in range(length))
+
+
+def test_call_alleles_exact_novel_and_missing(tmp_path):
+    rng = random.Random(1)
+    scheme_dir = tmp_path / "scheme"
+    scheme_dir.mkdir()
+    loci = {locus: [_random_seq(rng, 300) for _ in range(3)]
+            for locus in ("abcZ", "adk", "gdh", "pta", "tkt")}
+    loci["adk"].append(loci["adk"][0][:150] + loci["adk"][1][150:])
+    for locus, alleles in loci.items():
+        (scheme_dir / f"{locus}.fasta").write_text(
+            "".join(f">{locus}_{idx}\n{seq}\n" for idx, seq in enumerate(alleles, 1))
+        )
+    novel = loci["gdh"][0][:100] + "T" * 20 + loci["gdh"][0][120:]
+    contig1 = _random_seq(rng, 500) + loci["abcZ"][1] + _random_seq(rng, 500) + novel
+    contig2 = _random_seq(rng, 200) + AlleleCaller.reverse_complement(loci["adk"][3]) + _random_seq(rng, 200)
+    contig2 += loci["tkt"][0] + _random_seq(rng, 200) + loci["tkt"][2]
+    assembly = tmp_path / "S1.fasta"
+    assembly.write_text(f">contig1\n{contig1}\n>contig2\n{contig2.lower()}\n")
+    targets = tmp_path / "targets.tsv"
+    targets.write_text("Locus\tConsensus\n"
+                       + "".join(f"{locus}\tx\n" for locus in ("pta", "gdh", "adk", "abcZ", "tkt")))
+    output = tmp_path / "S1_cgmlst.json"
+
+    result = CliRunner().invoke(cli, [
+        "call-alleles", "-i", str(assembly), "-x", str(tmp_path / "alleles.sqlite"), "-o", str(output),
+        "--scheme-dir", str(scheme_dir), "--targets", str(targets), "--workers", "2",
+    ])
+    assert result.exit_code == 0, result.output
+    cgmlst = json.loads(output.read_text())["typing_result"][0]
+    assert cgmlst["type"] == "cgmlst"
+    assert list(cgmlst["result"]["alleles"].items()) == [
+        ("pta", "LNF"), ("gdh", "INF"), ("adk", 4), ("abcZ", 2), ("tkt", "NIPH")
+    ]
+    assert cgmlst["result"]["n_missing"] == 1
+    assert cgmlst["result"]["n_novel"] == 1
+
+
+def test_call_alleles_across_chunk_boundaries(tmp_path):
+    rng = random.Random(2)
+    scheme_dir = tmp_path / "scheme"
+    scheme_dir.mkdir()
+    loci = {f"locus{idx}": [_random_seq(rng, 300), _random_seq(rng, 320)] for idx in range(6)}
+    for locus, alleles in loci.items():
+        (scheme_dir / f"{locus}.fasta").write_text(
+            "".join(f">{locus}_{idx}\n{seq}\n" for idx, seq in enumerate(alleles, 1))
+        )
+    index_fpath = str(tmp_path / "alleles.sqlite")
+    with AlleleIndex(index_fpath) as allele_index:
+        allele_index.build(str(scheme_dir))
+    novel = loci["locus5"][0][:100] + "A" * 20 + loci["locus5"][0][120:]
+    contig = "".join(_random_seq(rng, 137) + seq for seq in (
+        loci["locus0"][0], loci["locus1"][1], AlleleCaller.reverse_complement(loci["locus2"][0]),
+        loci["locus3"][1], novel
+    )) + _random_seq(rng, 50)
+    assembly = tmp_path / "S1.fasta"
+    assembly.write_text(f">contig1\n{contig}\n")
+    expected = {"locus0": 1, "locus1": 2, "locus2": 1, "locus3": 2, "locus4": "LNF", "locus5": "INF"}
+
+    caller = AlleleCaller(index_fpath, workers=2, chunk_size=250)
+    assert len(list(caller.chunks(contig, 384))) == -(-len(contig) // 250)
+    assert caller.call(str(assembly)) == expected
+    assert AlleleCaller(index_fpath, workers=2, chunk_size=7).call(str(assembly)) == expected
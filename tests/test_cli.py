@@ -120,7 +120,7 @@ def test_transform_cgmlst_csv_bed_columns(cgmlst_csv, tmp_path):
 @pytest.mark.parametrize("subcommand", [
     "find", "validate-pipelines", "identify-missing",
     "reformat-csv", "converge-catalogues", "post-align-qc",
-    "concatenate-files", "create-yaml",
+    "concatenate-files", "create-yaml", "render-plots",
 ])
 def test_help_exits_zero(subcommand):
     result = runner.invoke(cli, [subcommand, "--help"])
@@ -138,6 +138,7 @@ def test_help_exits_zero(subcommand):
     ("reformat-csv", []),
     ("concatenate-files", []),
     ("create-yaml", []),
+    ("render-plots", []),
 ])
 def test_missing_required_args(subcommand, args):
     result = runner.invoke(cli, [subcommand] + args)
@@ -222,6 +223,19 @@ def test_annotate_delly(delly_bcf_path, delly_bed_path, tmp_path):
     assert out.exists()
 
 
+# ── render-plots ──────────────────────────────────────────────────────────────
+
+def test_render_plots(tmp_path):
+    job = {"kind": "boxplot", "data": {"labels": ["S1", "S2"], "counts": [1, 5]},
+           "output_plot_fpath": "/elsewhere/box.png", "kwargs": {"xlabel": "x", "title": "Boxes"}}
+    (tmp_path / "box.plot.json").write_text(json.dumps(job))
+    result = runner.invoke(cli, [
+        "render-plots", "--input-dir", str(tmp_path), "--plot-format", "svg", "--plot-dpi", "50",
+    ])
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "box.svg").stat().st_size > 0
+
+
 # ── post-align-qc ─────────────────────────────────────────────────────────────
 
 def test_post_align_qc(saureus_bam_path, tmp_path):
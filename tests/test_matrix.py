@@ -0,0 +1,73 @@
+"""Tests for the cgMLST differential matrix heatmap."""
+import sys
+import types
+
+import numpy as np
+import pytest
+import pandas as pd
+
+from jasentool.matrix import Matrix
+from jasentool.plot import Plot
+
+
+def _distance_df(n_samples):
+    sample_ids = [f"S{idx}" for idx in range(n_samples)]
+    values = np.arange(n_samples * n_samples, dtype=float).reshape(n_samples, n_samples)
+    return pd.DataFrame(values, index=sample_ids, columns=sample_ids)
+
+
+def test_downsample_matrix_block_means():
+    values = np.arange(25, dtype=float).reshape(5, 5)
+    values[0, 0] = np.nan
+    overview = Matrix(None, None).downsample_matrix(values, 2)
+    assert overview.shape == (2, 2)
+    assert overview[0, 0] == np.mean([1, 2, 5, 6, 7, 10, 11, 12])
+    assert overview[1, 1] == np.mean([18, 19, 23, 24])
+    assert Matrix(None, None).downsample_matrix(values, 5).shape == (5, 5)
+
+
+def test_cluster_order_reorders_rows_and_columns(monkeypatch):
+    hierarchy = types.SimpleNamespace(linkage=lambda values, method: (values, method),
+                                      leaves_list=lambda linkage: np.array([2, 0, 1]))
+    monkeypatch.setitem(sys.modules, "scipy", types.ModuleType("scipy"))
+    monkeypatch.setitem(sys.modules, "scipy.cluster", types.SimpleNamespace(hierarchy=hierarchy))
+    clustered = Matrix(None, None).cluster_order(_distance_df(3))
+    assert list(clustered.index) == ["S2", "S0", "S1"]
+    assert list(clustered.columns) == ["S2", "S0", "S1"]
+    assert clustered.loc["S2", "S0"] == 6
+
+
+def test_cluster_without_scipy_fails(monkeypatch):
+    monkeypatch.setitem(sys.modules, "scipy", None)
+    with pytest.raises(SystemExit, match="requires scipy"):
+        Matrix(None, None, cluster=True)
+    assert not Matrix(None, None).cluster
+
+
+def test_plot_heatmap_limits(tmp_path):
+    plot = Plot(data_only=True)
+    matrix = Matrix(None, None, plot)
+    matrix.plot_heatmap(_distance_df(4), str(tmp_path / "small.png"), annot_limit=4)
+    matrix.plot_heatmap(_distance_df(6), str(tmp_path / "large.png"), annot_limit=4,
+                        overview_limit=3)
+    assert [(job["output_plot_fpath"], job["kwargs"]["annot"]) for job in plot.queue] == [
+        (str(tmp_path / "small.png"), True),
+        (str(tmp_path / "large.png"), False),
+        (str(tmp_path / "large_overview.png"), False),
+    ]
+    assert plot.queue[2]["data"]["values"].shape == (3, 3)
+    assert plot.queue[2]["data"]["labels"] is None
+
+
+def test_run_writes_heatmap(tmp_path, monkeypatch):
+    plot = Plot(data_only=True)
+    matrix = Matrix(None, None, plot, annot_limit=1)
+    alleles = {"S0": [1, 2, 3], "S1": [1, 2, 4], "S2": [2, 2, 4]}
+    monkeypatch.setattr(matrix, "get_cgviz_cgmlst_data", lambda sample_id: [1, 2, 3])
+    monkeypatch.setattr(matrix, "get_jasen_cgmlst_data", alleles.get)
+    input_files = [str(tmp_path / f"{sample_id}_result.json") for sample_id in alleles]
+    matrix.run(input_files, [str(tmp_path / "out.csv")])
+    assert [job["kind"] for job in plot.queue] == ["heatmap", "matrix_boxplot"]
+    assert plot.queue[0]["output_plot_fpath"] == str(tmp_path / "cgviz_vs_jasen_heatmap.png")
+    assert plot.queue[0]["data"]["labels"] == ["S0", "S1", "S2"]
+    assert not plot.queue[0]["kwargs"]["annot"]
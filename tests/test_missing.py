@@ -0,0 +1,254 @@
+"""Tests for identify-missing helpers."""
+import os
+import json
+
+import pytest
+
+from jasentool.missing import Missing
+from jasentool.inventory import Inventory
+from jasentool.restore import Restore
+from jasentool.sample_sheet import SampleRecord
+from jasentool.stat_cache import StatCache
+from jasentool.utils import Utils
+
+
+@pytest.fixture()
+def basecalls_dir(tmp_path):
+    """Create a BaseCalls directory with a few read files and return its path."""
+    basecalls = tmp_path / "run" / "Data" / "Intensities" / "BaseCalls"
+    basecalls.mkdir(parents=True)
+    for name in ["S1_R1_001.fastq.gz", "S1_R2_001.fastq.gz", "S10_R1_001.fastq.gz",
+                 "S2.spring", "S2.spring~", "Undetermined_R1_001.fastq.gz"]:
+        (basecalls / name).write_text("")
+    return basecalls
+
+
+def test_find_prefixed_files(basecalls_dir, tmp_path):
+    Missing.initialize(tmp_path / "cache")
+    parent_dir = f"{basecalls_dir}/"
+    assert Missing.find_prefixed_files("S1_", parent_dir) == [
+        f"{parent_dir}S1_R1_001.fastq.gz", f"{parent_dir}S1_R2_001.fastq.gz"
+    ]
+    assert Missing.find_prefixed_files("S2", parent_dir) == [f"{parent_dir}S2.spring"]
+    assert Missing.find_files(r"\.spring$", parent_dir) == [f"{parent_dir}S2.spring"]
+    assert Missing.find_prefixed_files("S1", str(tmp_path / "absent")) == []
+
+
+def test_dir_index_persisted_by_mtime(basecalls_dir, tmp_path):
+    Missing.initialize(tmp_path / "cache")
+    assert len(Missing.find_prefixed_files("S1", str(basecalls_dir))) == 3
+    Missing.save_cache()
+    assert (tmp_path / "cache" / "dir_index.json").exists()
+
+    Missing.initialize(tmp_path / "cache")
+    (basecalls_dir / "S1_R3_001.fastq.gz").write_text("")
+    assert len(Missing.find_prefixed_files("S1", str(basecalls_dir))) == 4
+
+
+def test_run_resolver_cache(tmp_path):
+    run_dir = tmp_path / "230101_RUN1"
+    Missing.initialize(tmp_path / "cache")
+    assert Missing.check_format(str(run_dir)) == str(run_dir)
+    Missing.save_cache()
+
+    (run_dir / "Data" / "Intensities" / "BaseCalls").mkdir(parents=True)
+    Missing.initialize(tmp_path / "cache")
+    entry = Missing.run_resolver.locations[str(run_dir)]
+    assert not entry["found"]
+    assert Missing.check_format(str(run_dir)) == str(run_dir)
+
+    Missing.initialize(tmp_path / "cache", unresolved_ttl=0)
+    assert Missing.check_format(str(run_dir)) == str(run_dir)
+    assert Missing.run_resolver.locations[str(run_dir)]["found"]
+
+
+def test_parse_sample_sheet(tmp_path):
+    run_dir = tmp_path / "230101_RUN1"
+    basecalls = run_dir / "Data" / "Intensities" / "BaseCalls"
+    basecalls.mkdir(parents=True)
+    for name in ["ABCD123_S1_R1_001.fastq.gz", "ABCD123_S1_R2_001.fastq.gz", "EFGH456.spring"]:
+        (basecalls / name).write_text("")
+    sample_sheet = run_dir / "SampleSheet.csv"
+    sample_sheet.write_text(
+        "Sample_ID,Description\n"
+        "ABCD123_G1,lane_S1_saureus\n"
+        "EFGH456_G2,lane_S2_saureus\n"
+        "IJKL789_G3,lane_S3_ecoli\n"
+    )
+    restore_dir = str(tmp_path / "restored")
+    id_seqrun_dict = {"S1": "230101_RUN1", "S2": "230101_RUN1", "S3": "230101_RUN1"}
+    Missing.initialize(tmp_path / "cache")
+    csv_dict = Missing.parse_sample_sheet(str(sample_sheet), restore_dir, id_seqrun_dict)
+    assert list(csv_dict) == ["S1", "S2"]
+    assert csv_dict["S1"][:4] == ("ABCD123", "G1", "saureus", "230101_RUN1")
+    assert csv_dict["S1"].reads == [f"{restore_dir}/ABCD123_S1_R1_001.fastq.gz",
+                                    f"{restore_dir}/ABCD123_S1_R2_001.fastq.gz"]
+    assert csv_dict["S1"].spring is None
+    assert csv_dict["S2"].spring == [f"{basecalls}/EFGH456.spring"]
+    assert csv_dict["S2"].restored == f"{restore_dir}/EFGH456.spring"
+    Missing.save_cache()
+
+    Missing.initialize(tmp_path / "cache")
+    assert str(sample_sheet) in Missing.sample_sheets.parsed
+    assert Missing.parse_sample_sheet(str(sample_sheet), restore_dir, id_seqrun_dict) == csv_dict
+
+
+def test_inventory_missing_samples(tmp_path):
+    analysis_dir = tmp_path / "analysis"
+    analysis_dir.mkdir()
+    (analysis_dir / "S1_result.json").write_text("{}")
+    with Inventory(str(tmp_path / "inventory.sqlite")) as inventory:
+        inventory.update_samples([{"id": "S2", "run": "RUN2"}, {"id": "S1", "run": "RUN1"},
+                                  {"id": "S3", "run": "RUN1"}])
+        inventory.update_results(str(analysis_dir))
+        assert inventory.missing_samples(str(analysis_dir)) == ["S3", "S2"]
+
+        (analysis_dir / "S3_result.json").write_text("{}")
+        inventory.update_results(str(analysis_dir))
+        inventory.update_samples([{"id": "S2", "run": "RUN2"}, {"id": "S3", "run": "RUN1"}])
+        assert inventory.missing_samples(str(analysis_dir)) == ["S2"]
+
+
+def test_inventory_records_reads_and_checks_runs_through_stat_cache(tmp_path):
+    run_dir = tmp_path / "RUN1"
+    run_dir.mkdir()
+    stat_cache = StatCache()
+    inventory = Inventory(str(tmp_path / "inventory.sqlite"), stat_cache)
+    inventory.update_samples([{"id": "S1", "run": "RUN1"}, {"id": "S2", "run": "RUN2"}])
+    inventory.update_runs({"RUN1": str(run_dir), "RUN2": str(tmp_path / "RUN2")})
+    assert inventory.run_dirs() == {"RUN1": str(run_dir)}
+    assert set(stat_cache.results) == {str(run_dir), str(tmp_path / "RUN2")}
+    inventory.update_reads({
+        "S1": SampleRecord("LIMS1", "G1", "saureus", "RUN1", ["/restore/S1_R1.fastq.gz"],
+                           ["/backup/S1.spring"], "/restore/S1.spring"),
+        "S2": SampleRecord("LIMS2", "G1", "saureus", "RUN2", ["/restore/S2_R1.fastq.gz"], None,
+                           ["/backup/S2_R1.fastq.gz"]),
+    })
+    assert inventory.read_files("S1") == ["/restore/S1_R1.fastq.gz"]
+    assert inventory.read_files("S1", "backup") == ["/backup/S1.spring"]
+    assert inventory.read_files("S2", "backup") == ["/backup/S2_R1.fastq.gz"]
+    inventory.update_samples([{"id": "S1", "run": "RUN1"}])
+    assert inventory.read_files("S2") == []
+    inventory.close()
+
+
+def test_inventory_switches_sample_naming(tmp_path):
+    analysis_dir = tmp_path / "analysis"
+    analysis_dir.mkdir()
+    (analysis_dir / "LIMS1_result.json").write_text('{"sample_name": "S1"}')
+    other_dir = tmp_path / "other"
+    other_dir.mkdir()
+    (other_dir / "S2_result.json").write_text('{"sample_name": "LIMS2"}')
+    samples = [{"id": "S1", "run": "RUN1"}, {"id": "LIMS1", "run": "RUN1"}, {"id": "S2", "run": "RUN1"}]
+    db_fpath = str(tmp_path / "inventory.sqlite")
+    Missing.initialize()
+
+    inventory = Inventory(db_fpath)
+    inventory.update_samples(samples)
+    inventory.update_results(str(analysis_dir), Missing.result_index.index(str(analysis_dir), Missing.get_sample_name))
+    inventory.update_results(str(other_dir))
+    assert inventory.missing_samples(str(analysis_dir), alter_sample_id=True) == ["LIMS1", "S2"]
+    inventory.close()
+
+    inventory = Inventory(db_fpath)
+    inventory.update_results(str(analysis_dir))
+    assert inventory.missing_samples(str(analysis_dir)) == ["S1", "S2"]
+    assert inventory.missing_samples(str(other_dir)) == ["LIMS1", "S1"]
+    assert inventory.missing_samples(str(analysis_dir), alter_sample_id=True) == ["LIMS1", "S2"]
+    inventory.close()
+
+
+def test_find_missing_reuses_known_run_dirs(tmp_path, basecalls_dir, monkeypatch):
+    resolved = []
+    monkeypatch.setattr(Missing, "check_format", staticmethod(lambda run: resolved.append(run) or run))
+    Missing.initialize()
+    meta_dict = [{"id": "S1", "run": "RUN1"}, {"id": "S2", "run": "RUN2"}]
+    known = {"RUN1": str(tmp_path / "run")}
+    _, _, run_dirs = Missing.find_missing(meta_dict, [], str(tmp_path / "restored"), known_run_dirs=known)
+    assert resolved == ["RUN2"]
+    assert run_dirs == {"RUN1": str(tmp_path / "run"), "RUN2": "RUN2"}
+
+
+def test_create_bash_script_throttled(tmp_path):
+    small, large = tmp_path / "S1.spring", tmp_path / "S2.spring"
+    small.write_bytes(b"0" * 10)
+    large.write_bytes(b"0" * 100)
+    restore_dir = str(tmp_path / "restored")
+    csv_dict = {
+        sample: SampleRecord("LIMS", "G1", "saureus", "RUN",
+                             [f"{restore_dir}/{sample}_R1.fastq.gz", f"{restore_dir}/{sample}_R2.fastq.gz"],
+                             [str(spring)], f"{restore_dir}/{sample}.spring")
+        for sample, spring in (("S1", small), ("S2", large))
+    }
+    Missing.initialize()
+    assert [job.sample_id for job in Missing.restore_jobs(csv_dict, restore_dir)] == ["S2", "S1"]
+    bash_script = Missing.create_bash_script(csv_dict, restore_dir, max_jobs=2, retries=3)
+    assert "MAX_JOBS=2\nRETRIES=3\n" in bash_script
+    assert bash_script.count("throttle\n(") == 2
+    assert bash_script.index(str(large)) < bash_script.index(str(small))
+    assert f"retry /fs2/sw/bnf-scripts/jcp {large} {restore_dir}/ && retry /fs2/sw/bnf-scripts/unspring_file.pl" in bash_script
+
+
+def test_restore_execute_resumes(tmp_path):
+    backup = tmp_path / "backup"
+    backup.mkdir()
+    for name in ["S1_R1.fastq.gz", "S1_R2.fastq.gz"]:
+        (backup / name).write_bytes(b"0" * 100)
+    restore_dir = str(tmp_path / "restored")
+    csv_dict = {"S1": SampleRecord("LIMS", "G1", "saureus", "RUN", [], None,
+                                   [str(backup / "S1_R1.fastq.gz"), str(backup / "S1_R2.fastq.gz"),
+                                    str(backup / "S1_R3.fastq.gz")])}
+    state_fpath = str(tmp_path / "restore_state.json")
+    Missing.initialize()
+    jobs = Missing.restore_jobs(csv_dict, restore_dir)
+    assert Restore(workers=2, state_fpath=state_fpath).run(jobs) == 1
+    assert (tmp_path / "restored" / "S1_R1.fastq.gz").read_bytes() == b"0" * 100
+
+    (backup / "S1_R3.fastq.gz").write_bytes(b"0")
+    restore = Restore(workers=2, state_fpath=state_fpath)
+    assert len(restore.done) == 2
+    assert restore.run(jobs) == 0
+    assert sorted(os.listdir(restore_dir)) == ["S1_R1.fastq.gz", "S1_R2.fastq.gz", "S1_R3.fastq.gz"]
+
+
+def test_parse_dir_alter_sample_id(tmp_path):
+    analysis_dir = tmp_path / "analysis"
+    analysis_dir.mkdir()
+    (analysis_dir / "a_result.json").write_text('{"sample_name": "S1_RUN1", "qc": [{"sample_name": "x"}]}')
+    (analysis_dir / "b_result.json").write_text('{"run": "RUN2", "sample_name": "S2\\u00e5"}')
+    (analysis_dir / "c_result.json").write_text('{"run": "RUN3"}')
+    Missing.initialize(tmp_path / "cache")
+    assert sorted(Missing.parse_dir(str(analysis_dir), True)) == ["S1_RUN1", "S2å"]
+    Missing.save_cache()
+
+    Missing.initialize(tmp_path / "cache")
+    (analysis_dir / "c_result.json").write_text('{"run": "RUN3", "sample_name": "S3_RUN3"}')
+    os.utime(analysis_dir / "c_result.json", ns=(0, 10 ** 9))
+    assert sorted(Missing.parse_dir(str(analysis_dir), True)) == ["S1_RUN1", "S2å", "S3_RUN3"]
+    assert Missing.result_index.indexed[str(analysis_dir)]["a_result.json"][1] == "S1_RUN1"
+
+
+def test_get_sample_name_skips_nested_keys(tmp_path):
+    json_fpath = tmp_path / "a_result.json"
+    json_fpath.write_text(json.dumps({
+        "qc": [{"sample_name": "nested", "note": '"sample_name": "quoted"'}],
+        "meta": {"sample_name": "nested2", "x": "{"},
+        "sample_name": "S1\u00e5",
+    }))
+    assert Missing.get_sample_name(str(json_fpath)) == "S1\u00e5"
+    assert Missing.get_sample_name(str(json_fpath), chunk_size=3) == "S1\u00e5"
+    json_fpath.write_text('{"qc": {"sample_name": "nested"}, "sample_name": null}')
+    assert Missing.get_sample_name(str(json_fpath)) is None
+    json_fpath.write_text('{"qc": {"sample_name": "nested"}}')
+    assert Missing.get_sample_name(str(json_fpath)) is None
+
+
+def test_write_out_csv(tmp_path):
+    csv_dict = {"S1": SampleRecord("ABCD123", "G1", "saureus", "230101_RUN1", ["r1.fastq.gz", "r2.fastq.gz"],
+                                   None, ["b1.fastq.gz", "b2.fastq.gz"])}
+    out_fpath = tmp_path / "samples.csv"
+    Utils.write_out_csv(csv_dict, "jasen-saureus-dev", "illumina", out_fpath, alter_sample_id=True)
+    assert out_fpath.read_text().splitlines() == [
+        "id,clarity_sample_id,sample_name,group,species,assay,platform,sequencing_run,read1,read2",
+        "abcd123_230101_run1,ABCD123,S1,G1,saureus,jasen-saureus-dev,illumina,230101_RUN1,r1.fastq.gz,r2.fastq.gz",
+    ]
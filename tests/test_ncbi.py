@@ -0,0 +1,60 @@
+"""Tests for the NCBI download scheduler."""
+import types
+import zipfile
+
+from jasentool.ncbi import NCBI
+from jasentool.utils import Utils
+
+
+def test_ncbi_skips_verified_accessions(tmp_path):
+    options = types.SimpleNamespace(accession=["GCF_1", "GCF_2"], output_dir=str(tmp_path),
+                                    bwa_index=False, fai_index=False, clean=False, bgzip=True,
+                                    workers=2, index_workers=1)
+    ncbi = NCBI(options)
+    downloaded = []
+
+    def download(url, zip_path, max_retries=3):
+        accn = url.split("/accession/")[1].split("/")[0]
+        downloaded.append(accn)
+        with zipfile.ZipFile(zip_path, "w") as zip_object:
+            zip_object.writestr(f"ncbi_dataset/data/{accn}/{accn}_genomic.fna", ">chr1\nACGTACGT\n")
+            zip_object.writestr(f"ncbi_dataset/data/{accn}/genomic.gff", "##gff-version 3\n")
+        return True
+
+    ncbi.downloader.download = download
+    ncbi.run()
+    assert sorted(downloaded) == ["GCF_1", "GCF_2"]
+    for accn in ("GCF_1", "GCF_2"):
+        for ext in (".fasta.gz", ".fasta.gz.fai", ".fasta.gz.gzi", ".gff", ".sha256"):
+            assert (tmp_path / f"{accn}{ext}").exists()
+    assert not (tmp_path / "GCF_1.zip").exists()
+
+    (tmp_path / "GCF_2.gff").write_text("truncated")
+    ncbi.run()
+    assert sorted(downloaded) == ["GCF_1", "GCF_2", "GCF_2"]
+    assert (tmp_path / "GCF_2.gff").read_text() == "##gff-version 3\n"
+
+    (tmp_path / "GCF_1.sha256").write_text("truncated")
+    ncbi.run()
+    assert sorted(downloaded) == ["GCF_1", "GCF_1", "GCF_2", "GCF_2"]
+
+
+def test_ncbi_fails_accession_on_extraction_failure(tmp_path, monkeypatch):
+    options = types.SimpleNamespace(accession=["GCF_1"], output_dir=str(tmp_path),
+                                    bwa_index=False, fai_index=False, clean=False, bgzip=False,
+                                    workers=1, index_workers=1)
+    ncbi = NCBI(options)
+    downloaded = []
+
+    def download(url, zip_path, max_retries=3):
+        downloaded.append(url)
+        with zipfile.ZipFile(zip_path, "w") as zip_object:
+            zip_object.writestr("ncbi_dataset/data/GCF_1/GCF_1_genomic.fna", ">chr1\nACGTACGT\n")
+        return True
+
+    ncbi.downloader.download = download
+    monkeypatch.setattr(Utils, "extract_members", staticmethod(lambda *args, **kwargs: False))
+    ncbi.run()
+    assert not (tmp_path / "GCF_1.sha256").exists()
+    ncbi.run()
+    assert len(downloaded) == 2
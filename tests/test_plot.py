@@ -0,0 +1,47 @@
+"""Tests for queued, headless plot rendering."""
+import json
+import shutil
+
+import numpy as np
+
+from jasentool.plot import Plot
+
+
+def _queue_plots(plot, out_dir):
+    plot.plot_barplot({"a": 2000, "b": 3000, "c": 5}, str(out_dir / "bar.png"), "x", "y", "Bars")
+    plot.plot_boxplot({"S1": 10, "S2": 200}, str(out_dir / "box.png"), "x", "Boxes", 100)
+    values = np.array([[0.0, 1.0], [np.nan, -2.0]])
+    plot.plot_heatmap(values, None, str(out_dir / "heat.png"), "Heat", "Jasen", "Cgviz")
+
+
+def test_render_with_workers(tmp_path):
+    plot = Plot(dpi=50, fmt="svg", workers=2)
+    _queue_plots(plot, tmp_path)
+    assert [job["output_plot_fpath"] for job in plot.queue] == [
+        str(tmp_path / "bar.svg"), str(tmp_path / "box.svg"), str(tmp_path / "heat.svg")
+    ]
+    rendered = plot.render()
+    assert rendered == [str(tmp_path / f"{name}.svg") for name in ("bar", "box", "heat")]
+    assert all((tmp_path / f"{name}.svg").stat().st_size > 0 for name in ("bar", "box", "heat"))
+    assert not plot.queue
+    assert plot.render() == []
+
+
+def test_data_only_round_trip(tmp_path):
+    plot = Plot(data_only=True)
+    _queue_plots(plot, tmp_path)
+    data_fpaths = plot.render()
+    assert data_fpaths == [str(tmp_path / f"{name}.plot.json") for name in ("bar", "box", "heat")]
+    assert not list(tmp_path.glob("*.png"))
+    heatmap_job = json.loads((tmp_path / "heat.plot.json").read_text())
+    assert heatmap_job["kind"] == "heatmap" and heatmap_job["data"]["labels"] is None
+
+    moved_dir = tmp_path / "moved"
+    moved_dir.mkdir()
+    for data_fpath in data_fpaths:
+        shutil.move(data_fpath, moved_dir)
+    renderer = Plot(dpi=50, fmt="pdf", workers=2)
+    assert renderer.render_data_file(str(moved_dir / "heat.plot.json")) == str(moved_dir / "heat.pdf")
+    rendered = renderer.render_data_files(sorted(str(fpath) for fpath in moved_dir.glob("*.plot.json")))
+    assert rendered == [str(moved_dir / f"{name}.pdf") for name in ("bar", "box", "heat")]
+    assert all((moved_dir / f"{name}.pdf").stat().st_size > 0 for name in ("bar", "box", "heat"))
@@ -0,0 +1,132 @@
+"""Tests for post-align-qc against pysam flagstat and pileup."""
+import json
+import os
+import random
+import types
+
+import numpy as np
+import pysam
+import pytest
+
+from jasentool import qc
+from jasentool.qc import QC
+
+REFERENCES = [("chr1", 20000), ("chr2", 3000)]
+CIGARS = ["100M", "10S90M", "50M5D50M", "40M200N60M", "30M2I68M", "95M5S", "3H100M"]
+
+
+def _read(rng, name, flag, tid=-1, pos=-1, cigar=None, tlen=0):
+    read = pysam.AlignedSegment()
+    read.query_name = name
+    read.flag = flag
+    read.reference_id = tid
+    read.reference_start = pos
+    read.next_reference_id = tid
+    read.next_reference_start = pos
+    read.template_length = tlen
+    read.mapping_quality = 60
+    if cigar:
+        read.cigarstring = cigar
+    read.query_sequence = "".join(rng.choice("ACGT") for _ in range(read.infer_query_length() or 50))
+    read.query_qualities = pysam.qualitystring_to_array("I" * len(read.query_sequence))
+    return read
+
+
+@pytest.fixture()
+def qc_bam(tmp_path):
+    """Write a coordinate-sorted paired-end BAM with clips, indels, duplicates and unmapped reads."""
+    rng = random.Random(3)
+    reads = []
+    for idx in range(1500):
+        tid = int(idx >= 1200)
+        pos = rng.randrange(0, REFERENCES[tid][1] - 400)
+        ins = rng.randrange(150, 400)
+        flag = 1 | 2 | 32 | 64 | (1024 if rng.random() < 0.05 else 0) | (512 if rng.random() < 0.01 else 0)
+        reads.append(_read(rng, f"r{idx}", flag, tid, pos, rng.choice(CIGARS), ins))
+        reads.append(_read(rng, f"r{idx}", 1 | 2 | 16 | 128, tid, pos + ins - 100, "100M", -ins))
+        if rng.random() < 0.05:
+            reads.append(_read(rng, f"r{idx}", 1 | 64 | 256, tid, rng.randrange(0, 2000), "60M"))
+            reads.append(_read(rng, f"r{idx}", 1 | 64 | 2048, tid, rng.randrange(0, 2000), "60M40H"))
+    for idx in range(20):
+        pos = rng.randrange(0, 19000)
+        reads.append(_read(rng, f"u{idx}", 1 | 8 | 64, 0, pos, "100M"))
+        reads.append(_read(rng, f"u{idx}", 1 | 4 | 128, 0, pos))
+    reads.sort(key=lambda read: (read.reference_id, read.reference_start))
+    reads += [_read(rng, f"x{idx}", 1 | 4 | 8 | (64 if idx % 2 else 128)) for idx in range(10)]
+    bam_fpath = str(tmp_path / "sample.bam")
+    header = {"HD": {"VN": "1.6", "SO": "coordinate"},
+              "SQ": [{"SN": name, "LN": length} for name, length in REFERENCES]}
+    with pysam.AlignmentFile(bam_fpath, "wb", header=header) as bam:
+        for read in reads:
+            bam.write(read)
+    pysam.index(bam_fpath)
+    bed_fpath = tmp_path / "regions.bed"
+    bed_fpath.write_text("chr1\t0\t1000\nchr1\t9900\t10500\nchr1\t10400\t10600\nchr2\t100\t2900\n")
+    return bam_fpath, str(bed_fpath)
+
+
+def _expected(bam_fpath, regions):
+    """Return flagstat counts, insert sizes and pileup depths the way samtools reports them."""
+    counts = {}
+    for line in pysam.flagstat(bam_fpath).splitlines():
+        count = int(line.split(" + ")[0])
+        for key, label in (("n_reads", "in total"), ("n_dup_reads", "primary duplicates"),
+                           ("n_mapped_reads", "primary mapped"), ("n_read_pairs", "read1")):
+            if label in line and key not in counts:
+                counts[key] = count
+    with pysam.AlignmentFile(bam_fpath, "rb") as bam:
+        insert_sizes = [read.template_length for read in bam
+                        if read.is_read1 and read.is_proper_pair and read.template_length > 0]
+        depths = []
+        for chrom, start, end in regions:
+            region_cov = np.zeros(end - start, dtype=np.int32)
+            for col in bam.pileup(chrom, start, end, truncate=True, min_base_quality=0, stepper="nofilter"):
+                region_cov[col.reference_pos - start] = col.nsegments
+            depths.append(region_cov)
+    return counts, insert_sizes, np.concatenate(depths)
+
+
+@pytest.mark.parametrize("cpus", [1, 3])
+@pytest.mark.parametrize("use_bed", [False, True])
+def test_post_align_qc_matches_flagstat_and_pileup(qc_bam, use_bed, cpus, monkeypatch):
+    monkeypatch.setattr(qc, "MIN_REGION_SIZE", 1000)
+    bam_fpath, bed_fpath = qc_bam
+    if use_bed:
+        regions = [(line.split("\t")[0], int(line.split("\t")[1]), int(line.split("\t")[2]))
+                   for line in open(bed_fpath, encoding="utf-8").read().splitlines()]
+    else:
+        regions = [(name, 0, length) for name, length in REFERENCES]
+    counts, insert_sizes, depths = _expected(bam_fpath, regions)
+    options = types.SimpleNamespace(bam=bam_fpath, bed=bed_fpath if use_bed else None, sample_id="S1", cpus=cpus)
+    result = json.loads(QC(options).run())
+
+    for key, count in counts.items():
+        assert result[key] == count
+    assert result["ins_size"] == round(float(np.median(insert_sizes)), 6)
+    assert result["ins_size_dev"] == round(float(np.std(insert_sizes)), 6)
+    assert result["mean_cov"] == float(np.mean(depths))
+    assert result["quartile1"] == float(np.percentile(depths, 25))
+    assert result["median_cov"] == float(np.median(depths))
+    assert result["quartile3"] == float(np.percentile(depths, 75))
+    for threshold, pct in result["pct_above_x"].items():
+        assert pct == round(100 * float(np.sum(depths >= int(threshold))) / len(depths), 6)
+
+
+def test_post_align_qc_single_cpu_does_not_index(qc_bam):
+    bam_fpath, _ = qc_bam
+    os.remove(f"{bam_fpath}.bai")
+    options = types.SimpleNamespace(bam=bam_fpath, bed=None, sample_id="S1", cpus=1)
+    result = json.loads(QC(options).run())
+    assert not os.path.exists(f"{bam_fpath}.bai")
+    assert result["mean_cov"] > 0
+
+
+@pytest.mark.parametrize("n_bases", [1, 2, 7, 10, 1001, 1002])
+def test_coverage_stats_match_numpy(n_bases):
+    depths = np.random.default_rng(n_bases).integers(0, 40, n_bases)
+    mean_cov, q1, median_cov, q3, above_pct = QC.coverage_stats(np.bincount(depths), [1, 10, 30, 100])
+    assert mean_cov == float(np.mean(depths))
+    assert q1 == float(np.percentile(depths, 25))
+    assert median_cov == float(np.median(depths))
+    assert q3 == float(np.percentile(depths, 75))
+    assert above_pct == {t: round(100 * float(np.sum(depths >= t)) / n_bases, 6) for t in [1, 10, 30, 100]}
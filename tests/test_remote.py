@@ -0,0 +1,104 @@
+"""Tests for the multiplexed remote session using local ssh/scp stand-ins."""
+import os
+import sys
+import stat
+import time
+
+from jasentool.remote import RemoteSession
+from jasentool.utils import Utils
+
+FAKE_SSH = """#!{python}
+import os, subprocess, sys
+with open(os.environ["FAKE_SSH_LOG"], "a") as log:
+    log.write(" ".join(sys.argv) + "\\n")
+args = sys.argv[1:]
+if "-M" in args and os.environ.get("FAKE_SSH_NO_MASTER"):
+    sys.exit(255)
+if "-M" in args or "-O" in args:
+    sys.exit(0)
+idx = 0
+while args[idx].startswith("-"):
+    idx += 2 if args[idx] == "-o" else 1
+sys.exit(subprocess.run(" ".join(args[idx + 1:]), shell=True).returncode)
+"""
+
+FAKE_SCP = """#!{python}
+import os, shutil, sys
+with open(os.environ["FAKE_SSH_LOG"], "a") as log:
+    log.write(" ".join(sys.argv) + "\\n")
+args = [arg for idx, arg in enumerate(sys.argv[1:]) if arg != "-o" and sys.argv[idx] != "-o"]
+for fpath in args[:-1]:
+    shutil.copy(fpath, args[-1].split(":", 1)[1])
+"""
+
+
+def _write_script(fpath, content):
+    fpath.write_text(content.format(python=sys.executable))
+    fpath.chmod(fpath.stat().st_mode | stat.S_IEXEC)
+    return str(fpath)
+
+
+def _wait_for(fpaths, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not all(os.path.exists(fpath) for fpath in fpaths) and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def _batch_files(tmp_path, remote_dir):
+    batch_files = []
+    for assay in ("saureus", "ecoli", "unknown"):
+        batch_file = tmp_path / f"{assay}.sh"
+        batch_file.write_text(f"echo {assay}\ntouch {remote_dir}/{assay}.started\n")
+        batch_files.append(str(batch_file))
+    csv_file = tmp_path / "samples.csv"
+    csv_file.write_text("id\n")
+    return batch_files, [str(csv_file)]
+
+
+def test_remote_session_multiplexes_copy_and_launch(tmp_path, monkeypatch):
+    log_fpath = tmp_path / "ssh.log"
+    monkeypatch.setenv("FAKE_SSH_LOG", str(log_fpath))
+    ssh = _write_script(tmp_path / "ssh", FAKE_SSH)
+    scp = _write_script(tmp_path / "scp", FAKE_SCP)
+    remote_dir = tmp_path / "remote"
+    batch_files, csv_files = _batch_files(tmp_path, remote_dir)
+
+    with RemoteSession("remote-host", ssh=ssh, scp=scp) as session:
+        control_path = session.control_path
+        Utils.copy_batch_and_csv_files(batch_files, csv_files, str(remote_dir), "remote-host", True, session)
+        Utils.start_remote_pipelines(batch_files, "remote-host", str(remote_dir), session)
+
+    started = [remote_dir / f"{assay}.started" for assay in ("saureus", "ecoli")]
+    _wait_for(started)
+    assert all(os.path.exists(fpath) for fpath in started)
+    assert not (remote_dir / "unknown.started").exists()
+    assert (remote_dir / "ecoli.sh.log").read_text() == "ecoli\n"
+    calls = log_fpath.read_text().splitlines()
+    assert len(calls) == 6
+    assert " -M " in calls[0] and sum(" -M " in call for call in calls) == 1
+    assert all(f"ControlPath={control_path}" in call for call in calls)
+    assert all(" nohup bash " in call for call in calls[3:5])
+    assert " -O exit " in calls[-1]
+    assert not os.path.exists(os.path.dirname(control_path))
+
+
+def test_remote_session_falls_back_to_plain_ssh(tmp_path, monkeypatch):
+    log_fpath = tmp_path / "ssh.log"
+    monkeypatch.setenv("FAKE_SSH_LOG", str(log_fpath))
+    monkeypatch.setenv("FAKE_SSH_NO_MASTER", "1")
+    ssh = _write_script(tmp_path / "ssh", FAKE_SSH)
+    scp = _write_script(tmp_path / "scp", FAKE_SCP)
+    remote_dir = tmp_path / "remote"
+    batch_files, csv_files = _batch_files(tmp_path, remote_dir)
+
+    with RemoteSession("remote-host", ssh=ssh, scp=scp) as session:
+        assert session.control_path is None
+        Utils.copy_batch_and_csv_files(batch_files, csv_files, str(remote_dir), "remote-host", True, session)
+        Utils.start_remote_pipelines(batch_files, "remote-host", str(remote_dir), session)
+
+    _wait_for([remote_dir / "saureus.started", remote_dir / "ecoli.started"])
+    assert (remote_dir / "saureus.started").exists() and (remote_dir / "ecoli.started").exists()
+    calls = log_fpath.read_text().splitlines()
+    assert len(calls) == 5
+    assert not any("ControlPath" in call for call in calls[1:])
+    assert not any(" -O exit " in call for call in calls)
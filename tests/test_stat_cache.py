@@ -0,0 +1,73 @@
+"""Tests for the memoized, concurrent stat layer."""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from jasentool.missing import Missing
+from jasentool.stat_cache import StatCache
+
+
+@pytest.fixture()
+def stat_calls(monkeypatch):
+    """Record (path, thread name) of every stat made by StatCache."""
+    calls = []
+    stat = StatCache._stat
+
+    def record_stat(path):
+        calls.append((path, threading.current_thread().name))
+        return stat(path)
+
+    monkeypatch.setattr(StatCache, "_stat", staticmethod(record_stat))
+    return calls
+
+
+def test_stat_cache_hits(tmp_path, stat_calls):
+    fpath = tmp_path / "reads.fastq.gz"
+    fpath.write_bytes(b"x" * 10)
+    stat_cache = StatCache(workers=4)
+    assert stat_cache.exists(fpath) and not stat_cache.isdir(fpath)
+    assert stat_cache.getsize(str(fpath)) == 10
+    assert not stat_cache.exists(tmp_path / "absent")
+    with pytest.raises(FileNotFoundError):
+        stat_cache.getsize(tmp_path / "absent")
+    stat_cache.prefetch([fpath, tmp_path / "absent", tmp_path])
+    assert [path for path, _ in stat_calls] == [str(fpath), str(tmp_path / "absent"), str(tmp_path)]
+    assert stat_cache.isdir(tmp_path)
+    stat_cache.close()
+
+
+def test_stat_cache_sees_mtime_change_in_next_invocation(tmp_path):
+    fpath = tmp_path / "reads.fastq.gz"
+    fpath.write_bytes(b"x")
+    Missing.initialize()
+    first = Missing.stat_cache.stat(fpath)
+    fpath.write_bytes(b"xx")
+    os.utime(fpath, ns=(first.st_atime_ns, first.st_mtime_ns + 10 ** 9))
+    assert Missing.stat_cache.stat(fpath) is first
+    Missing.initialize()
+    assert Missing.stat_cache.stat(fpath).st_mtime_ns == first.st_mtime_ns + 10 ** 9
+    assert Missing.stat_cache.getsize(fpath) == 2
+
+
+def test_nested_prefetch_shares_one_pool(tmp_path, stat_calls):
+    stat_cache = StatCache(workers=3)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(
+            lambda idx: stat_cache.prefetch(tmp_path / f"{idx}_{path}" for path in range(10)), range(8)
+        ))
+    assert len(stat_calls) == 80
+    assert len({name for _, name in stat_calls}) <= 3
+    assert all(name.startswith("stat") for _, name in stat_calls)
+    stat_cache.close()
+
+
+def test_resolve_run_dirs_prefetches_once(tmp_path, stat_calls):
+    runs = [str(tmp_path / f"23010{idx}_RUN{idx}") for idx in range(5)]
+    os.makedirs(os.path.join(runs[0], "Data/Intensities/BaseCalls"))
+    Missing.initialize(workers=4)
+    run_dirs = Missing.resolve_run_dirs(runs)
+    assert run_dirs == {run: run for run in runs}
+    assert len(stat_calls) == len({path for path, _ in stat_calls}) == 5 * 4
+    assert all(name.startswith("stat") for _, name in stat_calls)
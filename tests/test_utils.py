@@ -0,0 +1,217 @@
+"""Tests for the pooled HTTP downloader and download cache."""
+import os
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pysam
+import pytest
+
+from jasentool.download import Downloader, DownloadCache
+from jasentool.utils import Utils
+
+PAYLOAD = bytes(range(256)) * 1024
+PAYLOADS = {1: PAYLOAD, 2: PAYLOAD[::-1]}
+LAST_MODIFIED = "Mon, 05 Jan 2026 10:00:00 GMT"
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serve PAYLOADS[version], honouring If-Range and single byte ranges and failing /flaky once.
+
+    /badrange answers every range request with a range starting at byte 0 and /no-etag
+    only sends Last-Modified. Request headers and response codes are recorded.
+    """
+    requests_seen = []
+    headers_seen = []
+    responses_sent = []
+    flaky_failed = False
+    version = 1
+
+    def do_GET(self):
+        RangeHandler.requests_seen.append((self.path, self.headers.get("Range")))
+        RangeHandler.headers_seen.append(dict(self.headers))
+        if self.path == "/missing":
+            self.send_error(404)
+            return
+        if self.path == "/flaky" and not RangeHandler.flaky_failed:
+            RangeHandler.flaky_failed = True
+            self.send_error(503)
+            return
+        etag = f'"v{RangeHandler.version}"'
+        payload = PAYLOADS[RangeHandler.version]
+        if self.path == "/no-etag":
+            not_modified = self.headers.get("If-Modified-Since") == LAST_MODIFIED
+        else:
+            not_modified = self.headers.get("If-None-Match") == etag
+        if not_modified:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range", etag) == etag:
+            start = int(range_header.split("=")[1].rstrip("-"))
+            if start >= len(payload):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(payload)}")
+                self.end_headers()
+                return
+            start = 0 if self.path == "/badrange" else start
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(payload) - 1}/{len(payload)}")
+        else:
+            self.send_response(200)
+        if self.path == "/no-etag":
+            self.send_header("Last-Modified", LAST_MODIFIED)
+        else:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(payload) - start))
+        self.end_headers()
+        self.wfile.write(payload[start:])
+
+    def send_response(self, code, message=None):
+        RangeHandler.responses_sent.append(code)
+        super().send_response(code, message)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def http_server():
+    """Run a local HTTP server and return its base url."""
+    RangeHandler.requests_seen = []
+    RangeHandler.headers_seen = []
+    RangeHandler.responses_sent = []
+    RangeHandler.flaky_failed = False
+    RangeHandler.version = 1
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_resumes_partial_file(http_server, tmp_path):
+    out_fpath = tmp_path / "payload.bin"
+    (tmp_path / "payload.bin.part").write_bytes(PAYLOAD[:1000])
+    (tmp_path / "payload.bin.part.validator").write_text('"v1"')
+    assert Utils.download_and_save_file(f"{http_server}/file", str(out_fpath))
+    assert out_fpath.read_bytes() == PAYLOAD
+    assert RangeHandler.requests_seen == [("/file", "bytes=1000-")]
+    assert RangeHandler.headers_seen[0]["If-Range"] == '"v1"'
+    assert not (tmp_path / "payload.bin.part").exists()
+    assert not (tmp_path / "payload.bin.part.validator").exists()
+
+
+def test_download_restarts_changed_or_misranged_partial_file(http_server, tmp_path):
+    out_fpath = tmp_path / "payload.bin"
+    part_fpath = tmp_path / "payload.bin.part"
+    validator_fpath = tmp_path / "payload.bin.part.validator"
+    downloader = Downloader()
+    part_fpath.write_bytes(PAYLOAD[:1000])
+    assert downloader.download(f"{http_server}/file", str(out_fpath))
+    assert RangeHandler.requests_seen == [("/file", None)]
+
+    part_fpath.write_bytes(PAYLOAD[:1000])
+    validator_fpath.write_text('"v1"')
+    RangeHandler.version = 2
+    assert downloader.download(f"{http_server}/file", str(out_fpath))
+    assert out_fpath.read_bytes() == PAYLOADS[2]
+    assert RangeHandler.requests_seen[1:] == [("/file", "bytes=1000-")]
+    assert RangeHandler.headers_seen[1]["If-Range"] == '"v1"'
+
+    part_fpath.write_bytes(PAYLOADS[2][:1000])
+    validator_fpath.write_text('"v2"')
+    assert downloader.download(f"{http_server}/badrange", str(out_fpath))
+    assert out_fpath.read_bytes() == PAYLOADS[2]
+    assert RangeHandler.requests_seen[2:] == [("/badrange", "bytes=1000-"), ("/badrange", None)]
+
+    part_fpath.write_bytes(PAYLOADS[2] + b"extra")
+    validator_fpath.write_text('"v2"')
+    assert downloader.download(f"{http_server}/file", str(out_fpath))
+    assert out_fpath.read_bytes() == PAYLOADS[2]
+    assert RangeHandler.requests_seen[4:] == [("/file", f"bytes={len(PAYLOAD) + 5}-"), ("/file", None)]
+    assert not part_fpath.exists() and not validator_fpath.exists()
+
+
+def test_download_retries_and_gives_up(http_server, tmp_path, monkeypatch):
+    monkeypatch.setattr("jasentool.download.sleep", lambda _: None)
+    downloader = Downloader()
+    assert downloader.download(f"{http_server}/flaky", str(tmp_path / "flaky.bin"))
+    assert not downloader.download(f"{http_server}/missing", str(tmp_path / "missing.bin"))
+    assert [path for path, _ in RangeHandler.requests_seen] == ["/flaky", "/flaky", "/missing"]
+
+
+def test_download_many(http_server, tmp_path):
+    downloads = [(f"{http_server}/file{idx}", str(tmp_path / f"file{idx}.bin")) for idx in range(6)]
+    results = Downloader(workers=3).download_many(downloads + [(f"{http_server}/missing", str(tmp_path / "x"))])
+    assert [results[fpath] for _, fpath in downloads] == [True] * 6
+    assert not results[str(tmp_path / "x")]
+    assert all((tmp_path / f"file{idx}.bin").read_bytes() == PAYLOAD for idx in range(6))
+
+
+def test_download_cache_revalidates_and_serves_offline(http_server, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    downloader = Downloader(cache=DownloadCache(cache_dir))
+    url = f"{http_server}/tbdb.csv"
+    assert downloader.download(url, str(tmp_path / "first.csv"))
+    assert downloader.download(url, str(tmp_path / "second.csv"))
+    assert RangeHandler.requests_seen == [("/tbdb.csv", None), ("/tbdb.csv", None)]
+    assert "If-None-Match" not in RangeHandler.headers_seen[0]
+    assert RangeHandler.headers_seen[1]["If-None-Match"] == '"v1"'
+    assert RangeHandler.responses_sent == [200, 304]
+    assert (tmp_path / "second.csv").read_bytes() == PAYLOAD
+    entry = DownloadCache(cache_dir).entries[url]
+    assert entry["etag"] == '"v1"' and entry["size"] == len(PAYLOAD)
+    assert os.listdir(tmp_path / "cache" / "objects") == [entry["sha256"]]
+
+    offline = Downloader(cache=DownloadCache(cache_dir, offline=True))
+    assert offline.download(url, str(tmp_path / "third.csv"))
+    assert not offline.download(f"{http_server}/who.xlsx", str(tmp_path / "who.xlsx"))
+    assert len(RangeHandler.requests_seen) == 2
+    assert (tmp_path / "third.csv").read_bytes() == PAYLOAD
+
+    RangeHandler.version = 2
+    assert downloader.download(url, str(tmp_path / "fourth.csv"))
+    assert RangeHandler.responses_sent[2:] == [200]
+    assert (tmp_path / "fourth.csv").read_bytes() == PAYLOADS[2]
+    entry = DownloadCache(cache_dir).entries[url]
+    assert entry["etag"] == '"v2"'
+    assert os.listdir(tmp_path / "cache" / "objects") == [entry["sha256"]]
+
+
+def test_download_cache_revalidates_by_last_modified(http_server, tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"))
+    url = f"{http_server}/no-etag"
+    assert Downloader(cache=cache).download(url, str(tmp_path / "first.csv"))
+    assert Downloader(cache=cache).download(url, str(tmp_path / "second.csv"))
+    assert RangeHandler.headers_seen[1]["If-Modified-Since"] == LAST_MODIFIED
+    assert "If-None-Match" not in RangeHandler.headers_seen[1]
+    assert RangeHandler.responses_sent == [200, 304]
+    assert (tmp_path / "second.csv").read_bytes() == PAYLOAD
+
+
+def test_extract_members(tmp_path):
+    zip_fpath = tmp_path / "GCF_1.zip"
+    with zipfile.ZipFile(zip_fpath, "w") as zip_object:
+        zip_object.writestr("ncbi_dataset/data/GCF_1/GCF_1_genomic.fna", ">chr1\nACGTACGT\n>chr2\nGGGGCCCC\n")
+        zip_object.writestr("ncbi_dataset/data/GCF_1/genomic.gff", "##gff-version 3\n")
+    fasta_fpath, gff_fpath = str(tmp_path / "GCF_1.fasta.gz"), str(tmp_path / "GCF_1.gff")
+    assert Utils.zip_members(zip_fpath)[1] == "ncbi_dataset/data/GCF_1/genomic.gff"
+    assert Utils.extract_members(zip_fpath, {
+        "ncbi_dataset/data/GCF_1/GCF_1_genomic.fna": fasta_fpath,
+        "ncbi_dataset/data/GCF_1/genomic.gff": gff_fpath,
+    }, bgzip_members={"ncbi_dataset/data/GCF_1/GCF_1_genomic.fna"})
+    assert not (tmp_path / "ncbi_dataset").exists()
+    assert (tmp_path / "GCF_1.gff").read_text() == "##gff-version 3\n"
+    pysam.faidx(fasta_fpath)
+    with pysam.FastaFile(fasta_fpath) as fasta:
+        assert fasta.fetch("chr2") == "GGGGCCCC"
+    assert (tmp_path / "GCF_1.fasta.gz.gzi").exists()
+
+    (tmp_path / "bad.zip").write_bytes(b"not a zip")
+    assert Utils.zip_members(tmp_path / "bad.zip") is None
+    assert not Utils.extract_members(tmp_path / "bad.zip", {})
+    assert not Utils.extract_members(zip_fpath, {"ncbi_dataset/data/GCF_1/missing.fna": fasta_fpath})